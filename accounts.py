@@ -0,0 +1,157 @@
+import parameters
+import resilience
+import exchange
+import adapters
+import log
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+class SubAccount(exchange.Exchange):
+    '''
+    Trading account of a venue sub-account. Has its own adapter (api keys and http sessions), rate limit bucket, target
+    qty partition and inventory, and shares everything market data related (assets info, valid pairs, snapshots,
+    conversion rates, clock, ...) with the exchange it belongs to. The trade path works on it exactly like on the exchange.
+    '''
+    def __init__(self, parent, account_name, api_public, api_secret, passphrase):
+        self.parent = parent
+        self.account_name = account_name
+        self.name = parent.name
+        self.target_asset = parent.target_asset
+
+        self.adapter = adapters.get_adapter(self.name, api_public, api_secret, passphrase)
+        self.sync_symbols()
+        self.rate_limiter = resilience.RateLimiter(parameters.ACCOUNT_REQUESTS_PER_SECOND, parameters.ACCOUNT_REQUEST_BURST)
+
+        log.print_status("Sub-account '{}':".format(account_name))
+        self.trading_target_qty, self.reserve_target_qty = self.update_target_qty_partitions()
+        self.total_starting_target_qty = self.trading_target_qty + self.reserve_target_qty
+        self.total_starting_account_value = None
+
+        self.inventory = {}
+        self.inventory_drift = {}
+        self.rebalance_history = []
+        self.inventory_lock = threading.Lock()
+        self.rebalance_event = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.parent, name)  # market data state is shared with the parent exchange
+
+    def sync_symbols(self):
+        '''
+        Uses the parent's venue symbol lookups (swapped in whole on every symbol universe refresh).
+        '''
+        self.adapter.venue_symbols = self.parent.adapter.venue_symbols
+        self.adapter.stripped_symbols = self.parent.adapter.stripped_symbols
+
+
+class AccountPool():
+    '''
+    Dispatches trade plans across the exchange's main account and its sub-accounts. Each plan goes to a free account
+    with rate limit budget for a whole plan (PLAN_REQUEST_COST) and the most tradeable target qty, and runs on that
+    account's own worker thread, so plans on different accounts execute concurrently while the scan loop keeps going.
+    Results are handed back to the scan loop through 'get_finished', which is also when an account becomes free again.
+    '''
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.busy = {}  # account name -> pair being traded
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=len(accounts))
+
+        self.dispatched = {account.account_name: 0 for account in accounts}
+        self.no_account_skips = 0
+
+    def acquire(self, pair):
+        '''
+        @Returns
+        free account with budget and balance to trade 'pair' (its api budget is taken), or None. Pairs already being
+        traded on another account are not dispatched again.
+        '''
+        if pair in self.busy.values():
+            log.print_status("MSG: {} is already being traded on another account. Skipping opportunity.".format(pair))
+            self.no_account_skips += 1
+            return None
+
+        free = [account for account in self.accounts if account.account_name not in self.busy and account.trading_target_qty > 0]
+        for account in sorted(free, key=lambda account: account.trading_target_qty, reverse=True):
+            if account.rate_limiter.try_acquire(parameters.PLAN_REQUEST_COST):
+                self.busy[account.account_name] = pair
+                return account
+
+        log.print_status("MSG: No account with free api budget and balance. Skipping opportunity.")
+        self.no_account_skips += 1
+        return None
+
+    def release(self, account):
+        self.busy.pop(account.account_name, None)
+
+    def submit(self, account, execute, *args):
+        '''
+        Runs 'execute(account, *args)' on a worker thread. The account stays busy until its result is collected.
+        '''
+        self.dispatched[account.account_name] += 1
+        self.futures.append((account, self.executor.submit(execute, account, *args)))
+
+    def get_finished(self):
+        '''
+        @Returns
+        results of every finished execution (failed executions are logged and skipped), freeing their accounts
+        '''
+        finished = [(account, future) for account, future in self.futures if future.done()]
+        self.futures = [(account, future) for account, future in self.futures if not future.done()]
+
+        results = []
+        for account, future in finished:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                log.print_status("WARNING: Execution on account '{}' failed -> {}".format(account.account_name, str(e)))
+            self.release(account)
+
+        return results
+
+    def wait(self):
+        '''
+        Waits for every in-flight execution to finish.
+        @Returns
+        their results (see 'get_finished')
+        '''
+        for _, future in self.futures:
+            future.exception()  # blocks until done
+
+        return self.get_finished()
+
+    def sync_symbols(self):
+        for account in self.accounts:
+            if isinstance(account, SubAccount):
+                account.sync_symbols()
+
+    def value_starting_accounts(self):
+        '''
+        Values each sub-account once the first snapshot's conversion rates are in.
+        '''
+        for account in self.accounts:
+            if isinstance(account, SubAccount) and account.total_starting_account_value is None:
+                account.total_starting_account_value = account.get_account_value(account.get_balances())
+                log.print_status("Starting '{}' account value = {} {}".format(account.account_name, round(account.total_starting_account_value, 5), parameters.TARGET_ASSET))
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of plans dispatched per account and opportunities skipped for lack of a free account
+        '''
+        return {"dispatched": dict(self.dispatched), "no_account_skips": self.no_account_skips}
+
+
+def get_account_pool(parent):
+    '''
+    Creates the pool of the exchange's main account and every sub-account in its SUB_ACCOUNTS credentials.
+    '''
+    accounts = [parent]
+    for sub_account in parameters.EXCHANGE_CREDENTIALS[parent.name].get("SUB_ACCOUNTS", []):
+        accounts.append(SubAccount(parent, sub_account["NAME"], sub_account["PUBLIC_KEY"], sub_account["SECRET_KEY"], sub_account.get("PASSPHRASE", "")))
+
+    log.print_status("Dispatching trade plans across {} accounts.".format(len(accounts)))
+
+    return AccountPool(accounts)
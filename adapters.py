@@ -0,0 +1,449 @@
+from kucoin.client import Market as KucoinMarket
+from kucoin.client import Trade as KucoinTrade
+from kucoin.client import User as KucoinUser
+from binance.client import Client as BinanceClient
+from binance.exceptions import BinanceAPIException, BinanceRequestException
+
+import parameters
+import resilience
+import staging
+import helper
+import log
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import json
+import uuid
+import re
+
+
+class ExchangeAdapter():
+    '''
+    Venue interface used by the exchange, market and trade code. Each venue implements these methods once, so hot paths
+    never branch on the exchange name and every response comes back in one normalized shape:
+        - assets info / snapshots are indexed by stripped symbol (base + quote)
+        - orderbooks are {"bids": [[price, qty], ...], "asks": [[price, qty], ...]}
+        - snapshots (attrs) and orderbooks carry "exchange_time" in epoch secs when the venue reports one
+        - snapshots carry a 'quoteVolume' (24h volume in quote asset) column when the venue's ticker list has one
+        - order details are revised order detail dicts (see normalize_order_details), flagged 'unresolved' when the
+          order was accepted but its fill state couldn't be fetched (its fill qtys are then placeholders, not fills)
+        - balances are dataframes with 'asset', 'balance' and 'available' columns
+    Venue symbols are precomputed from assets info, so no symbol reformatting happens per call.
+    Market data requests raise resilience.VenueError for api errors of the venue (see call_market_api).
+    '''
+    api_errors = ()  # errors the venue's client raises for rejected requests (its http errors are OSErrors, raised as they are)
+
+    def __init__(self, name):
+        self.name = name
+        self.venue_symbols = {}     # stripped symbol -> venue symbol
+        self.stripped_symbols = {}  # venue symbol -> stripped symbol
+        self.market_fallback = None
+        self.stager = None  # pre-staged limit order sender, set when PRESTAGE_ORDERS is on
+
+    def call_market_api(self, request):
+        '''
+        Makes a market data request, translating the client's api errors (http 429/5xx, error codes) into
+        resilience.VenueError. Connection errors are raised as they are.
+        '''
+        try:
+            return request()  # ** API CALL **
+        except OSError:
+            raise
+        except Exception as e:
+            if not self.is_api_error(e):
+                raise  # bugs (bad arguments, normalization errors) surface instead of tripping breakers
+            raise resilience.VenueError(str(e)) from e
+
+    def is_api_error(self, error):
+        '''
+        Returns True if 'error' is the venue rejecting a request rather than an error in the calling code.
+        '''
+        return isinstance(error, self.api_errors)
+
+    def map_symbols(self, assets_info, venue_symbols):
+        '''
+        Precomputes stripped <-> venue symbol lookups. Mappings from earlier refreshes are kept (delisted symbols may
+        still be referenced by an in-flight trade) and the lookups are swapped in whole, so readers never see a partial update.
+        '''
+        self.venue_symbols = {**self.venue_symbols, **dict(zip(assets_info.index, venue_symbols))}
+        self.stripped_symbols = {**self.stripped_symbols, **dict(zip(venue_symbols, assets_info.index))}
+
+    def stage_orders(self, orders):
+        '''
+        Pre-stages [(venue symbol, order type)] limit orders so sending them only patches in price and qty.
+        '''
+        if self.stager is not None:
+            self.stager.stage_orders(orders)
+
+    def get_symbol(self, base_asset, quote_asset):
+        '''
+        Returns venue symbol for a base/quote asset pair.
+        '''
+        return self.venue_symbols[base_asset + quote_asset]
+
+    def get_assets_info(self):
+        raise NotImplementedError
+
+    def get_server_time(self):
+        raise NotImplementedError
+
+    def get_orderbook_tickers(self, fallback=False):
+        raise NotImplementedError
+
+    def get_symbol_tickers(self, symbols, fallback=False):
+        raise NotImplementedError
+
+    def get_pair_orderbook(self, symbol):
+        raise NotImplementedError
+
+    def get_available_qty(self, asset):
+        raise NotImplementedError
+
+    def get_balances(self):
+        raise NotImplementedError
+
+    def place_limit_order(self, symbol, order_type, qty, price):
+        raise NotImplementedError
+
+    def place_market_order(self, symbol, order_type, qty):
+        raise NotImplementedError
+
+    def place_symbol_batch(self, symbol, trades):
+        raise NotImplementedError
+
+    def get_order_details(self, order):
+        raise NotImplementedError
+
+    def normalize_order_details(self, order_details, trade, trade_num):
+        raise NotImplementedError
+
+    def cancel_order(self, order):
+        raise NotImplementedError
+
+    def try_cancel_order(self, order):
+        try:
+            return self.cancel_order(order)  # ** API CALL **
+        except Exception as e:
+            log.print_status("MSG: Failed to cancel order {}. API Reason -> {}".format(order["orderId"], str(e)))  # most likely already completed
+            return False
+
+    def cancel_orders(self, orders):
+        '''
+        Cancels orders by id, one request each sent concurrently. Venues' cancel-all endpoints would also cancel orders
+        that aren't part of the batch (rebalancer orders, legs of other plans), so they aren't used.
+        @Returns
+        list of canceled order ids (orders that failed to cancel, most likely already completed, are left out)
+        '''
+        with ThreadPoolExecutor(max_workers=len(orders)) as pool:
+            canceled = list(pool.map(self.try_cancel_order, orders))
+
+        return [order["orderId"] for order, was_canceled in zip(orders, canceled) if was_canceled]
+
+    def is_below_min_size_error(self, error):
+        raise NotImplementedError
+
+
+class KucoinAdapter(ExchangeAdapter):
+    api_error_pattern = re.compile(r"\d{3}-")  # the client raises bare Exceptions of "<http status>-<response body>"
+
+    def __init__(self, name, api_public, api_secret, passphrase):
+        super().__init__(name)
+        self.market = KucoinMarket()
+        self.trade = KucoinTrade(api_public, api_secret, passphrase)
+        self.user = KucoinUser(api_public, api_secret, passphrase)
+
+        fallback_host = parameters.FALLBACK_MARKET_HOSTS.get(name, "")
+        if fallback_host != "":
+            self.market_fallback = KucoinMarket(url=fallback_host)  # secondary market data host
+
+        if parameters.PRESTAGE_ORDERS:
+            self.stager = staging.KucoinOrderStager(self.trade.url, api_public, api_secret, passphrase)  # same host as the client
+
+    def get_assets_info(self):
+        exchange_info = pd.DataFrame(self.market.get_symbol_list())  # ** API CALL **
+
+        assets_info = pd.DataFrame({
+            "name": exchange_info["name"].str.replace("-", "", regex=False),
+            "baseAsset": exchange_info["baseCurrency"],
+            "quoteAsset": exchange_info["quoteCurrency"],
+            "baseMinQty": exchange_info["baseMinSize"].astype(float),
+            "baseMaxQty": exchange_info["baseMaxSize"].astype(float),
+            "baseQtyPrecision": helper.get_precisions(exchange_info["baseIncrement"]),
+            "quoteQtyPrecision": helper.get_precisions(exchange_info["quoteIncrement"]),
+            "basePricePrecision": helper.get_precisions(exchange_info["priceIncrement"]),
+            "baseMinNotional": "",
+            "tradingEnabled": exchange_info["enableTrading"].astype(bool)
+        }).set_index("name")
+        self.map_symbols(assets_info, list(exchange_info["symbol"]))
+
+        return assets_info
+
+    def get_server_time(self):
+        return self.market.get_server_timestamp() / 1000  # ** API CALL **
+
+    def is_api_error(self, error):
+        if type(error) is not Exception or len(error.args) == 0:
+            return False
+
+        body = error.args[0]
+        return isinstance(body, bytes) or (isinstance(body, str) and self.api_error_pattern.match(body) is not None)  # bytes -> 200 response that isn't json
+
+    def get_orderbook_tickers(self, fallback=False):
+        market_client = self.market_fallback if fallback else self.market
+        tickers = self.call_market_api(market_client.get_all_tickers)  # ** API CALL **
+        orderbook = pd.DataFrame(tickers['ticker'])
+        orderbook = orderbook[["symbol", "buy", "sell", "volValue"]].rename(columns={"buy": "bidPrice", "sell": "askPrice", "volValue": "quoteVolume"})
+        orderbook["symbol"] = orderbook["symbol"].map(self.stripped_symbols)
+
+        orderbook = orderbook.dropna(subset=["symbol"]).set_index("symbol").astype(float)
+        orderbook.attrs["exchange_time"] = tickers["time"] / 1000
+
+        return orderbook
+
+    def get_symbol_tickers(self, symbols, fallback=False):
+        '''
+        Best bid/ask of a few stripped symbols, one ticker request per symbol sent concurrently.
+        '''
+        market_client = self.market_fallback if fallback else self.market
+        with ThreadPoolExecutor(max_workers=len(symbols)) as pool:
+            tickers = self.call_market_api(lambda: list(pool.map(lambda symbol: market_client.get_ticker(self.venue_symbols[symbol]), symbols)))  # ** API CALL **
+
+        orderbook = pd.DataFrame({"bidPrice": [ticker["bestBid"] for ticker in tickers], "askPrice": [ticker["bestAsk"] for ticker in tickers]}, index=symbols).astype(float)
+        orderbook.attrs["exchange_time"] = min(ticker["time"] for ticker in tickers) / 1000
+
+        return orderbook
+
+    def get_pair_orderbook(self, symbol):
+        orderbook = self.market.get_part_order(20, symbol)  # ** API CALL **
+        orderbook["exchange_time"] = orderbook["time"] / 1000
+
+        return orderbook
+
+    def get_available_qty(self, asset):
+        return float(pd.DataFrame(self.user.get_account_list()).set_index("currency").loc[asset]["available"])  # ** API CALL **
+
+    def get_balances(self):
+        balances = pd.DataFrame(self.user.get_account_list())  # ** API CALL **
+        balances = balances.rename(columns={"currency": "asset"})
+        balances["balance"] = balances["balance"].astype(float)
+
+        return balances
+
+    def place_limit_order(self, symbol, order_type, qty, price):
+        if self.stager is not None:
+            return self.stager.send(symbol, order_type, qty, price)  # ** API CALL **
+
+        order = self.trade.create_limit_order(symbol, order_type, qty, price, timeInForce=parameters.ORDER_TIME_IN_FORCE)  # ** API CALL **
+        return {"orderId": order["orderId"], "pair": symbol}
+
+    def place_market_order(self, symbol, order_type, qty):
+        return self.trade.create_market_order(symbol, order_type, size=qty)  # ** API CALL **
+
+    def place_symbol_batch(self, symbol, trades):
+        results = []
+        for i in range(0, len(trades), 5):  # kucoin accepts up to 5 orders per bulk request
+            chunk = trades[i:i + 5]
+            order_list = [{"clientOid": uuid.uuid4().hex, "side": trade["order_type"], "type": "limit", "price": trade["price"],
+                           "size": trade["order_qty"], "timeInForce": parameters.ORDER_TIME_IN_FORCE} for _, trade in chunk]
+            try:
+                chunk_results = {result["clientOid"]: result for result in self.trade.create_bulk_orders(symbol, order_list)["data"]}  # ** API CALL **
+            except Exception as e:
+                log.print_status("MSG: Batch order for {} failed. API Reason -> {}".format(symbol, str(e)))
+                results += [None] * len(chunk)
+                continue
+
+            for order in order_list:
+                result = chunk_results.get(order["clientOid"])
+                if result is None or result.get("status") != "success":
+                    log.print_status("MSG: Batch order for {} rejected -> {}".format(symbol, result.get("failMsg") if result else "no response"))
+                    results.append(None)
+                else:
+                    results.append(result)
+
+        # bulk results carry no fill state (ioc/fok orders are already resolved), details of every accepted order are fetched at once
+        accepted = [result for result in results if result is not None]
+        if len(accepted) == 0:
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(accepted)) as pool:
+            details = dict(zip([result["id"] for result in accepted], pool.map(self.get_bulk_order_details, accepted)))
+
+        return [details[result["id"]] if result is not None else None for result in results]
+
+    def get_bulk_order_details(self, result, max_tries=2):
+        '''
+        Order details of an accepted bulk order. If they can't be fetched in 'max_tries' the order is still returned from
+        its bulk result so it is tracked and canceled like the others, but flagged 'unresolved': it may well have filled.
+        '''
+        for i in range(max_tries):
+            try:
+                return self.trade.get_order_details(result["id"])  # ** API CALL **
+            except Exception as e:
+                log.print_status("MSG: Could not get details of order {} ({}/{}). API Reason -> {}".format(result["id"], i + 1, max_tries, str(e)))
+
+        return {"id": result["id"], "symbol": result["symbol"], "isActive": True, "price": result["price"], "size": result["size"],
+                "dealSize": 0, "dealFunds": 0, "fee": 0, "feeCurrency": "", "unresolved": True}
+
+    def get_order_details(self, order):
+        return self.trade.get_order_details(order["orderId"])  # ** API CALL **
+
+    def normalize_order_details(self, order_details, trade, trade_num):
+        return {"scan_id": trade["scan_id"],
+                "trade_num": trade_num,
+                "orderId": order_details["id"],
+                "order_type": trade["order_type"],
+                "pair": order_details["symbol"],
+                "pending": bool(order_details["isActive"]),
+                "price": float(order_details["price"]),
+                "original_qty": float(order_details["size"]),
+                "filled_qty": float(order_details["dealSize"]),
+                "result_qty": float(order_details["dealFunds"]),
+                "fee": float(order_details["fee"]),
+                "fee_currency": order_details["feeCurrency"],
+                "unresolved": order_details.get("unresolved", False)}
+
+    def cancel_order(self, order):
+        return self.trade.cancel_order(order["orderId"])["cancelledOrderIds"][0] == order["orderId"]  # ** API CALL **
+
+    def is_below_min_size_error(self, error):
+        return "Order size below the minimum requirement" in str(error)
+
+
+class BinanceAdapter(ExchangeAdapter):
+    api_errors = (BinanceAPIException, BinanceRequestException)
+
+    def __init__(self, name, api_public, api_secret, passphrase):
+        super().__init__(name)
+        tld = 'us' if name == "BINANCE.US" else 'com'
+        self.client = BinanceClient(api_public, api_secret, tld=tld)
+
+        fallback_host = parameters.FALLBACK_MARKET_HOSTS.get(name, "")
+        if fallback_host != "":
+            self.market_fallback = BinanceClient(api_public, api_secret, tld=tld)  # secondary market data host
+            self.market_fallback.API_URL = fallback_host
+
+        if parameters.PRESTAGE_ORDERS:
+            self.stager = staging.BinanceOrderStager(self.client.API_URL, api_public, api_secret)  # same host as the client (tld, testnet)
+
+    def get_assets_info(self):
+        exchange_info = pd.DataFrame(self.client.get_exchange_info()["symbols"])  # ** API CALL **
+
+        # flatten every symbol's filter list in one pass -> one row per (symbol, filterType)
+        filters = exchange_info[["symbol", "filters"]].explode("filters").dropna(subset=["filters"])
+        filters = pd.DataFrame(filters["filters"].tolist(), index=filters["symbol"])
+        lot_size = filters[filters["filterType"] == "LOT_SIZE"].reindex(exchange_info["symbol"])
+        price_filter = filters[filters["filterType"] == "PRICE_FILTER"].reindex(exchange_info["symbol"])
+        min_notional = filters[filters["filterType"] == "MIN_NOTIONAL"].reindex(exchange_info["symbol"])
+
+        assets_info = pd.DataFrame({
+            "name": (exchange_info["baseAsset"] + exchange_info["quoteAsset"]).to_numpy(),
+            "baseAsset": exchange_info["baseAsset"].to_numpy(),
+            "quoteAsset": exchange_info["quoteAsset"].to_numpy(),
+            "baseMinQty": lot_size["minQty"].astype(float).to_numpy(),
+            "baseMaxQty": lot_size["maxQty"].astype(float).to_numpy(),
+            "baseQtyPrecision": helper.get_precisions(lot_size["stepSize"]).to_numpy(),  # TODO: add "quoteQtyPrecision" later....
+            "basePricePrecision": helper.get_precisions(price_filter["tickSize"]).to_numpy(),
+            "baseMinNotional": min_notional["minNotional"].astype(float).fillna(0).to_numpy(),  # no filter -> no min notional
+            "tradingEnabled": (exchange_info["status"] == "TRADING").to_numpy()
+        }).set_index("name")
+        self.map_symbols(assets_info, list(exchange_info["symbol"]))
+
+        return assets_info
+
+    def get_server_time(self):
+        return self.client.get_server_time()["serverTime"] / 1000  # ** API CALL **
+
+    def get_orderbook_tickers(self, fallback=False):
+        market_client = self.market_fallback if fallback else self.client
+        orderbook = pd.DataFrame(self.call_market_api(market_client.get_orderbook_tickers))  # ** API CALL **
+
+        return orderbook.set_index("symbol").astype(float)[["bidPrice", "askPrice"]]
+
+    def get_symbol_tickers(self, symbols, fallback=False):
+        '''
+        Best bid/ask of a few stripped symbols in one request.
+        '''
+        market_client = self.market_fallback if fallback else self.client
+        venue_symbols = json.dumps([self.venue_symbols[symbol] for symbol in symbols], separators=(",", ":"))
+        orderbook = pd.DataFrame(self.call_market_api(lambda: market_client.get_orderbook_ticker(symbols=venue_symbols)))  # ** API CALL **
+        orderbook["symbol"] = orderbook["symbol"].map(self.stripped_symbols)
+
+        return orderbook.set_index("symbol").astype(float)[["bidPrice", "askPrice"]]
+
+    def get_pair_orderbook(self, symbol):
+        return self.client.get_order_book(symbol=symbol)  # ** API CALL **
+
+    def get_available_qty(self, asset):
+        return float(self.client.get_asset_balance(asset=asset)['free'])  # ** API CALL **
+
+    def get_balances(self):
+        balances = pd.DataFrame(self.client.get_account()["balances"])  # ** API CALL **
+        balances["available"] = balances["free"].astype(float)
+        balances["balance"] = balances["available"] + balances["locked"].astype(float)
+
+        return balances[["asset", "balance", "available"]]
+
+    def place_limit_order(self, symbol, order_type, qty, price):
+        if self.stager is not None:
+            return self.stager.send(symbol, order_type, qty, price)  # ** API CALL **
+
+        order = self.client.create_order(symbol=symbol, side=order_type.upper(), type="LIMIT", quantity=qty, price=price,
+                                         timeInForce=parameters.ORDER_TIME_IN_FORCE)  # ** API CALL **
+        return {"orderId": order["orderId"], "pair": symbol}
+
+    def place_market_order(self, symbol, order_type, qty):
+        return self.client.create_order(symbol=symbol, side=order_type.upper(), type="MARKET", quantity=qty)  # ** API CALL **
+
+    def place_symbol_batch(self, symbol, trades):
+        responses = []
+        for _, trade in trades:  # spot api has no batch order endpoint, send individually
+            try:
+                responses.append(self.client.create_order(symbol=symbol, side=trade["order_type"].upper(), type="LIMIT", quantity=trade["order_qty"],
+                                                          price=trade["price"], timeInForce=parameters.ORDER_TIME_IN_FORCE))  # ** API CALL **
+            except Exception as e:
+                log.print_status("MSG: Batch order for {} failed. API Reason -> {}".format(symbol, str(e)))
+                responses.append(None)
+
+        return responses
+
+    def get_order_details(self, order):
+        return self.client.get_order(symbol=order["pair"], orderId=order["orderId"])  # ** API CALL **
+
+    def normalize_order_details(self, order_details, trade, trade_num):
+        fills = order_details.get("fills", [])
+        return {"scan_id": trade["scan_id"],
+                "trade_num": trade_num,
+                "orderId": order_details["orderId"],
+                "order_type": trade["order_type"],
+                "pair": order_details["symbol"],
+                "pending": order_details["status"] in ["NEW", "PARTIALLY_FILLED"],
+                "price": float(order_details["price"]),
+                "original_qty": float(order_details["origQty"]),
+                "filled_qty": float(order_details["executedQty"]),
+                "result_qty": float(order_details["cummulativeQuoteQty"]),
+                "fee": sum(float(fill["commission"]) for fill in fills),
+                "fee_currency": fills[0]["commissionAsset"] if len(fills) > 0 else "",
+                "unresolved": False}  # placement responses carry the fill state
+
+    def cancel_order(self, order):
+        return self.client.cancel_order(symbol=order["pair"], orderId=order["orderId"])["orderId"] == order["orderId"]  # ** API CALL **
+
+    def is_below_min_size_error(self, error):
+        return "LOT_SIZE" in str(error) or "MIN_NOTIONAL" in str(error)
+
+
+ADAPTERS = {
+    "BINANCE.US": BinanceAdapter,
+    "BINANCE": BinanceAdapter,
+    "KUCOIN": KucoinAdapter
+}
+
+
+def get_adapter(exchange_name, api_public, api_secret, passphrase):
+    '''
+    Creates the venue adapter for 'exchange_name'. Returns None if the exchange is not supported.
+    '''
+    if exchange_name not in ADAPTERS:
+        return None
+
+    return ADAPTERS[exchange_name](exchange_name, api_public, api_secret, passphrase)
@@ -0,0 +1,174 @@
+import parameters
+import log
+
+import numpy as np
+import pandas as pd
+import threading
+import time
+
+
+METRICS = ["slippage_bps", "fill_ratio", "ack_secs", "fill_secs", "cancel_secs"]
+
+
+class Distribution():
+    '''
+    Last 'length' samples of one measurement in a fixed-memory ring (percentiles are computed on demand).
+    '''
+    def __init__(self, length):
+        self.values = np.full(length, np.nan)
+        self.position = 0  # next slot to overwrite
+        self.count = 0
+
+    def add(self, value):
+        if pd.isnull(value):
+            return
+
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        self.count += 1
+
+    def get_count(self):
+        return min(self.count, len(self.values))
+
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return np.nan
+
+        return float(np.nanpercentile(self.values, percentile))
+
+    def get_summary(self):
+        return {"count": self.get_count(), "p50": round(self.get_percentile(50), 5), "p90": round(self.get_percentile(90), 5)}
+
+
+class ExecutionAttribution():
+    '''
+    Joins every executed leg to the leg it was projected as in its trade plan as soon as the leg resolves, and keeps
+    rolling distributions of slippage (bps of the projected price, positive = worse than planned), fill ratio and time
+    spent waiting on the exchange ack, on fills and on cancels per pair and per arbitrage direction. Fills are only seen
+    when orders are polled, so 'fill_secs' (first submit to the last order update of the leg) is an upper bound.
+    Shared by the exchange and its sub-accounts, legs may be recorded from several worker threads.
+    '''
+    def __init__(self, length, min_samples):
+        self.length = length
+        self.min_samples = min_samples
+        self.distributions = {}  # ("pair", pair) or ("direction", direction) -> metric -> Distribution
+        self.records = []  # joined legs since the last save
+        self.num_legs = 0
+        self.lock = threading.Lock()
+
+    def get_distributions(self, key):
+        if key not in self.distributions:
+            self.distributions[key] = {metric: Distribution(self.length) for metric in METRICS}
+
+        return self.distributions[key]
+
+    def record_leg(self, trade_num, projected, submitted_qty, orders, leg_start_time):
+        '''
+        Attributes executed leg 'trade_num'. 'projected' is the leg's trade plan row, 'submitted_qty' what was actually sent
+        for it (after adjusting to earlier legs' results) and 'orders' every normalized order placed for it.
+        '''
+        orders = [order for order in orders if order is not None and order["filled_qty"] >= 0]  # skip below min size stand-ins
+        if len(orders) == 0:
+            return
+
+        filled_qty = sum(order["filled_qty"] for order in orders)
+        result_qty = sum(order["result_qty"] for order in orders)
+        projected_price = float(projected["price"])
+
+        slippage_bps = np.nan
+        if filled_qty > 0 and projected_price > 0:
+            fill_price = result_qty / filled_qty  # volume weighted across every order of the leg
+            slippage_bps = (fill_price / projected_price - 1) * 10000
+            if projected["order_type"] == "sell":
+                slippage_bps = -slippage_bps
+
+        record = {"scan_id": projected["scan_id"],
+                  "trade_num": trade_num,
+                  "pair": projected["pair"],
+                  "direction": projected["direction"],
+                  "order_type": projected["order_type"],
+                  "projected_price": projected_price,
+                  "projected_qty": float(projected["qty"]),
+                  "submitted_qty": float(submitted_qty),
+                  "filled_qty": filled_qty,
+                  "num_orders": len(orders),
+                  "slippage_bps": slippage_bps,
+                  "fill_ratio": filled_qty / float(submitted_qty) if float(submitted_qty) > 0 else np.nan,
+                  "ack_secs": orders[0].get("ack_secs", np.nan),
+                  "fill_secs": time.time() - leg_start_time if filled_qty > 0 else np.nan,
+                  "cancel_secs": sum(order.get("cancel_secs", 0) for order in orders)}
+
+        with self.lock:
+            for key in [("pair", record["pair"]), ("direction", record["direction"])]:
+                distributions = self.get_distributions(key)
+                for metric in METRICS:
+                    distributions[metric].add(record[metric])
+
+            self.records.append(record)
+            self.num_legs += 1
+
+        log.print_status("FILL    -> {} {} {} bps, {}% filled, ack {}s, fill {}s, cancel {}s".format(record["order_type"], record["pair"], round(slippage_bps, 2),
+                                                                                                   round(record["fill_ratio"] * 100, 1), round(record["ack_secs"], 3),
+                                                                                                   round(record["fill_secs"], 3), round(record["cancel_secs"], 3)))
+
+    def get_distribution(self, pair=None, direction=None):
+        '''
+        @Returns
+        dict of metric -> {"count", "p50", "p90"} for 'pair' (or 'direction'), None if nothing was recorded for it
+        '''
+        key = ("pair", pair) if pair is not None else ("direction", direction)
+        with self.lock:
+            if key not in self.distributions:
+                return None
+
+            return {metric: distribution.get_summary() for metric, distribution in self.distributions[key].items()}
+
+    def get_expected_slippage(self, pair, direction):
+        '''
+        @Returns
+        median slippage bps of 'pair' once it has 'min_samples' filled legs, otherwise of its direction, otherwise 0
+        '''
+        with self.lock:
+            for key in [("pair", pair), ("direction", direction)]:
+                distribution = self.distributions.get(key, {}).get("slippage_bps")
+                if distribution is not None and distribution.get_count() >= self.min_samples:
+                    return distribution.get_percentile(50)
+
+        return 0
+
+    def get_expected_slippage_percent(self, legs, direction):
+        '''
+        @Returns
+        profit percent the legs [(pair, order type)] of a triangle are expected to give up to slippage (price
+        improvement isn't counted on)
+        '''
+        return sum(max(self.get_expected_slippage(pair, direction), 0) for pair, _ in legs) / 100
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of attributed legs, distributions per direction and the pairs with the worst median slippage
+        '''
+        with self.lock:
+            pair_slippage = {key[1]: distributions["slippage_bps"].get_percentile(50) for key, distributions in self.distributions.items()
+                             if key[0] == "pair" and distributions["slippage_bps"].get_count() > 0}
+            directions = {key[1]: {metric: distribution.get_summary() for metric, distribution in distributions.items()}
+                          for key, distributions in self.distributions.items() if key[0] == "direction"}
+
+        worst_pairs = sorted(pair_slippage.items(), key=lambda item: item[1], reverse=True)[:3]
+
+        return {"legs": self.num_legs, "directions": directions, "worst_pairs_bps": {pair: round(bps, 2) for pair, bps in worst_pairs}}
+
+    def save(self, path, save_time):
+        '''
+        Saves the legs attributed since the last save to an execution_attribution csv in 'path'.
+        '''
+        with self.lock:
+            records, self.records = self.records, []
+
+        if len(records) > 0:
+            pd.DataFrame(records).set_index(["scan_id", "trade_num"]).to_csv("{}execution_attribution_{}.csv".format(path, str(save_time)))
+
+
+def get_attribution():
+    return ExecutionAttribution(parameters.ATTRIBUTION_WINDOW, parameters.ATTRIBUTION_MIN_SAMPLES)
@@ -0,0 +1,95 @@
+import parameters
+import log
+
+import threading
+import time
+
+
+class ClockSync():
+    '''
+    Estimates the offset of the exchange's server clock from the local clock. Each sync takes a few server-time samples
+    and keeps the one with the lowest round-trip time, assuming the server read its clock halfway through the round trip
+    (NTP style). Market data is stamped with exchange time, local receive time and monotonic receive time, so its age
+    can be measured later without depending on the local wall clock.
+    '''
+    def __init__(self, name, get_server_time):
+        self.name = name
+        self.get_server_time = get_server_time  # () -> exchange server time in epoch secs
+        self.offset_secs = 0.0  # exchange time - local time
+        self.rtt_secs = 0.0
+        self.synced = False
+        self.last_sync_time = 0
+
+    def sync(self, num_samples):
+        '''
+        Re-estimates clock offset and round-trip time. Keeps the previous estimate if the server time can't be fetched.
+        @Returns
+        True if the estimate was updated
+        '''
+        best_sample = None
+        for i in range(num_samples):
+            try:
+                send_time, send_monotonic = time.time(), time.monotonic()
+                server_time = self.get_server_time()  # ** API CALL **
+                rtt_secs = time.monotonic() - send_monotonic
+            except Exception as e:
+                log.print_status("MSG: {} server time unavailable -> {}".format(self.name, str(e)))
+                continue
+
+            if best_sample is None or rtt_secs < best_sample[0]:
+                best_sample = (rtt_secs, server_time - (send_time + rtt_secs / 2))
+
+        if best_sample is None:
+            return False
+
+        self.rtt_secs, self.offset_secs = best_sample
+        self.synced = True
+        self.last_sync_time = time.time()
+
+        return True
+
+    def sync_loop(self):
+        '''
+        Background clock re-sync loop.
+        '''
+        while True:
+            time.sleep(parameters.CLOCK_SYNC_INTERVAL_SECONDS)
+            self.sync(parameters.CLOCK_SYNC_SAMPLES)
+
+    def start(self):
+        '''
+        Syncs once, then keeps re-syncing on a background thread.
+        '''
+        if self.sync(parameters.CLOCK_SYNC_SAMPLES):
+            log.print_status("Clock offset from {} = {} secs (rtt {} secs).".format(self.name, round(self.offset_secs, 4), round(self.rtt_secs, 4)))
+
+        threading.Thread(target=self.sync_loop, daemon=True).start()
+
+    def get_exchange_time(self, local_time=None):
+        '''
+        Converts local epoch time (now by default) to exchange clock time.
+        '''
+        return (time.time() if local_time is None else local_time) + self.offset_secs
+
+    def stamp(self, exchange_time=None):
+        '''
+        Stamps market data on receipt. 'exchange_time' is the venue's own data timestamp when the response carries one,
+        otherwise the data is assumed to be produced half a round trip before it arrived.
+        @Returns
+        dict with 'exchange_time', 'receive_time', 'receive_monotonic' and 'receive_age_secs'
+        '''
+        receive_time, receive_monotonic = time.time(), time.monotonic()
+        if exchange_time is None:
+            exchange_time = self.get_exchange_time(receive_time) - self.rtt_secs / 2
+
+        return {"exchange_time": exchange_time,
+                "receive_time": receive_time,
+                "receive_monotonic": receive_monotonic,
+                "receive_age_secs": max(self.get_exchange_time(receive_time) - exchange_time, 0)}
+
+    def get_data_age(self, stamp):
+        '''
+        @Returns
+        current age in secs of data stamped with 'stamp' (age on receipt + monotonic time since receipt)
+        '''
+        return stamp["receive_age_secs"] + (time.monotonic() - stamp["receive_monotonic"])
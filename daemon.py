@@ -0,0 +1,153 @@
+import parameters
+import log
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
+import threading
+import json
+import time
+import os
+
+
+# settings only read while the exchange and background workers are set up, changing them needs a restart
+RESTART_REQUIRED_PARAMETERS = ["EXCHANGE_CREDENTIALS", "TARGET_ASSET", "FALLBACK_MARKET_HOSTS", "EXECUTION_MODE",
+                               "PIPELINED_SCANS", "RECORD_MARKET_DATA", "PUBLISH_SNAPSHOT_BUS", "SNAPSHOT_BUS_MAX_SYMBOLS",
+                               "SYMBOL_REFRESH_INTERVAL_SECONDS", "NEGATIVE_CACHE", "LATENCY_AWARE_RANKING",
+                               "ACCOUNT_REQUESTS_PER_SECOND", "ACCOUNT_REQUEST_BURST", "PRESTAGE_ORDERS",
+                               "EXECUTION_ATTRIBUTION", "ATTRIBUTION_WINDOW", "ATTRIBUTION_MIN_SAMPLES", "TIERED_SCANNING",
+                               "PREFETCH_TOP_N", "PRICE_HISTORY_LENGTH", "PROFILE_INTERVAL_SECONDS",
+                               "DECAY_HISTORY_PATH", "SAVE_PATH", "DAEMON_CONTROL_PORT"]
+
+
+class ParameterReloader():
+    '''
+    Reloads the parameters module in place when parameters.py changes on disk. Every module reads settings as
+    'parameters.X' at call time, so reloaded values apply from the next scan without reconnecting to the exchange.
+    '''
+    def __init__(self):
+        self.path = parameters.__file__
+        self.modified_time = os.path.getmtime(self.path)
+        self.num_reloads = 0
+
+    def reload_if_changed(self):
+        '''
+        @Returns
+        True if parameters were reloaded
+        '''
+        try:
+            modified_time = os.path.getmtime(self.path)
+        except OSError:
+            return False
+
+        if modified_time == self.modified_time:
+            return False
+
+        self.modified_time = modified_time
+        previous_values = {name: getattr(parameters, name, None) for name in RESTART_REQUIRED_PARAMETERS}
+        try:
+            importlib.reload(parameters)
+        except Exception as e:  # keep running on the values already loaded (a half-saved file is a SyntaxError)
+            log.print_status("MSG: Could not reload parameters -> " + str(e))
+            return False
+
+        self.num_reloads += 1
+        log.print_status("MSG: Reloaded parameters.")
+
+        changed = [name for name in RESTART_REQUIRED_PARAMETERS if getattr(parameters, name, None) != previous_values[name]]
+        if len(changed) > 0:
+            log.print_status("WARNING: {} changed but only take effect after a restart.".format(changed))
+
+        return True
+
+
+class DaemonControl():
+    '''
+    Shared state between the scan loop and the local control API. The API only sets flags, the scan loop acts on them
+    between scans so nothing is changed mid scan or mid trade.
+    '''
+    def __init__(self):
+        self.start_time = time.time()
+        self.running = threading.Event()
+        self.running.set()
+        self.flush_requested = threading.Event()
+        self.stop_requested = threading.Event()
+        self.status = {}
+        self.status_lock = threading.Lock()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def update_status(self, **status):
+        with self.status_lock:
+            self.status.update(status)
+
+    def get_status(self):
+        with self.status_lock:
+            status = dict(self.status)
+        status["paused"] = not self.running.is_set()
+        status["uptime_secs"] = round(time.time() - self.start_time, 1)
+
+        return status
+
+    def wait_while_paused(self):
+        '''
+        Blocks the scan loop while paused. Flush and stop requests still wake it up.
+        @Returns
+        True if the loop should keep going
+        '''
+        while not self.running.wait(1):
+            if self.flush_requested.is_set() or self.stop_requested.is_set():
+                break
+
+        return not self.stop_requested.is_set()
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    '''
+    GET /status, POST /pause, /resume, /flush, /stop. Responses are JSON.
+    '''
+    def send_json(self, code, body):
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(200, self.server.control.get_status())
+        else:
+            self.send_json(404, {"error": "unknown endpoint"})
+
+    def do_POST(self):
+        control = self.server.control
+        actions = {"/pause": control.pause, "/resume": control.resume,
+                   "/flush": control.flush_requested.set, "/stop": control.stop_requested.set}
+
+        if self.path not in actions:
+            self.send_json(404, {"error": "unknown endpoint"})
+            return
+
+        actions[self.path]()
+        log.print_status("MSG: Control API -> {}".format(self.path[1:]))
+        self.send_json(200, control.get_status())
+
+    def log_message(self, format, *args):
+        pass  # keep http request lines out of the console log
+
+
+def start_control_server(control, port):
+    '''
+    Serves the control API on localhost only, on a background thread.
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), ControlRequestHandler)
+    server.control = control
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.print_status("Control API listening on http://127.0.0.1:{}".format(port))
+
+    return server
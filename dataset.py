@@ -0,0 +1,276 @@
+import parameters
+
+import argparse
+import numpy as np
+import pandas as pd
+import shutil
+import json
+import glob
+import time
+import os
+import re
+
+
+'''
+::: DATASET LAYOUT :::
+======================
+<dataset>/<table>/<run>/<session>/schema.json
+<dataset>/<table>/<run>/<session>/<column>.npy                   numeric and bool columns
+<dataset>/<table>/<run>/<session>/<column>.codes.npy             string columns, dictionary encoded (-1 = missing)
+<dataset>/<table>/<run>/<session>/<column>.categories.npy
+
+One partition per table per recorded session (one saved history csv; a data/run* folder can hold several sessions,
+and scan_ids restart in each). Partition rows are sorted by scan_id (then pair), so scan_id ranges are found with a
+binary search and pair filters compare integer codes. Columns are memory-mapped on read, a query only touches the
+columns and partitions it needs. schema.json holds row counts, scan_id ranges and the pairs of each partition so
+whole partitions are skipped without opening any column.
+'''
+
+TABLES = ["scan_history", "projected_trades_history", "executed_trades_history", "raw_profits_history", "balances_history"]
+HISTORY_FILE_PATTERN = re.compile(r"^(?P<table>{})_(?P<session>[0-9_]+)\.csv$".format("|".join(TABLES)))
+
+
+def get_time_secs(timestamps):
+    '''
+    Converts recorded 'HH:MM:SS' timestamps (in recording order) to seconds since the first midnight of the session.
+    '''
+    seconds = pd.to_timedelta(timestamps).dt.total_seconds()
+    return seconds + np.cumsum(np.where(seconds.diff() < 0, 86400, 0))  # timestamps wrap at midnight
+
+
+def write_partition(partition_path, history):
+    '''
+    Writes one session's history dataframe as a partition. Written to a temporary folder first and renamed into place,
+    so readers never see a half-written partition.
+    '''
+    sort_columns = [column for column in ["scan_id", "pair"] if column in history.columns]
+    history = history.sort_values(sort_columns, kind="stable").reset_index(drop=True)
+
+    temp_path = partition_path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    columns = []
+    for column in history.columns:
+        values = history[column]
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            np.save(os.path.join(temp_path, column + ".npy"), values.to_numpy())
+            columns.append({"name": column, "kind": "numeric"})
+        else:
+            categorical = pd.Categorical(values)
+            np.save(os.path.join(temp_path, column + ".codes.npy"), categorical.codes.astype(np.int32))
+            np.save(os.path.join(temp_path, column + ".categories.npy"), np.array(categorical.categories.astype(str), dtype=str))
+            columns.append({"name": column, "kind": "category"})
+
+    schema = {"columns": columns, "num_rows": len(history)}
+    if "scan_id" in history.columns and len(history) > 0:
+        schema["min_scan_id"], schema["max_scan_id"] = int(history["scan_id"].min()), int(history["scan_id"].max())
+    if "pair" in history.columns:
+        schema["pairs"] = sorted(history["pair"].dropna().astype(str).unique().tolist())
+
+    with open(os.path.join(temp_path, "schema.json"), "w") as schema_file:
+        json.dump(schema, schema_file)
+
+    shutil.rmtree(partition_path, ignore_errors=True)
+    os.rename(temp_path, partition_path)
+
+
+def convert(data_path, dataset_path, overwrite=False):
+    '''
+    Converts every saved history csv under 'data_path' (run folders like data/run*, or a single SAVE_PATH folder) into
+    the dataset. Sessions already in the dataset are skipped unless 'overwrite', so it can be re-run after every run.
+    @Returns
+    number of partitions written
+    '''
+    num_written = 0
+    for csv_path in sorted(glob.glob(os.path.join(data_path, "**", "*.csv"), recursive=True)):
+        match = HISTORY_FILE_PATTERN.match(os.path.basename(csv_path))
+        if match is None:
+            continue
+
+        run = os.path.relpath(os.path.dirname(csv_path), data_path).replace(os.sep, "_")
+        run = os.path.basename(os.path.normpath(data_path)) if run == "." else run
+        partition_path = os.path.join(dataset_path, match.group("table"), run, match.group("session"))
+        if os.path.exists(os.path.join(partition_path, "schema.json")) and not overwrite:
+            continue
+
+        history = pd.read_csv(csv_path)
+        if "timestamp" in history.columns:
+            history["time_secs"] = get_time_secs(history["timestamp"])
+
+        write_partition(partition_path, history)
+        num_written += 1
+
+    return num_written
+
+
+class HistoryDataset():
+    '''
+    Query layer over a converted dataset. Every table is queryable across all runs by run, session, scan_id range and
+    pair. Results are dataframes with 'run' and 'session' columns added.
+    '''
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.partitions = {table: [] for table in TABLES}  # table -> [(run, session, path, schema)]
+
+        for schema_path in sorted(glob.glob(os.path.join(dataset_path, "*", "*", "*", "schema.json"))):
+            partition_path = os.path.dirname(schema_path)
+            session_path, session = os.path.split(partition_path)
+            table_path, run = os.path.split(session_path)
+            table = os.path.basename(table_path)
+            if table not in self.partitions:
+                continue
+
+            with open(schema_path) as schema_file:
+                self.partitions[table].append((run, session, partition_path, json.load(schema_file)))
+
+    def get_runs(self, table="scan_history"):
+        return pd.DataFrame([{"run": run, "session": session, "num_rows": schema["num_rows"],
+                              "min_scan_id": schema.get("min_scan_id"), "max_scan_id": schema.get("max_scan_id")}
+                             for run, session, _, schema in self.partitions[table]])
+
+    def read_partition(self, partition_path, schema, columns, scan_ids, pairs):
+        '''
+        Reads the rows of one partition matching the scan_id range and pairs (columns are memory-mapped).
+        '''
+        available = {column["name"]: column["kind"] for column in schema["columns"]}
+        load = lambda name, suffix: np.load(os.path.join(partition_path, name + suffix), mmap_mode="r")
+
+        rows = slice(0, schema["num_rows"])
+        if scan_ids is not None and "scan_id" in available:
+            scan_id_column = load("scan_id", ".npy")
+            rows = slice(np.searchsorted(scan_id_column, scan_ids[0], side="left"), np.searchsorted(scan_id_column, scan_ids[1], side="right"))
+
+        mask = None
+        if pairs is not None and "pair" in available:
+            codes = np.flatnonzero(np.isin(load("pair", ".categories.npy"), list(pairs)))
+            mask = np.isin(load("pair", ".codes.npy")[rows], codes)
+
+        history = {}
+        for name in (columns if columns is not None else available.keys()):
+            if name not in available:
+                continue
+
+            if available[name] == "numeric":
+                values = np.asarray(load(name, ".npy")[rows])
+            else:
+                codes = np.asarray(load(name, ".codes.npy")[rows])
+                values = pd.Categorical.from_codes(codes, load(name, ".categories.npy"))
+            history[name] = values[mask] if mask is not None else values
+
+        return pd.DataFrame(history)
+
+    def query(self, table, runs=None, scan_ids=None, pairs=None, columns=None):
+        '''
+        @Returns
+        dataframe of 'table' rows in 'runs' (all if None), with scan_id in the inclusive (first, last) 'scan_ids' range
+        and pair in 'pairs'. Only 'columns' are read when given.
+        '''
+        pairs = set(pairs) if pairs is not None else None
+
+        histories = []
+        for run, session, partition_path, schema in self.partitions[table]:
+            if runs is not None and run not in runs:
+                continue
+            if scan_ids is not None and "min_scan_id" in schema and (schema["max_scan_id"] < scan_ids[0] or schema["min_scan_id"] > scan_ids[1]):
+                continue
+            if pairs is not None and "pairs" in schema and pairs.isdisjoint(schema["pairs"]):
+                continue
+
+            history = self.read_partition(partition_path, schema, columns, scan_ids, pairs)
+            history.insert(0, "session", session)
+            history.insert(0, "run", run)
+            histories.append(history)
+
+        if len(histories) == 0:
+            return pd.DataFrame()
+
+        return pd.concat(histories, ignore_index=True)
+
+    def get_opportunity_episodes(self, runs=None, pairs=None, min_profit_percent=0.0):
+        '''
+        Finds every stretch of consecutive scans in which a triangle stays above the fee threshold (3 * maker fee of its
+        exchange plus 'min_profit_percent'). A triangle missing from a scan (not retained) ends its stretch.
+        @Returns
+        dataframe with one row per episode (run, session, pair, start/end scan_id, num_scans, lifetime_secs, max_profit)
+        '''
+        scans = self.query("scan_history", runs=runs, pairs=pairs, columns=["scan_id", "exchange", "pair", "net_forward", "net_reverse", "time_secs"])
+        if len(scans) == 0:
+            return pd.DataFrame()
+
+        maker_fees = scans["exchange"].astype(str).map({name: fees["maker"] for name, fees in parameters.TRADING_FEES.items()})
+        threshold = maker_fees * 3 * 100 + min_profit_percent  # 3 trades required for arbitrage hence *3
+        scans["profit"] = scans[["net_forward", "net_reverse"]].max(axis=1)
+        scans = scans[scans["profit"] > threshold].sort_values(["run", "session", "pair", "scan_id"], kind="stable")
+        if len(scans) == 0:
+            return pd.DataFrame()
+
+        same_triangle = (scans[["run", "session", "pair"]].astype(str) == scans[["run", "session", "pair"]].astype(str).shift()).all(axis=1)
+        continues = same_triangle & (scans["scan_id"].diff() == 1)
+        scans["episode"] = np.cumsum(~continues.to_numpy())
+
+        episodes = scans.groupby("episode").agg(run=("run", "first"), session=("session", "first"), pair=("pair", "first"),
+                                                start_scan_id=("scan_id", "first"), end_scan_id=("scan_id", "last"),
+                                                num_scans=("scan_id", "size"), start_secs=("time_secs", "first"),
+                                                end_secs=("time_secs", "last"), max_profit=("profit", "max"))
+        episodes["lifetime_secs"] = episodes["end_secs"] - episodes["start_secs"]
+
+        return episodes.reset_index(drop=True)
+
+    def get_opportunity_report(self, runs=None, pairs=None, min_profit_percent=0.0):
+        '''
+        Per-triangle lifetime and recurrence report across all runs.
+        @Returns
+        dataframe indexed by pair: episodes, lifetime stats (scans and secs), mean secs between episode starts and
+        episodes per observed hour
+        '''
+        episodes = self.get_opportunity_episodes(runs, pairs, min_profit_percent)
+        if len(episodes) == 0:
+            return pd.DataFrame()
+
+        scans = self.query("scan_history", runs=runs, pairs=pairs, columns=["pair", "time_secs"])
+        observed_secs = scans.groupby(["run", "session", "pair"], observed=True)["time_secs"].agg(lambda secs: secs.max() - secs.min())
+        observed_hours = observed_secs.groupby(level="pair", observed=True).sum() / 3600
+
+        episodes["pair"] = episodes["pair"].astype(str)
+        gaps = episodes.groupby(["run", "session", "pair"])["start_secs"].diff()  # episodes are ordered by start within a triangle
+
+        report = episodes.groupby("pair").agg(episodes=("num_scans", "size"), mean_lifetime_scans=("num_scans", "mean"),
+                                              max_lifetime_scans=("num_scans", "max"), mean_lifetime_secs=("lifetime_secs", "mean"),
+                                              median_lifetime_secs=("lifetime_secs", "median"), max_lifetime_secs=("lifetime_secs", "max"),
+                                              max_profit=("max_profit", "max"))
+        report["mean_recurrence_secs"] = gaps.groupby(episodes["pair"]).mean()
+        observed_hours.index = observed_hours.index.astype(str)
+        report["episodes_per_hour"] = report["episodes"] / observed_hours.reindex(report.index).replace(0, np.nan)
+
+        return report.sort_values("episodes", ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert saved histories to a columnar dataset and report on opportunity lifetimes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="convert saved history csvs (e.g. data/run*) into the dataset")
+    convert_parser.add_argument("data_path", nargs="?", default="data")
+    convert_parser.add_argument("dataset_path", nargs="?", default="dataset")
+    convert_parser.add_argument("--overwrite", action="store_true")
+
+    report_parser = subparsers.add_parser("report", help="per-triangle opportunity lifetime and recurrence report")
+    report_parser.add_argument("dataset_path", nargs="?", default="dataset")
+    report_parser.add_argument("--min-profit", type=float, default=parameters.MIN_PROFIT, help="decimal percent on top of the fees")
+    report_parser.add_argument("--output", default="opportunity_report.csv")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == "convert":
+        num_written = convert(args.data_path, args.dataset_path, args.overwrite)
+        print("Wrote {} partitions to {} in {} secs.".format(num_written, args.dataset_path, round(time.time() - start, 3)))
+    else:
+        report = HistoryDataset(args.dataset_path).get_opportunity_report(min_profit_percent=args.min_profit * 100)
+        report.to_csv(args.output)
+        print(report.head(20).to_string())
+        print("Report over {} triangles in {} secs.".format(len(report), round(time.time() - start, 3)))
+
+
+if __name__ == '__main__':
+    main()
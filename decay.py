@@ -0,0 +1,149 @@
+import parameters
+import log
+
+import numpy as np
+import pandas as pd
+import glob
+import time
+
+
+class DecayModel():
+    '''
+    Per-triangle opportunity decay model used to rank triangles by the profit expected to be left when execution lands.
+    Each triangle's best profit is treated as reverting to its own rolling mean: the excess over the mean shrinks by a
+    learned persistence factor per second (AR(1) on scan-to-scan excesses, kept as exponentially weighted sums).
+    Expected realized profit = mean + excess * persistence ^ expected latency, where expected latency comes from live
+    per-leg execution time measurements. Every update and evaluation is a handful of vectorized operations per scan.
+    Each triangle keeps its own observation interval, so triangles scanned at different cadences (tiered scanning)
+    convert their per-observation persistence to per-second persistence over their own interval.
+    '''
+    def __init__(self, alpha, min_observations, default_latency_secs):
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.state = pd.DataFrame(columns=["count", "mean", "excess", "time", "interval", "sum_xy", "sum_xx"], dtype=float)
+
+        self.leg_latency_secs = {}  # trade_num -> ewma secs
+        self.overhead_latency_secs = default_latency_secs  # scan + planning time not spent placing legs
+
+    def update(self, profits, now):
+        '''
+        Adds one scan of best profit percents (Series indexed by pair) observed at epoch secs 'now'.
+        '''
+        old_state = self.state
+        state = old_state.reindex(profits.index)
+        profits = profits.to_numpy(dtype=float)
+        seen = state["count"].notna().to_numpy()
+        continuous = seen & state["time"].notna().to_numpy()  # previous observation is from the same run
+
+        old_mean = np.where(seen, state["mean"], profits)
+        prev_excess = state["excess"].to_numpy()
+        excess = profits - old_mean
+
+        # ewma of the secs between each triangle's own observations
+        old_interval = state["interval"].to_numpy()
+        interval = now - state["time"].to_numpy()
+        interval = np.where(continuous, np.where(np.isnan(old_interval), interval, old_interval + self.alpha * (interval - old_interval)), old_interval)
+
+        sum_xy = state["sum_xy"].fillna(0).to_numpy()
+        sum_xx = state["sum_xx"].fillna(0).to_numpy()
+        sum_xy = np.where(continuous, (1 - self.alpha) * sum_xy + self.alpha * excess * prev_excess, sum_xy)
+        sum_xx = np.where(continuous, (1 - self.alpha) * sum_xx + self.alpha * prev_excess ** 2, sum_xx)
+
+        self.state = pd.DataFrame({"count": np.where(seen, state["count"] + 1, 1), "mean": old_mean + self.alpha * excess,
+                                   "excess": excess, "time": now, "interval": interval, "sum_xy": sum_xy, "sum_xx": sum_xx}, index=state.index)
+
+        # keep triangles missing from this scan (e.g. halted) in case they come back
+        dropped = old_state.index.difference(state.index)
+        if len(dropped) > 0:
+            self.state = pd.concat([self.state, old_state.loc[dropped]])
+
+    def get_persistence(self):
+        '''
+        @Returns
+        per-second persistence (0..1) of each triangle's excess profit, pooled across triangles until one has enough
+        observations of its own, over the triangle's own observation interval (the median one until it has its own)
+        '''
+        intervals = self.state["interval"].where(self.state["interval"] > 0)
+        intervals = intervals.fillna(intervals.median())
+        if intervals.isna().all():
+            return pd.Series(0.0, index=self.state.index)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pooled = np.clip(self.state["sum_xy"].sum() / self.state["sum_xx"].sum(), 0, 1)
+            own = np.clip(self.state["sum_xy"] / self.state["sum_xx"], 0, 1)
+
+        per_scan = own.where((self.state["count"] > self.min_observations) & own.notna(), pooled).fillna(0)
+
+        return (per_scan ** (1 / intervals)).fillna(0)
+
+    def get_legs_latency(self, leg_secs):
+        if parameters.EXECUTION_MODE == "simultaneous":
+            return max(leg_secs, default=0)  # all legs go out together
+
+        return sum(leg_secs)
+
+    def get_expected_latency(self):
+        return self.overhead_latency_secs + self.get_legs_latency(self.leg_latency_secs.values())
+
+    def get_expected_profits(self, pairs):
+        '''
+        @Returns
+        Series of expected realized profit percent per pair after the expected execution latency
+        '''
+        state = self.state.reindex(pairs)
+        persistence = self.get_persistence().reindex(pairs)
+
+        return state["mean"] + state["excess"] * persistence ** self.get_expected_latency()
+
+    def add_expected_profit(self, scan):
+        '''
+        Updates the model with a scan and adds an 'expected_profit' column to it.
+        '''
+        profits = scan[["net_forward", "net_reverse"]].max(axis=1).set_axis(scan["pair"])
+        self.update(profits, time.time())
+        scan["expected_profit"] = self.get_expected_profits(scan["pair"]).to_numpy()
+
+    def record_execution(self, executed_trades, total_secs):
+        '''
+        Updates latency estimates from an executed trade plan (per-leg 'execution_time_secs') and its total time.
+        '''
+        if len(executed_trades) == 0 or "execution_time_secs" not in executed_trades.columns:
+            return
+
+        leg_secs = executed_trades.groupby("trade_num")["execution_time_secs"].apply(lambda secs: pd.to_numeric(secs, errors="coerce").sum())
+        for trade_num, secs in leg_secs.items():
+            previous = self.leg_latency_secs.get(trade_num, secs)
+            self.leg_latency_secs[trade_num] = previous + self.alpha * (secs - previous)
+
+        overhead_secs = max(total_secs - self.get_legs_latency(leg_secs.values), 0)
+        self.overhead_latency_secs += self.alpha * (overhead_secs - self.overhead_latency_secs)
+
+    def fit_history(self, path_pattern):
+        '''
+        Warms the model up by replaying recorded scan_history csvs (oldest first) matching 'path_pattern'.
+        '''
+        scan_history_paths = sorted(glob.glob(path_pattern))
+        for scan_history_path in scan_history_paths:
+            scans = pd.read_csv(scan_history_path, usecols=["scan_id", "pair", "net_forward", "net_reverse", "timestamp"])
+            seconds = pd.to_timedelta(scans["timestamp"]).dt.total_seconds()
+            scans["scan_time"] = seconds + np.cumsum(np.where(seconds.diff() < 0, 86400, 0))  # timestamps wrap at midnight
+
+            for scan_id, scan in scans.groupby("scan_id", sort=True):
+                profits = scan[["net_forward", "net_reverse"]].max(axis=1).set_axis(scan["pair"])
+                self.update(profits[~profits.index.duplicated()], scan["scan_time"].iloc[0])
+
+            self.state["time"] = np.nan  # next run's first scan isn't a continuation of this one
+
+        if len(scan_history_paths) > 0:
+            log.print_status("Decay model warmed up from {} recorded runs ({} triangles).".format(len(scan_history_paths), len(self.state)))
+
+
+def get_decay_model():
+    '''
+    Creates the decay model and warms it up from recorded runs in DECAY_HISTORY_PATH (if set).
+    '''
+    model = DecayModel(parameters.DECAY_EWMA_ALPHA, parameters.DECAY_MIN_OBSERVATIONS, parameters.DECAY_DEFAULT_LATENCY_SECONDS)
+    if parameters.DECAY_HISTORY_PATH != "":
+        model.fit_history(parameters.DECAY_HISTORY_PATH)
+
+    return model
@@ -1,14 +1,15 @@
-from kucoin.client import Market as KucoinMarket
-from kucoin.client import Trade as KucoinTrade
-from kucoin.client import User as KucoinUser
-from binance.client import Client as BinanceClient
-
 import parameters
+import resilience
+import clocksync
+import adapters
 import market
 import helper
 import log
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import threading
+import time
 import sys
 
 
@@ -16,6 +17,7 @@ class Exchange():
     def __init__(self, exchange_name, target_asset, api_public, api_secret, passphrase):
         self.name = exchange_name
         self.target_asset = target_asset
+        self.account_name = "main"
 
         self.api_public = api_public
         self.api_secret = api_secret
@@ -27,105 +29,139 @@ class Exchange():
         self.trading_target_qty, self.reserve_target_qty = self.update_target_qty_partitions()
         self.total_starting_target_qty = self.trading_target_qty + self.reserve_target_qty
 
+        # asset -> target asset rates from the latest scan snapshot, used to value the balance ledger
+        self.conversion_rates = pd.Series(dtype=float)
+        self.total_starting_account_value = None
+
+        # rolling per-symbol price history built on the first scan
+        self.price_history = None
+        self.price_history_pairs = None  # pair -> row of triangle_leg_indices
+        self.triangle_leg_indices = None
+
+        # working balances of intermediate assets used for simultaneous leg execution
+        self.inventory = {}
+        self.inventory_drift = {}
+        self.rebalance_history = []
+        self.inventory_lock = threading.Lock()
+        self.rebalance_event = threading.Event()
+
     def establish_connections(self):
         '''
-        Establishes clients for each API function (market, trade, user)
-        '''
-        if self.name == "BINANCE.US":
-            self.market = BinanceClient(self.api_public, self.api_secret, tld='us')
-            self.trade = self.market
-            self.user = self.market
-        elif self.name == "BINANCE":
-            self.market = BinanceClient(self.api_public, self.api_secret)
-            self.trade = self.market
-            self.user = self.market
-        elif self.name == "KUCOIN":
-            self.market = KucoinMarket()
-            self.trade = KucoinTrade(self.api_public, self.api_secret, self.passphrase)
-            self.user = KucoinUser(self.api_public, self.api_secret, self.passphrase)
-        else:
-            log.print_status(self.name, "exchange not supported.")
+        Establishes the venue adapter that wraps each API function (market, trade, user).
+        '''
+        self.adapter = adapters.get_adapter(self.name, self.api_public, self.api_secret, self.passphrase)
+        if self.adapter is None:
+            log.print_status("{} exchange not supported.".format(self.name))
             sys.exit()
 
-    def extrapolate_binance_info(self, exchange_info):
-        '''
-        '''
-        assets_info = []
-        for i in range(len(exchange_info)):
-            filters = pd.DataFrame(exchange_info.iloc[i]["filters"]).set_index("filterType")
-            asset_info = {
-                "name": exchange_info.iloc[i]["baseAsset"] + exchange_info.iloc[i]["quoteAsset"],
-                "baseAsset": exchange_info.iloc[i]["baseAsset"],
-                "quoteAsset": exchange_info.iloc[i]["quoteAsset"],
-                "baseMinQty": float(filters.loc["LOT_SIZE"]["minQty"]),
-                "baseMaxQty": float(filters.loc["LOT_SIZE"]["maxQty"]),
-                "baseQtyPrecision": helper.get_precision(filters.loc["LOT_SIZE"]["stepSize"]),  # TODO: add "quoteQtyPrecision" later....
-                "basePricePrecision": helper.get_precision(filters.loc["PRICE_FILTER"]["tickSize"]),
-                "baseMinNotional": float(filters.loc["MIN_NOTIONAL"]["minNotional"])
-            }
-
-            assets_info.append(asset_info)
-
-        return pd.DataFrame(assets_info).set_index("name")
-
-    def extrapolate_kucoin_info(self, exchange_info):
-        assets_info = []
-        for i in range(len(exchange_info)):
-            asset_info = {
-                "name": exchange_info.iloc[i]["name"].replace("-", ""),
-                "baseAsset": exchange_info.iloc[i]["baseCurrency"],
-                "quoteAsset": exchange_info.iloc[i]["quoteCurrency"],
-                "baseMinQty": float(exchange_info.iloc[i]["baseMinSize"]),
-                "baseMaxQty": float(exchange_info.iloc[i]["baseMaxSize"]),
-                "baseQtyPrecision": int(helper.get_precision(exchange_info.iloc[i]["baseIncrement"])),
-                "quoteQtyPrecision": int(helper.get_precision(exchange_info.iloc[i]["quoteIncrement"])),
-                "basePricePrecision": int(helper.get_precision(exchange_info.iloc[i]["priceIncrement"])),
-                "baseMinNotional": ""
-            }
-
-            assets_info.append(asset_info)
-
-        return pd.DataFrame(assets_info).set_index("name")
+        self.breakers = {"primary": resilience.CircuitBreaker("{} market data".format(self.name)),
+                         "fallback": resilience.CircuitBreaker("{} fallback market data".format(self.name))}
+        self.last_snapshot = None
+        self.last_snapshot_time = 0
+        self.recorder = None  # raw market data recorder, set by main when RECORD_MARKET_DATA is on
+        self.snapshot_bus = None  # shared memory snapshot publisher, set by main when PUBLISH_SNAPSHOT_BUS is on
+        self.prefetcher = None  # leg orderbook prefetcher, set by main when PREFETCH_TOP_N > 0
+        self.decay_model = None  # opportunity decay model, set by main when LATENCY_AWARE_RANKING is on
+        self.negative_cache = None  # triangles that recently failed planning, set by main when NEGATIVE_CACHE is on
+        self.accounts = None  # main + sub-account dispatch pool, set by main when SUB_ACCOUNTS are configured
+        self.attribution = None  # per-leg slippage and fill latency distributions, set by main when EXECUTION_ATTRIBUTION is on
+        self.tiering = None  # hot/cold triangle refresh scheduler, set by main when TIERED_SCANNING is on
+        self.rate_limiter = resilience.RateLimiter(parameters.ACCOUNT_REQUESTS_PER_SECOND, parameters.ACCOUNT_REQUEST_BURST)
+
+        self.clock = clocksync.ClockSync(self.name, self.adapter.get_server_time)
+        self.clock.start()
 
     def get_assets_info(self):
         '''
         '''
-        if self.name == "BINANCE" or self.name == "BINANCE.US":
-            return self.extrapolate_binance_info(pd.DataFrame(self.market.get_exchange_info()["symbols"]))
-        elif self.name == "KUCOIN":
-            return self.extrapolate_kucoin_info(pd.DataFrame(self.market.get_symbol_list()))
+        return self.adapter.get_assets_info()  # ** API CALL **
 
-    def get_valid_pairs(self):
+    def get_pair_info(self, symbol):
         '''
-        Gets valid pairs that can be used in arbitrage trades.
+        Returns assets info row for a venue-formatted symbol.
+        '''
+        return self.assets_info.loc[self.adapter.stripped_symbols[symbol]]
+
+    def get_candidate_pairs(self, assets_info):
+        '''
+        Pairs whose base and quote assets both trade against the target asset, with all three legs open for trading.
+        '''
+        trading = assets_info[assets_info["tradingEnabled"]] if "tradingEnabled" in assets_info.columns else assets_info
+        has_legs = (trading["baseAsset"] + self.target_asset).isin(trading.index) & (trading["quoteAsset"] + self.target_asset).isin(trading.index)
+
+        return list(trading.index[has_legs])
+
+    def get_valid_pairs(self, candidate_pairs=None, assets_info=None):
         '''
+        Gets valid pairs that can be used in arbitrage trades. Only candidate pairs (all by default) are probed.
+        '''
+        assets_info = self.assets_info if assets_info is None else assets_info
+        if candidate_pairs is None:
+            candidate_pairs = self.get_candidate_pairs(assets_info)
+
         valid_pairs = []
-        unwinded_assets_info = self.assets_info.reset_index()
-        for i in range(len(unwinded_assets_info)):
-            asset_info = unwinded_assets_info.iloc[i]
-            try:
-                self.assets_info.loc[asset_info["baseAsset"] + self.target_asset]
-                self.assets_info.loc[asset_info["quoteAsset"] + self.target_asset]
-                orderbook = market.get_pair_orderbook(self, asset_info["baseAsset"], asset_info["quoteAsset"])
+        for pair in candidate_pairs:
+            orderbook = market.get_pair_orderbook(self, assets_info.loc[pair]["baseAsset"], assets_info.loc[pair]["quoteAsset"])
 
-                if orderbook is not None:
-                    if len(orderbook["bids"]) != 0 and len(orderbook["asks"]) != 0:  # doesn't mark pair valid if no bids or asks for pair
-                        valid_pairs.append(asset_info["name"])
-            except KeyError:
-                pass  # not a valid asset pair for arbitrage, not added to valid pairs list
+            if orderbook is not None:
+                if len(orderbook["bids"]) != 0 and len(orderbook["asks"]) != 0:  # doesn't mark pair valid if no bids or asks for pair
+                    valid_pairs.append(pair)
 
         log.print_status("Found {} valid pairs on {}.".format(len(valid_pairs), self.name))
 
         return valid_pairs
 
+    def refresh_symbol_universe(self):
+        '''
+        Re-reads exchange info and diffs the triangle universe against the current valid pairs. Only newly listed pairs
+        are probed, halted or delisted pairs are dropped and everything else is kept as is. The new assets info and
+        valid pairs are swapped in whole, so a scan in progress keeps using the lists it started with.
+        @Returns
+        (added pairs, removed pairs)
+        '''
+        assets_info = self.get_assets_info()  # ** API CALL **
+        vanished = self.assets_info.index.difference(assets_info.index)
+        if len(vanished) > 0:  # keep delisted rows (marked not trading) for lookups by in-flight trades
+            assets_info = pd.concat([assets_info, self.assets_info.loc[vanished].assign(tradingEnabled=False)])
+
+        candidate_pairs = set(self.get_candidate_pairs(assets_info))
+        removed_pairs = [pair for pair in self.valid_pairs if pair not in candidate_pairs]
+        added_pairs = []
+        new_pairs = sorted(candidate_pairs.difference(self.valid_pairs))
+        if len(new_pairs) > 0:
+            added_pairs = self.get_valid_pairs(new_pairs, assets_info)  # ** API CALL **
+
+        self.assets_info = assets_info
+        if self.accounts is not None:
+            self.accounts.sync_symbols()  # sub-account adapters look symbols up in the refreshed mappings
+        if len(added_pairs) > 0 or len(removed_pairs) > 0:
+            self.valid_pairs = [pair for pair in self.valid_pairs if pair not in removed_pairs] + added_pairs
+            log.print_status("MSG: Symbol universe changed. Added {}, removed {} ({} valid pairs).".format(added_pairs, removed_pairs, len(self.valid_pairs)))
+
+        return added_pairs, removed_pairs
+
+    def symbol_refresh_loop(self):
+        '''
+        Refreshes the symbol universe every SYMBOL_REFRESH_INTERVAL_SECONDS.
+        '''
+        while True:
+            time.sleep(parameters.SYMBOL_REFRESH_INTERVAL_SECONDS)
+            try:
+                self.refresh_symbol_universe()
+            except Exception as e:
+                log.print_status("WARNING: Symbol universe refresh failed -> " + str(e))
+
+    def start_symbol_refresher(self):
+        '''
+        Starts background symbol universe refresh thread.
+        '''
+        threading.Thread(target=self.symbol_refresh_loop, daemon=True).start()
+
     def update_target_qty_partitions(self):
         '''
         Get starting target quantity and compute the amount of tradeable target qty and reserve target qty.
         '''
-        if self.name == "BINANCE.US" or self.name == "BINANCE":
-            starting_target_qty = float(self.user.get_asset_balance(asset=parameters.TARGET_ASSET)['free'])  # ** API CALL **
-        elif self.name == "KUCOIN":
-            starting_target_qty = float(pd.DataFrame(self.user.get_account_list()).set_index("currency").loc[parameters.TARGET_ASSET]["available"])  # ** API CALL **
+        starting_target_qty = self.adapter.get_available_qty(parameters.TARGET_ASSET)  # ** API CALL **
 
         trading_target_qty = starting_target_qty * (1 - parameters.TARGET_MIN_LIQUIDITY)
         reserve_target_qty = starting_target_qty - trading_target_qty
@@ -134,41 +170,245 @@ class Exchange():
 
         return trading_target_qty, reserve_target_qty
 
+    def place_batch_orders(self, trades):
+        '''
+        Places several independent limit orders at once. Orders are grouped by symbol so each group goes out in as few
+        requests as the venue allows, and the groups are sent concurrently.
+        trades: list of (trade_num, trade) tuples with prepped trades
+        @Returns
+        list of normalized order details (None where placement failed) in the same order as 'trades'
+        '''
+        groups = {}
+        for i, (trade_num, trade) in enumerate(trades):
+            groups.setdefault(trade["pair"], []).append(i)
+
+        symbols = list(groups.keys())
+        with ThreadPoolExecutor(max_workers=len(symbols)) as pool:
+            group_responses = list(pool.map(lambda symbol: self.adapter.place_symbol_batch(symbol, [trades[i] for i in groups[symbol]]), symbols))
+
+        orders = [None] * len(trades)
+        for symbol, responses in zip(symbols, group_responses):
+            for i, response in zip(groups[symbol], responses):
+                if response is not None:
+                    orders[i] = self.adapter.normalize_order_details(response, trades[i][1], trades[i][0])
+
+        return orders
+
+    def cancel_batch_orders(self, orders):
+        '''
+        Cancels several open orders at once, by order id (other open orders on the same symbols are left alone).
+        @Returns
+        list of canceled order ids
+        '''
+        open_orders = [order for order in orders if order is not None and order["pending"]]
+        if len(open_orders) == 0:
+            return []
+
+        try:
+            canceled = self.adapter.cancel_orders(open_orders)  # ** API CALL **
+        except Exception as e:
+            log.print_status("MSG: Failed to cancel batch orders. API Reason -> " + str(e))  # most likely already completed
+            return []
+
+        log.print_status("MSG: {} order(s) canceled.".format(len(canceled)))
+
+        return canceled
+
     def get_balances(self):
         '''
         Gets exchange current balance of all assets.
         '''
         log.print_status("Collecting balances...")
-        if self.name == "BINANCE" or self.name == "BINANCE.US":
-            # TODO
+        balances = self.adapter.get_balances()  # ** API CALL **
 
-            balances = "TODO LATER"  # TODO
+        return balances[balances["balance"] > 0]  # only return assets with an available balance over zero.
 
-        elif self.name == "KUCOIN":
-            balances = pd.DataFrame(self.user.get_account_list())
-            balances = balances.rename(columns={"currency": "asset"})
-            balances["balance"] = balances["balance"].astype(float)
+    def value_balances(self, balances):
+        '''
+        Values the whole balance ledger in the target asset as one vectorized operation using the
+        conversion rates of the latest scan snapshot (no API calls). Unpriceable assets get a NaN value.
+        @Returns
+        balances dataframe with added 'target_rate', 'target_value' and 'dust' columns
+        '''
+        balances = balances.copy()
+        balances["target_rate"] = balances["asset"].map(self.conversion_rates)
+        balances["target_value"] = balances["balance"] * balances["target_rate"]
+        balances["dust"] = balances["target_value"] < parameters.DUST_MAX_TARGET_VALUE
 
-        return balances[balances["balance"] > 0]  # only return assets with an available balance over zero.
+        return balances
+
+    def get_account_value(self, balances):
+        '''
+        Gets total account value in the target asset.
+        '''
+        return self.value_balances(balances)["target_value"].sum()
 
     def check_stop_loss(self, balances):
         '''
-        Check to see if stop loss for specified base stablcoin was exceeded.
+        Check to see if stop loss was exceeded. Uses total account value when the latest snapshot can value the ledger,
+        otherwise falls back to the target asset balance alone.
         '''
+        if self.total_starting_account_value is not None and len(self.conversion_rates) > 0:
+            if self.get_account_value(balances) < (self.total_starting_account_value * (1 - parameters.TARGET_STOP)):
+                return True
+
+            return False
+
         if balances.set_index("asset").loc[parameters.TARGET_ASSET]["balance"] < (self.total_starting_target_qty * (1 - parameters.TARGET_STOP)):
             return True
 
         return False
 
+    def get_asset_target_price(self, asset):
+        '''
+        Gets the price of 'asset' in the target asset, from the latest snapshot when possible. Returns None if it can't be priced.
+        '''
+        if asset in self.conversion_rates.index:
+            return self.conversion_rates[asset]  # priced from the latest scan snapshot
+
+        orderbook = market.get_pair_orderbook(self, asset, self.target_asset)  # ** API CALL **
+        if orderbook is None or len(orderbook["bids"]) == 0 or len(orderbook["asks"]) == 0:
+            return None
+
+        return (float(orderbook["bids"][0][0]) + float(orderbook["asks"][0][0])) / 2
+
     def rebalance_portfolio(self):
         '''
+        Keeps a working balance of each inventory asset at INVENTORY_TARGET_PERCENT of the trading target qty so that
+        all three arbitrage legs can be sent at the same moment. Balances within INVENTORY_DRIFT_TOLERANCE are left alone.
+        Balances, prices and rebalance orders go out without holding 'inventory_lock' (so simultaneous executions are never
+        kept waiting on them); the lock is only taken to book the results into 'inventory'.
+        @Returns
+        list of rebalance orders placed
+        '''
+        rebalance_orders = []
+        held_qtys = {}
+
+        with self.inventory_lock:
+            booked_inventory = dict(self.inventory)  # executions booked after this are carried over below
+
+        balances = self.get_balances().set_index("asset")  # ** API CALL **
+        target_value = self.trading_target_qty * parameters.INVENTORY_TARGET_PERCENT
+
+        for asset in parameters.INVENTORY_ASSETS:
+            symbol = asset + self.target_asset
+            if asset == self.target_asset or symbol not in self.assets_info.index:
+                continue
+
+            price = self.get_asset_target_price(asset)  # ** API CALL ** (when not in the latest snapshot)
+            if price is None:
+                log.print_status("MSG: Could not price {} inventory. Skipping rebalance.".format(asset))
+                continue
+
+            try:
+                held_qty = float(balances.loc[asset]["available"])
+            except KeyError:
+                held_qty = 0
+
+            held_qtys[asset] = held_qty
+            held_value = held_qty * price
+            if abs(held_value - target_value) <= target_value * parameters.INVENTORY_DRIFT_TOLERANCE:
+                continue
+
+            order_type = "buy" if held_value < target_value else "sell"
+            qty = helper.round_decimals_down(abs(target_value - held_value) / price, int(self.assets_info.loc[symbol]["baseQtyPrecision"]))
+            rebalance_trade = {"pair": symbol, "price": price, "qty": qty}
+
+            if not (helper.check_min_notional(self, rebalance_trade, symbol) and helper.check_qty(self, rebalance_trade, symbol)):
+                continue
+
+            try:
+                order = self.adapter.place_market_order(self.adapter.get_symbol(asset, self.target_asset), order_type, qty)  # ** API CALL **
+            except Exception as e:
+                log.print_status("WARNING: Rebalance order for {} failed. API Reason -> {}".format(asset, str(e)))
+                continue
+
+            log.print_status("REBAL   -> {} {} {}".format(order_type, qty, asset))
+            held_qtys[asset] = held_qty + qty if order_type == "buy" else held_qty - qty
+            rebalance_orders.append({"asset": asset, "order_type": order_type, "qty": qty, "price": price, "order": order})
+
+        with self.inventory_lock:
+            for asset, held_qty in held_qtys.items():
+                self.inventory[asset] = held_qty + self.inventory.get(asset, 0) - booked_inventory.get(asset, 0)
+            for rebalance_order in rebalance_orders:
+                self.inventory_drift[rebalance_order["asset"]] = 0  # drift is reset once the asset is back on target
+
+        self.rebalance_history += rebalance_orders
+
+        return rebalance_orders
+
+    def rebalance_loop(self):
+        '''
+        Rebalances inventory every REBALANCE_INTERVAL_SECONDS, or sooner when 'rebalance_event' is set.
+        '''
+        while True:
+            self.rebalance_event.wait(parameters.REBALANCE_INTERVAL_SECONDS)
+            self.rebalance_event.clear()
+            try:
+                self.rebalance_portfolio()
+            except Exception as e:
+                log.print_status("WARNING: Background rebalance failed -> " + str(e))
+
+    def start_rebalancer(self):
+        '''
+        Starts background inventory rebalancing thread.
+        '''
+        self.rebalance_portfolio()  # make sure inventory exists before the first simultaneous trade
+        threading.Thread(target=self.rebalance_loop, daemon=True).start()
+
+    def get_leg_assets(self, trade):
+        '''
+        Returns (spend_asset, receive_asset) for a single trade plan leg.
+        '''
+        pair_info = self.get_pair_info(trade["pair"])
+        base_asset, quote_asset = pair_info["baseAsset"], pair_info["quoteAsset"]
+
+        if trade["order_type"] == "buy":
+            return quote_asset, base_asset
+
+        return base_asset, quote_asset
+
+    def has_leg_inventory(self, trade_plan):
         '''
-        # rebalance portfolio when conditions met
-                    #     make sure a 1% qty total for these -> {'BTC', 'DAI', 'ETH', 'KCS', 'PAX', 'TRX', 'TUSD', 'USDC', 'USDT', 'UST'}
-                    #     make sure most qty in USDT (95%)
-                    #     make sure KCS at 4%
-                    #     record additional fees incurred to rebalance portfolio
-        return
+        Checks if held inventory covers every leg of 'trade_plan' so the legs can be sent simultaneously.
+        '''
+        for _, trade in trade_plan.iterrows():
+            spend_asset, _ = self.get_leg_assets(trade)
+            required_qty = trade["qty"] * float(trade["price"]) if trade["order_type"] == "buy" else trade["qty"]
+
+            if spend_asset == self.target_asset:
+                available_qty = self.trading_target_qty
+            else:
+                available_qty = self.inventory.get(spend_asset, 0)
+
+            if available_qty < required_qty:
+                log.print_status("MSG: Not enough {} inventory for simultaneous execution ({} < {}).".format(spend_asset, available_qty, required_qty))
+                return False
+
+        return True
+
+    def record_inventory_drift(self, trade, order):
+        '''
+        Updates held inventory with what a simultaneous leg actually filled and tracks how far each asset drifted from plan.
+        @Returns
+        leg fill drift in base asset qty (negative means the leg filled less than planned)
+        '''
+        spend_asset, receive_asset = self.get_leg_assets(trade)
+        planned_notional = trade["qty"] * float(trade["price"])
+
+        if trade["order_type"] == "buy":
+            planned = {spend_asset: -planned_notional, receive_asset: trade["qty"]}
+            actual = {spend_asset: -order["result_qty"], receive_asset: order["filled_qty"]}
+        else:
+            planned = {spend_asset: -trade["qty"], receive_asset: planned_notional}
+            actual = {spend_asset: -order["filled_qty"], receive_asset: order["result_qty"]}
+
+        for asset in planned:
+            if asset != self.target_asset:
+                self.inventory[asset] = self.inventory.get(asset, 0) + actual[asset]
+                self.inventory_drift[asset] = self.inventory_drift.get(asset, 0) + (actual[asset] - planned[asset])
+
+        return order["filled_qty"] - trade["qty"]
 
 
 def get_exchange(user_input):
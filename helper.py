@@ -1,4 +1,6 @@
 import log
+
+import numpy as np
 import math
 
 
@@ -10,6 +12,79 @@ def get_precision(step_size):
     return int(round(-math.log(float(step_size), 10), 0))
 
 
+def get_precisions(step_sizes):
+    '''
+    Vectorized get_precision for a series of step sizes.
+    '''
+    return (-np.log10(step_sizes.astype(float))).round().astype(int)
+
+
+def to_ticks(number, decimals, round_down=True):
+    '''
+    Converts a float to a scaled integer count of 10^-decimals steps (price ticks or qty lots), rounded down by default.
+    Values within float noise of a step snap to it, so 0.29 at 2 decimals is 29 ticks rather than 28.
+    '''
+    scaled = number * 10 ** decimals
+    nearest = round(scaled)
+    if not round_down or math.isclose(scaled, nearest, rel_tol=1e-15, abs_tol=1e-9):
+        return int(nearest)
+
+    return math.floor(scaled)
+
+
+def from_ticks(ticks, decimals):
+    '''
+    Converts a scaled integer count of 10^-decimals steps back to the closest float.
+    '''
+    return ticks / 10 ** decimals
+
+
+def format_ticks(ticks, decimals):
+    '''
+    Formats a scaled integer count of 10^-decimals steps as an exact decimal string (no float formatting or scientific notation).
+    ticks: 12345, decimals: 3
+    returns "12.345"
+    '''
+    if decimals <= 0:
+        return str(ticks * 10 ** -decimals)
+
+    sign = "-" if ticks < 0 else ""
+    whole, fraction = divmod(abs(ticks), 10 ** decimals)
+    return "{}{}.{:0{}d}".format(sign, whole, fraction, decimals)
+
+
+def divide_exact(numerator, denominator, exponent):
+    '''
+    floor(numerator * 10^exponent / denominator) in integer arithmetic ('exponent' may be negative).
+    '''
+    numerator, denominator = int(numerator), int(denominator)  # numpy ints would overflow
+    if exponent >= 0:
+        return numerator * 10 ** exponent // denominator
+
+    return numerator // (denominator * 10 ** -exponent)
+
+
+def convert_ticks(ticks, decimals, new_decimals):
+    '''
+    Re-expresses a count of 10^-decimals steps in 10^-new_decimals steps, rounded down.
+    '''
+    return divide_exact(ticks, 1, new_decimals - decimals)
+
+
+def multiply_ticks(qty_lots, qty_decimals, price_ticks, price_decimals, new_decimals):
+    '''
+    qty * price in 10^-new_decimals steps, rounded down (the quote qty a sell of 'qty_lots' at 'price_ticks' results in).
+    '''
+    return divide_exact(int(qty_lots) * int(price_ticks), 1, new_decimals - qty_decimals - price_decimals)
+
+
+def divide_ticks(qty_lots, qty_decimals, price_ticks, price_decimals, new_decimals):
+    '''
+    qty / price in 10^-new_decimals steps, rounded down (the base qty spending 'qty_lots' of quote at 'price_ticks' buys).
+    '''
+    return divide_exact(qty_lots, price_ticks, new_decimals + price_decimals - qty_decimals)
+
+
 def round_decimals_down(number, decimals):
     """
     Returns a value rounded down to a specific number of decimal places.
@@ -18,11 +93,8 @@ def round_decimals_down(number, decimals):
         raise TypeError("decimal places must be an integer")
     elif decimals < 0:
         raise ValueError("decimal places has to be 0 or more")
-    elif decimals == 0:
-        return math.floor(number)
 
-    factor = 10 ** decimals
-    return math.floor(number * factor) / factor
+    return from_ticks(to_ticks(number, decimals), decimals)
 
 
 def check_min_notional(exchange, trade, stripped_symbol):
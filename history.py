@@ -0,0 +1,83 @@
+import parameters
+
+import numpy as np
+import pandas as pd
+
+
+class ScanHistory():
+    '''
+    Bounded-retention scan history. Full rows are only kept for the top N triangles of each scan and for any triangle at
+    or above a profit threshold. Every other row is folded into per-pair running aggregates (min, max, mean and count
+    above fee), so memory and disk scale with the number of interesting events instead of scans x pairs.
+    '''
+    def __init__(self, top_n, min_profit_percent, fee_percent):
+        self.top_n = top_n
+        self.min_profit_percent = min_profit_percent
+        self.fee_percent = fee_percent
+
+        self.retained_scans = []
+        self.num_scans = 0
+        self.aggregates = pd.DataFrame(columns=["count", "min_profit", "max_profit", "sum_profit", "count_above_fee"], dtype=float)
+
+    def append(self, scan):
+        '''
+        Records a scan dataframe (one row per pair).
+        '''
+        if len(scan) == 0:
+            return
+
+        self.num_scans += 1
+        best_profit = scan[["net_forward", "net_reverse"]].max(axis=1)
+
+        keep = (best_profit.rank(ascending=False, method="first") <= self.top_n) | (best_profit >= self.min_profit_percent)
+        self.retained_scans.append(scan[keep])
+
+        # fold every row into running per-pair aggregates
+        profits = best_profit.set_axis(scan["pair"])
+        new_pairs = profits.index.difference(self.aggregates.index)
+        if len(new_pairs) > 0:
+            self.aggregates = pd.concat([self.aggregates, pd.DataFrame({"count": 0.0, "min_profit": np.inf, "max_profit": -np.inf,
+                                                                        "sum_profit": 0.0, "count_above_fee": 0.0}, index=new_pairs)])
+
+        pairs = profits.index
+        self.aggregates.loc[pairs, "count"] += 1
+        self.aggregates.loc[pairs, "min_profit"] = np.minimum(self.aggregates.loc[pairs, "min_profit"], profits)
+        self.aggregates.loc[pairs, "max_profit"] = np.maximum(self.aggregates.loc[pairs, "max_profit"], profits)
+        self.aggregates.loc[pairs, "sum_profit"] += profits
+        self.aggregates.loc[pairs, "count_above_fee"] += profits > self.fee_percent
+
+    def get_retained_scans(self):
+        '''
+        @Returns
+        dataframe of every retained scan row
+        '''
+        if len(self.retained_scans) == 0:
+            return pd.DataFrame()
+
+        return pd.concat(self.retained_scans)
+
+    def get_aggregates(self):
+        '''
+        @Returns
+        dataframe of per-pair running aggregates indexed by pair
+        '''
+        aggregates = self.aggregates.copy()
+        aggregates["mean_profit"] = aggregates["sum_profit"] / aggregates["count"]
+        aggregates.index.name = "pair"
+
+        return aggregates.drop(columns=["sum_profit"])
+
+    def save(self, path, save_time):
+        retained_scans = self.get_retained_scans()
+        if len(retained_scans) > 0:
+            retained_scans.set_index("scan_id").to_csv("{}scan_history_{}.csv".format(path, str(save_time)))
+            self.get_aggregates().to_csv("{}scan_aggregates_{}.csv".format(path, str(save_time)))
+
+
+def get_scan_history(exchange):
+    '''
+    Creates the scan history with the retention policy in parameters.
+    '''
+    fee_percent = parameters.TRADING_FEES[exchange.name]["maker"] * 3 * 100  # 3 trades required for arbitrage hence *3
+
+    return ScanHistory(parameters.SCAN_HISTORY_TOP_N, parameters.SCAN_HISTORY_MIN_PROFIT_PERCENT, fee_percent)
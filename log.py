@@ -9,7 +9,8 @@ def print_scan_info(scan_id, scan, max_trade_template):
     Writes max profit for each scan to log file and prints to console.
     '''
     time_secs = scan["scan_time_secs"][0]
-    message_str = ">>>  Scan {}/{} took {} secs. MAX PROFIT = {}%".format(scan_id, parameters.NUM_SCANS, f'{time_secs:.5f}', f'{max_trade_template["max_profit_percent"]:.5f}')
+    max_profit_str = f'{max_trade_template["max_profit_percent"]:.5f}%' if max_trade_template is not None else "none (no stable triangle)"
+    message_str = ">>>  Scan {}/{} took {} secs. MAX PROFIT = {}".format(scan_id, parameters.NUM_SCANS, f'{time_secs:.5f}', max_profit_str)
 
     today_date = date.today()
 
@@ -1,4 +1,16 @@
 import exchange
+import accounts
+import attribution
+import daemon
+import decay
+import negativecache
+import history
+import pipeline
+import prefetch
+import profiler
+import recorder
+import snapshotbus
+import tiering
 import market
 import trade
 import parameters
@@ -6,80 +18,277 @@ import log
 
 from datetime import datetime
 import pandas as pd
+import itertools
 import time
 import sys
 
 
+def save_runtime_history(save_time, scan_history, all_projected_trades, all_executed_trades, all_raw_profits, all_asset_balances, execution_attribution):
+    '''
+    Saves scan, trade, profit, balance and execution attribution histories to csv files in SAVE_PATH.
+    '''
+    scan_history.save(parameters.SAVE_PATH, save_time)
+
+    if execution_attribution is not None:
+        execution_attribution.save(parameters.SAVE_PATH, save_time)
+
+    if len(all_projected_trades) > 0:
+        all_projected_trades.set_index("scan_id").to_csv("{}projected_trades_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+
+    if len(all_executed_trades) > 0:
+        all_executed_trades.set_index(["scan_id", "trade_num"]).to_csv("{}executed_trades_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+        pd.DataFrame(all_raw_profits).set_index(["scan_id"]).to_csv("{}raw_profits_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+        all_asset_balances.set_index(["scan_id"]).to_csv("{}balances_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+
+
+def execute_plan(account, trade_plan, scan_id, execute_start_time, scan_time_secs):
+    '''
+    Executes a valid trade plan on 'account' (the exchange or one of its sub-accounts) and values its balances after.
+    @Returns
+    (account, executed trades dataframe, raw profit dict, balances dataframe or None)
+    '''
+    if parameters.EXECUTION_MODE == "simultaneous":
+        executed_trades, raw_profit = trade.execute_trade_plan_simultaneous(account, trade_plan)
+    else:
+        executed_trades, raw_profit = trade.execute_trade_plan(account, trade_plan)
+    # account.trading_target_qty = raw_profit["ending_qty"]  # may not be needed b/c we have account.update_target_qty_partitions()
+
+    raw_profit["account"] = account.account_name
+    raw_profit["total_arbitrage_time_secs"] = round(scan_time_secs + (time.time() - execute_start_time), 5)
+    log.print_status("TIME    -> {} secs.\n".format(raw_profit["total_arbitrage_time_secs"]))
+
+    balances = None
+    if raw_profit != 0:
+        balances = account.value_balances(account.get_balances())
+        balances["scan_id"] = scan_id
+        balances["account"] = account.account_name
+        log.print_status("VALUE   -> {} {} ({} {} in dust)".format(round(balances["target_value"].sum(), 5), parameters.TARGET_ASSET,
+                                                               round(balances[balances["dust"]]["target_value"].sum(), 5), parameters.TARGET_ASSET))
+
+    return account, executed_trades, raw_profit, balances
+
+
+def record_executions(ex, executions, all_executed_trades, all_raw_profits, all_asset_balances):
+    '''
+    Records finished executions (see execute_plan) and refreshes each account's target qty partitions.
+    @Returns
+    (all_executed_trades, all_asset_balances, True if an account exceeded its stop loss)
+    '''
+    stop_loss_exceeded = False
+    for account, executed_trades, raw_profit, balances in executions:
+        all_executed_trades = all_executed_trades.append(executed_trades)  # record executed trades
+        all_raw_profits.append(raw_profit)  # record raw profit
+
+        if ex.decay_model is not None:
+            ex.decay_model.record_execution(executed_trades, raw_profit["total_arbitrage_time_secs"])
+
+        if balances is not None:
+            all_asset_balances = all_asset_balances.append(balances)  # record current balance sheet
+
+            # TODO:
+            # ** KEEP TRACK OF FEES INCURRED pre and post fee discount **
+
+            if account.check_stop_loss(balances):
+                stop_loss_exceeded = True
+            else:
+                account.trading_target_qty, account.reserve_target_qty = account.update_target_qty_partitions()  # update target tradeable and liquid qty
+
+    return all_executed_trades, all_asset_balances, stop_loss_exceeded
+
+
 def main():
-    all_exchange_scans = pd.DataFrame()
     all_projected_trades = pd.DataFrame()
     all_executed_trades = pd.DataFrame()
     all_asset_balances = pd.DataFrame()
     all_raw_profits = []
 
-    ex = exchange.get_exchange(sys.argv)
+    prof = profiler.get_profiler(sys.argv)
+    ex = exchange.get_exchange([arg for arg in sys.argv if not arg.startswith("--")])
     genisis_target_qty = ex.total_starting_target_qty
+    scan_history = history.get_scan_history(ex)
+
+    if parameters.RECORD_MARKET_DATA:
+        ex.recorder = recorder.MarketDataRecorder(parameters.SAVE_PATH, "market_data_{}".format(datetime.now().strftime("%Y_%m_%d_%H_%M_%S")))
+
+    if parameters.PUBLISH_SNAPSHOT_BUS:
+        ex.snapshot_bus = snapshotbus.SnapshotBusWriter(snapshotbus.get_bus_name(ex.name), parameters.SNAPSHOT_BUS_MAX_SYMBOLS)
+        log.print_status("Publishing snapshots to shared memory '{}'.".format(ex.snapshot_bus.name))
+
+    if len(parameters.EXCHANGE_CREDENTIALS[ex.name].get("SUB_ACCOUNTS", [])) > 0:
+        ex.accounts = accounts.get_account_pool(ex)
+        genisis_target_qty = sum(account.total_starting_target_qty for account in ex.accounts.accounts)
+
+    if parameters.EXECUTION_MODE == "simultaneous":
+        for account in (ex.accounts.accounts if ex.accounts is not None else [ex]):
+            account.start_rebalancer()  # keep working balances of intermediate assets topped up in the background
+
+    if parameters.SYMBOL_REFRESH_INTERVAL_SECONDS > 0:
+        ex.start_symbol_refresher()  # pick up listings, delistings and halts without restarting
+
+    if parameters.TIERED_SCANNING:
+        ex.tiering = tiering.TieringScheduler(ex)
+
+    if parameters.PREFETCH_TOP_N > 0:
+        prefetcher = prefetch.OrderbookPrefetcher(ex)
+        if prefetcher.get_refresh_secs() > parameters.PREFETCH_MAX_AGE_SECONDS:  # books would be too old by the time planning reads them
+            log.print_status("WARNING: Prefetching {} triangles at {} requests/sec refreshes each leg every {} secs, over PREFETCH_MAX_AGE_SECONDS ({}). Prefetching disabled.".format(
+                parameters.PREFETCH_TOP_N, parameters.PREFETCH_REQUESTS_PER_SECOND, round(prefetcher.get_refresh_secs(), 3), parameters.PREFETCH_MAX_AGE_SECONDS))
+        else:
+            ex.prefetcher = prefetcher
+            ex.prefetcher.start()  # keep leg orderbooks of near-threshold triangles warm for planning
 
-    for scan_id in range(parameters.NUM_SCANS + 1):
-        scan = market.scan_exchange(ex, scan_id)
-        max_trade_template = market.get_max_profit_trade(scan)
+    if parameters.NEGATIVE_CACHE:
+        ex.negative_cache = negativecache.NegativeCache(ex)
+
+    if parameters.LATENCY_AWARE_RANKING:
+        ex.decay_model = decay.get_decay_model()
+
+    if parameters.EXECUTION_ATTRIBUTION:
+        ex.attribution = attribution.get_attribution()
+
+    producer = None
+    if parameters.PIPELINED_SCANS:
+        producer = pipeline.SnapshotProducer(ex)
+        producer.start()  # snapshot fetching now overlaps with scan compute, execution and bookkeeping
+
+    control = None
+    if "--daemon" in sys.argv:
+        control = daemon.DaemonControl()
+        reloader = daemon.ParameterReloader()
+        daemon.start_control_server(control, parameters.DAEMON_CONTROL_PORT)
+
+    num_executions = 0
+    for scan_id in (itertools.count() if control is not None else range(parameters.NUM_SCANS + 1)):
+        if control is not None:
+            reloader.reload_if_changed()  # apply edited parameters without reconnecting
+
+            while control.wait_while_paused() and control.flush_requested.is_set():  # flushing doesn't resume a paused bot
+                log.print_status("Flushing runtime history...")
+                save_runtime_history(datetime.now().strftime("%Y_%m_%d_%H_%M_%S"), scan_history, all_projected_trades,
+                                     all_executed_trades, all_raw_profits, all_asset_balances, ex.attribution)
+                all_projected_trades, all_executed_trades, all_asset_balances, all_raw_profits = pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), []
+                scan_history = history.get_scan_history(ex)
+                control.flush_requested.clear()
+
+            if control.stop_requested.is_set():
+                log.print_status("MSG: Stop requested. Exiting scan loop...")
+                break
+
+        with prof.profile("scan", scan_id, parameters.PROFILE_EVERY_N_SCANS):
+            orderbook = producer.get_latest_snapshot() if producer is not None else None
+            if producer is not None and orderbook is None:
+                log.print_status("WARNING: Snapshot producer stopped. Falling back to paced serial scans...")
+                producer = None  # scans fetch their own snapshots and sleep between them from here on
+            scan = market.scan_exchange(ex, scan_id, orderbook)
+            max_trade_template = market.get_max_profit_trade(scan)
+
+        if len(scan) == 0:  # no market data this time, nothing to record or trade
+            if producer is None:
+                time.sleep(market.get_scan_interval(ex))
+            continue
+
+        scan_history.append(scan)  # record scan (bounded retention)
+
+        if ex.tiering is not None:
+            ex.tiering.update(scan)  # re-pick hot triangles
+
+        if ex.prefetcher is not None:
+            ex.prefetcher.update_candidates(scan)
+
+        if ex.total_starting_account_value is None and len(ex.conversion_rates) > 0:
+            ex.total_starting_account_value = ex.get_account_value(ex.get_balances())  # valued from the first snapshot
+            log.print_status("Starting account value = {} {}".format(round(ex.total_starting_account_value, 5), parameters.TARGET_ASSET))
+            if ex.accounts is not None:
+                ex.accounts.value_starting_accounts()
 
-        all_exchange_scans = all_exchange_scans.append(scan)  # record scan
         log.print_scan_info(scan_id, scan, max_trade_template)  # print scan info to console
 
-        if market.is_profitable(ex, max_trade_template):
-            execute_start_time = time.time()
+        if control is not None:
+            control.update_status(scan_id=scan_id, max_profit_percent=max_trade_template["max_profit_percent"] if max_trade_template is not None else None, num_executions=num_executions,
+                                  trading_target_qty=ex.trading_target_qty, parameter_reloads=reloader.num_reloads)
+
+        if ex.negative_cache is not None:
+            max_trade_template = ex.negative_cache.get_candidate(scan, max_trade_template)  # next best if this triangle failed planning recently
+
+        executions = ex.accounts.get_finished() if ex.accounts is not None else []  # plans finished on sub-account workers
 
-            tp = trade.TradePlan(ex, scan_id, max_trade_template)
+        if market.is_profitable(ex, max_trade_template) and market.is_fresh(ex, max_trade_template):
+            account = ex.accounts.acquire(max_trade_template["pair"]) if ex.accounts is not None else ex
+            if account is not None:
+                execute_start_time = time.time()
 
-            if tp.trade_plan is not None:
-                all_projected_trades = all_projected_trades.append(tp.trade_plan)  # record projected trades
-                if tp.trade_plan["valid"].all():
-                    executed_trades, raw_profit = trade.execute_trade_plan(ex, tp.trade_plan)
-                    all_executed_trades = all_executed_trades.append(executed_trades)  # record executed trades
-                    # ex.trading_target_qty = raw_profit["ending_qty"]  # may not be needed b/c we have ex.update_target_qty_partitions()
+                with prof.profile("plan", num_executions, parameters.PROFILE_EVERY_N_EXECUTIONS):
+                    tp = trade.TradePlan(account, scan_id, max_trade_template)
 
-                    raw_profit["total_arbitrage_time_secs"] = round(scan["scan_time_secs"][0] + (time.time() - execute_start_time), 5)
-                    all_raw_profits.append(raw_profit)  # record raw profit
+                num_executions += 1
 
-                    log.print_status("TIME    -> {} secs.\n".format(raw_profit["total_arbitrage_time_secs"]))
+                if ex.negative_cache is not None:
+                    ex.negative_cache.record_plan(max_trade_template, tp)
 
-                    if raw_profit != 0:
-                        balances = ex.get_balances()
-                        balances["scan_id"] = scan_id
-                        all_asset_balances = all_asset_balances.append(balances)  # record current balance sheet
+                if tp.trade_plan is not None:
+                    all_projected_trades = all_projected_trades.append(tp.trade_plan)  # record projected trades
 
-                        # TODO:
-                        # ** KEEP TRACK OF FEES INCURRED pre and post fee discount **
-                        # ** KEEP TRACK OF CRYPTO DUST COLLECTED **
+                if tp.trade_plan is None or not tp.trade_plan["valid"].all():
+                    if ex.accounts is not None:
+                        ex.accounts.release(account)
+                elif ex.accounts is not None:
+                    ex.accounts.submit(account, execute_plan, tp.trade_plan, scan_id, execute_start_time, scan["scan_time_secs"][0])  # scanning goes on meanwhile
+                else:
+                    with prof.profile("execute", num_executions, parameters.PROFILE_EVERY_N_EXECUTIONS):
+                        executions.append(execute_plan(ex, tp.trade_plan, scan_id, execute_start_time, scan["scan_time_secs"][0]))
 
-                        ex.rebalance_portfolio()  # TODO
+        all_executed_trades, all_asset_balances, stop_loss_exceeded = record_executions(ex, executions, all_executed_trades, all_raw_profits, all_asset_balances)
+        if stop_loss_exceeded:
+            log.print_status("WARNING: STOP LOSS FOR TARGET ASSET EXCEEDED! Exiting scan loop early...")
+            break
 
-                        if ex.check_stop_loss(balances):
-                            log.print_status("WARNING: STOP LOSS FOR TARGET ASSET EXCEEDED! Exiting scan loop early...")
-                            break
-                        else:
-                            ex.update_target_qty_partitions()  # update target tradeable and liquid qty
+        if producer is None:
+            time.sleep(market.get_scan_interval(ex))  # pipelined producer paces its own api calls
 
-        time.sleep(parameters.SCAN_LENGTH_SECONDS)
+    if ex.accounts is not None:
+        log.print_status("Waiting for in-flight trade plans...")
+        all_executed_trades, all_asset_balances, _ = record_executions(ex, ex.accounts.wait(), all_executed_trades, all_raw_profits, all_asset_balances)
+        log.print_status("ACCOUNTS -> {}".format(ex.accounts.get_metrics()))
+
+    if producer is not None:
+        producer.stop()
+        log.print_status("Skipped {} stale snapshots, {} snapshots failed.".format(producer.skipped_snapshots, producer.failed_snapshots))
+
+    if ex.recorder is not None:
+        ex.recorder.close()  # write out any queued market data
+
+    if ex.snapshot_bus is not None:
+        ex.snapshot_bus.close()
+
+    if ex.tiering is not None:
+        log.print_status("TIERING -> {}".format(ex.tiering.get_metrics()))
+
+    if ex.negative_cache is not None:
+        log.print_status("NEGCACHE -> {}".format(ex.negative_cache.get_metrics()))
+
+    if ex.attribution is not None:
+        log.print_status("ATTRIBUTION -> {}".format(ex.attribution.get_metrics()))
+
+    if ex.prefetcher is not None:
+        ex.prefetcher.stop()
+        log.print_status("PREFETCH -> {}".format(ex.prefetcher.get_metrics()))
+
+    for breaker in ex.breakers.values():
+        log.print_status("DOWNTIME -> {}".format(breaker.get_metrics()))
 
     log.print_status("Saving runtime history...")
     save_time = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
 
-    all_exchange_scans.set_index("scan_id").to_csv("{}scan_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+    save_runtime_history(save_time, scan_history, all_projected_trades, all_executed_trades, all_raw_profits, all_asset_balances, ex.attribution)
 
-    if len(all_projected_trades) > 0:
-        all_projected_trades.set_index("scan_id").to_csv("{}projected_trades_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
-
-    if len(all_executed_trades) > 0:
-        all_executed_trades.set_index(["scan_id", "trade_num"]).to_csv("{}executed_trades_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
-        pd.DataFrame(all_raw_profits).set_index(["scan_id"]).to_csv("{}raw_profits_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
-        all_asset_balances.set_index(["scan_id"]).to_csv("{}balances_history_{}.csv".format(parameters.SAVE_PATH, str(save_time)))
+    if prof.enabled:
+        prof.save(parameters.SAVE_PATH, save_time)
+        log.print_status("PROFILE -> {} (stage: runs, samples)".format(prof.get_summary()))
 
     # ending messages
     total_runtime_mins = round((time.time() - runtime_start) / 60, 2)
-    final_trading_target_qty, final_reserve_target_qty = ex.update_target_qty_partitions()
-    target_asset_accumulation_amount = (final_trading_target_qty + final_reserve_target_qty) - genisis_target_qty
+    final_target_qty = sum(sum(account.update_target_qty_partitions()) for account in (ex.accounts.accounts if ex.accounts is not None else [ex]))
+    target_asset_accumulation_amount = final_target_qty - genisis_target_qty
     target_asset_accumulation_percent = round((target_asset_accumulation_amount / genisis_target_qty) * 100, 5)
     log.print_status("\nDone! In {} mins, the bot accumulated {} {} which is a {} percent difference.".format(total_runtime_mins, target_asset_accumulation_amount, parameters.TARGET_ASSET, target_asset_accumulation_percent))
 
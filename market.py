@@ -1,48 +1,187 @@
 import arbitrage
+import pricehistory
+import resilience
 import parameters
 import log
 
+import numpy as np
 import pandas as pd
 import time
 
 
+def get_cached_orderbook_snapshot(exchange):
+    '''
+    Returns the last good snapshot if it is younger than MAX_CACHED_SNAPSHOT_AGE_SECONDS, otherwise None.
+    '''
+    if exchange.last_snapshot is None or time.time() - exchange.last_snapshot_time > parameters.MAX_CACHED_SNAPSHOT_AGE_SECONDS:
+        return None
+
+    log.print_status("MSG: Using cached snapshot from {} secs ago.".format(round(time.time() - exchange.last_snapshot_time, 3)))
+    return exchange.last_snapshot
+
+
 def take_orderbook_snapshot(exchange, max_tries=30):
     '''
-    Gets current orderbook for all pairs in given exchange
+    Gets current orderbook for all pairs in given exchange. Retries with jittered exponential backoff, fails over to the
+    secondary market data host when the primary circuit is open, and falls back to a recent cached snapshot.
+    '''
+    sources = [("primary", lambda: exchange.adapter.get_orderbook_tickers())]  # ** API CALL **
+    if exchange.adapter.market_fallback is not None:
+        sources.append(("fallback", lambda: exchange.adapter.get_orderbook_tickers(fallback=True)))  # ** API CALL **
+
+    orderbook = resilience.call_with_failover(sources, exchange.breakers, max_tries, get_cached=lambda: get_cached_orderbook_snapshot(exchange))
+    if orderbook is None:
+        print("Failed to connect to API after {} retries. Stopping scans.".format(max_tries))
+        return None
+
+    if orderbook is not exchange.last_snapshot:
+        orderbook.attrs.update(exchange.clock.stamp(orderbook.attrs.get("exchange_time")))  # cached snapshots keep their original stamp
+        exchange.last_snapshot = orderbook
+        exchange.last_snapshot_time = time.time()
+        if exchange.recorder is not None:
+            exchange.recorder.record_snapshot(orderbook)
+        publish_snapshot(exchange, orderbook)
+
+    return orderbook
+
+
+def take_symbol_tickers(exchange, symbols, max_tries=0):
+    '''
+    Gets current best bid/ask of a few (stripped) symbols with targeted ticker requests. Goes through the same circuit
+    breakers and secondary market data host as full snapshots, without retrying (a failed hot tick is followed by a
+    full snapshot instead). Received tickers are recorded like full snapshots.
+    @Returns
+    stamped dataframe indexed by symbol with 'bidPrice' and 'askPrice', or None if the request failed
+    '''
+    symbols = [symbol for symbol in symbols if symbol in exchange.adapter.venue_symbols]  # delisted since the hot tier was picked
+    if len(symbols) == 0:
+        return None
+
+    sources = [("primary", lambda: exchange.adapter.get_symbol_tickers(symbols))]  # ** API CALL **
+    if exchange.adapter.market_fallback is not None:
+        sources.append(("fallback", lambda: exchange.adapter.get_symbol_tickers(symbols, fallback=True)))  # ** API CALL **
+
+    tickers = resilience.call_with_failover(sources, exchange.breakers, max_tries)
+    if tickers is None:
+        log.print_status("MSG: Could not get tickers of {} symbols.".format(len(symbols)))
+        return None
+
+    tickers.attrs.update(exchange.clock.stamp(tickers.attrs.get("exchange_time")))
+    if exchange.recorder is not None:
+        exchange.recorder.record_snapshot(tickers)
+
+    return tickers
+
+
+def publish_snapshot(exchange, orderbook, stamp=None):
+    '''
+    Publishes a stamped snapshot to the snapshot bus (when PUBLISH_SNAPSHOT_BUS is on). 'stamp' replaces the snapshot's
+    own stamp (attrs) when its rows aren't all from the time it was stamped with.
+    '''
+    if exchange.snapshot_bus is not None:
+        stamp = stamp if stamp is not None else orderbook.attrs
+        exchange.snapshot_bus.publish(orderbook, stamp["exchange_time"], stamp["receive_time"])
+
+
+def get_scan_snapshot(exchange):
+    '''
+    Takes the next scan's snapshot (hot triangles only between full snapshots when TIERED_SCANNING is on).
     '''
-    for i in range(max_tries + 1):
-        try:
-            if exchange.name == "BINANCE.US" or exchange.name == "BINANCE":
-                orderbook = pd.DataFrame(exchange.market.get_orderbook_tickers())
-                return orderbook.set_index("symbol").astype(float)[["bidPrice", "askPrice"]]
-            elif exchange.name == "KUCOIN":
-                orderbook = pd.DataFrame(exchange.market.get_all_tickers()['ticker'])
-                orderbook = orderbook[["symbolName", "buy", "sell"]].rename(columns={"symbolName": "symbol", "buy": "bidPrice", "sell": "askPrice"})
-                orderbook["symbol"] = orderbook["symbol"].str.replace("-", "")
-                return orderbook.set_index("symbol").astype(float)
-        except OSError:
-            print("OS ERROR. API Connection issue. Trying again in 120 secs ({}/{})...".format(i, max_tries))
-            time.sleep(120)
+    if exchange.tiering is not None:
+        return exchange.tiering.take_snapshot()  # ** API CALL **
 
-    print("Failed to connect to API after {} retries. Stopping scans.".format(max_tries))
-    return None
+    return take_orderbook_snapshot(exchange)  # ** API CALL **
 
 
-def scan_exchange(exchange, scan_id):
+def get_scan_interval(exchange):
     '''
-    Scan exchange asset pairs for arbitrage oppurtunities.
+    @Returns
+    number of secs to space scans by within the api budget
+    '''
+    if exchange.tiering is not None:
+        return exchange.tiering.get_tick_secs()
+
+    return parameters.SCAN_LENGTH_SECONDS
+
+
+def get_conversion_rates(exchange, orderbook):
+    '''
+    Builds an asset -> target asset conversion vector from a ticker snapshot. Assets with no direct target pair
+    are routed through the VALUATION_BRIDGE_ASSETS (BTC/ETH).
+    @Returns
+    pandas Series of target asset rates indexed by asset
+    '''
+    pairs = exchange.assets_info[["baseAsset", "quoteAsset"]].join(orderbook, how="inner")
+    pairs = pairs[(pairs["bidPrice"] > 0) & (pairs["askPrice"] > 0)]
+
+    rates = pd.Series({exchange.target_asset: 1.0})
+    direct = pairs[pairs["quoteAsset"] == exchange.target_asset]
+    inverse = pairs[pairs["baseAsset"] == exchange.target_asset]
+    rates = rates.combine_first(direct.groupby("baseAsset")["bidPrice"].first())
+    rates = rates.combine_first(1 / inverse.groupby("quoteAsset")["askPrice"].first())
+
+    for bridge_asset in parameters.VALUATION_BRIDGE_ASSETS:
+        if bridge_asset not in rates.index:
+            continue
+        routed = pairs[pairs["quoteAsset"] == bridge_asset]
+        rates = rates.combine_first(routed.groupby("baseAsset")["bidPrice"].first() * rates[bridge_asset])
+
+    return rates
+
+
+def add_price_stability(exchange, scan, orderbook):
+    '''
+    Records the snapshot in the exchange's rolling price history and flags triangles whose leg prices jumped far from
+    their rolling mean. Those are likely one-tick glitches rather than persistent mispricings, so they are marked
+    'stable' = False and skipped before any leg orderbooks are fetched. Snapshots that only refreshed some symbols
+    (tiered scans) only add observations for those.
+    '''
+    pairs = list(scan["pair"])
+    if exchange.price_history is None or not set(pairs).issubset(exchange.price_history_pairs):  # (re)index for current pairs
+        pairs_to_index = list(dict.fromkeys(list(exchange.valid_pairs) + pairs))  # every triangle, tiered scans only cover a few
+        legs = []
+        for pair in pairs_to_index:
+            legs.append((exchange.assets_info.loc[pair]["baseAsset"] + exchange.target_asset,
+                         exchange.assets_info.loc[pair]["quoteAsset"] + exchange.target_asset,
+                         pair))
+
+        leg_symbols = sorted(set(symbol for leg in legs for symbol in leg))
+        if exchange.price_history is None:
+            exchange.price_history = pricehistory.PriceRingBuffer(leg_symbols, parameters.PRICE_HISTORY_LENGTH)
+        else:
+            exchange.price_history.add_symbols(leg_symbols)  # symbol universe changed, keep existing history
+        exchange.price_history_pairs = {pair: i for i, pair in enumerate(pairs_to_index)}
+        exchange.triangle_leg_indices = np.array([[exchange.price_history.symbol_index[symbol] for symbol in leg] for leg in legs]).reshape(-1, 3)
+
+    refreshed_symbols = orderbook.attrs.get("refreshed_symbols")
+    exchange.price_history.update(orderbook if refreshed_symbols is None else orderbook.loc[refreshed_symbols])
+
+    triangle_leg_indices = exchange.triangle_leg_indices[[exchange.price_history_pairs[pair] for pair in pairs]]
+    leg_zscores = exchange.price_history.get_zscores()[triangle_leg_indices]
+    leg_counts = exchange.price_history.counts[triangle_leg_indices]
+
+    scan["max_leg_zscore"] = np.where(np.isnan(leg_zscores), 0, leg_zscores).max(axis=1)
+    scan["stable"] = (leg_counts.min(axis=1) < parameters.PRICE_HISTORY_MIN_OBSERVATIONS) | (scan["max_leg_zscore"] <= parameters.GLITCH_MAX_ZSCORE)
+
+
+def scan_exchange(exchange, scan_id, orderbook=None):
+    '''
+    Scan exchange asset pairs for arbitrage oppurtunities. Takes a new orderbook snapshot unless one is given.
+    Tiered snapshots name the triangles they refreshed ('tier_pairs'), only those are scanned.
     '''
     start = time.time()
-    orderbook = take_orderbook_snapshot(exchange)  # ** API CALL **
+    if orderbook is None:
+        orderbook = get_scan_snapshot(exchange)  # ** API CALL **
     timestamp = time.strftime("%H:%M:%S", time.localtime())
 
     if orderbook is None:
-        log.print_status("Could not access exchange market data. Waiting 2mins before proceeding...")
-        time.sleep(120)
+        log.print_status("Could not access exchange market data. Skipping scan...")
         return {}
 
+    exchange.conversion_rates = get_conversion_rates(exchange, orderbook)  # value holdings from this snapshot, no extra api calls
+
     scan = []
-    for pair in exchange.valid_pairs:
+    for pair in orderbook.attrs.get("tier_pairs", exchange.valid_pairs):  # read once, the symbol refresher swaps in a new list
         pair_scan = {}
         net_forward, forward_rates = arbitrage.get_net_forward_arbitrage(exchange, orderbook, pair)
         net_reverse, reverse_rates = arbitrage.get_net_reverse_arbitrage(exchange, orderbook, pair)
@@ -53,6 +192,9 @@ def scan_exchange(exchange, scan_id):
         pair_scan["net_forward"] = net_forward
         pair_scan["net_reverse"] = net_reverse
         pair_scan["timestamp"] = timestamp
+        pair_scan["exchange_time"] = orderbook.attrs.get("exchange_time")
+        pair_scan["receive_monotonic"] = orderbook.attrs.get("receive_monotonic")
+        pair_scan["receive_age_secs"] = orderbook.attrs.get("receive_age_secs")
 
         if net_forward >= net_reverse:
             pair_scan["best_direction"] = "forward"
@@ -68,6 +210,9 @@ def scan_exchange(exchange, scan_id):
         scan.append(pair_scan)
 
     scan = pd.DataFrame(scan)
+    add_price_stability(exchange, scan, orderbook)
+    if exchange.decay_model is not None and len(scan) > 0:
+        exchange.decay_model.add_expected_profit(scan)
     scan["scan_time_secs"] = round(time.time() - start, 5)
     scan["scan_id"] = scan_id
 
@@ -79,27 +224,55 @@ def get_max_profit_trade(scan):
     Looks at total 'scan' df of all pairs and their prices,
     then determines the best possible arbitrage trade.
     @Returns
-    dict of row from 'scan' dataframe representing the best trade.
+    dict of row from 'scan' dataframe representing the best trade, None if no (stable) triangle was scanned.
     '''
     if len(scan) == 0:
         return None  # meant that scan wasn't able to be taken
 
+    if "stable" in scan.columns:
+        scan = scan[scan["stable"]]  # skip triangles priced off a one-tick glitch
+        if len(scan) == 0:
+            return None  # every triangle is glitched, the best of them would be too
+
+    if "expected_profit" in scan.columns and scan["expected_profit"].notna().any():
+        max_profit_trade = dict(scan.loc[scan["expected_profit"].idxmax()])  # rank by profit left once execution lands
+        max_profit_trade["max_profit_percent"] = max_profit_trade["net_{}".format(max_profit_trade["best_direction"])]
+        max_profit_trade["expected_profit_percent"] = max_profit_trade["expected_profit"]
+        return max_profit_trade
+
     max_forward_proposal_index = scan['net_forward'].idxmax()
     max_reverse_proposal_index = scan['net_reverse'].idxmax()
 
-    max_forward_proposal = scan.iloc[max_forward_proposal_index]
-    max_reverse_proposal = scan.iloc[max_reverse_proposal_index]
+    max_forward_proposal = scan.loc[max_forward_proposal_index]
+    max_reverse_proposal = scan.loc[max_reverse_proposal_index]
 
     if max_forward_proposal['net_forward'] >= max_reverse_proposal["net_reverse"]:
-        max_profit_trade = dict(scan.iloc[max_forward_proposal_index])
+        max_profit_trade = dict(scan.loc[max_forward_proposal_index])
         max_profit_trade["max_profit_percent"] = max_forward_proposal['net_forward']
     else:
-        max_profit_trade = dict(scan.iloc[max_reverse_proposal_index])
+        max_profit_trade = dict(scan.loc[max_reverse_proposal_index])
         max_profit_trade["max_profit_percent"] = max_reverse_proposal['net_reverse']
 
     return max_profit_trade
 
 
+def is_fresh(exchange, market_data):
+    '''
+    Determines whether stamped market data (trade template or orderbook) is younger than MAX_DATA_AGE_SECONDS.
+    @Returns
+    bool 'True' if fresh (or unstamped), 'False' otherwise
+    '''
+    if market_data is None or pd.isnull(market_data.get("receive_monotonic")):
+        return True
+
+    data_age = exchange.clock.get_data_age(market_data)
+    if data_age > parameters.MAX_DATA_AGE_SECONDS:
+        log.print_status("MSG: Dropping opportunity, market data is {} secs old (budget {} secs).".format(round(data_age, 3), parameters.MAX_DATA_AGE_SECONDS))
+        return False
+
+    return True
+
+
 def is_profitable(exchange, trade_template):
     '''
     Determines whether arbitrage opportunity is profitable (depends on trading fees).
@@ -116,6 +289,8 @@ def is_profitable(exchange, trade_template):
         log.print_status("New profit percent after trade plan generation = {}%".format(round(max_profit_percent, 5)))
     except KeyError:
         max_profit_percent = trade_template["net_{}".format(trade_template["best_direction"])]  # initial profit percent
+        if not pd.isnull(trade_template.get("expected_profit_percent")):
+            max_profit_percent = min(max_profit_percent, trade_template["expected_profit_percent"])  # what should be left after execution latency
 
     if max_profit_percent / 100 > total_trading_fee + parameters.MIN_PROFIT:
         return True
@@ -127,17 +302,28 @@ def get_pair_orderbook(exchange, base_asset, quote_asset):
     '''
     '''
     try:
-        if exchange.name == "BINANCE.US" or exchange.name == "BINANCE":
-            pair_symbol = base_asset + quote_asset
-            return exchange.market.get_order_book(symbol=pair_symbol)
-        elif exchange.name == "KUCOIN":
-            pair_symbol = base_asset + "-" + quote_asset
-            return exchange.market.get_part_order(20, pair_symbol)
+        orderbook = exchange.adapter.get_pair_orderbook(exchange.adapter.get_symbol(base_asset, quote_asset))  # ** API CALL **
+        orderbook.update(exchange.clock.stamp(orderbook.get("exchange_time")))
+        if exchange.recorder is not None:
+            exchange.recorder.record_orderbook(base_asset + quote_asset, orderbook)
+        return orderbook
     except:
         log.print_status("A problem occurred getting {} orderbook. Pair might be untradeable on {}.".format(base_asset + "-" + quote_asset, exchange.name))
         return None
 
 
+def get_leg_orderbook(exchange, base_asset, quote_asset):
+    '''
+    Returns a warm prefetched orderbook for the leg when there is one, otherwise fetches it.
+    '''
+    if exchange.prefetcher is not None:
+        orderbook = exchange.prefetcher.get_orderbook(base_asset, quote_asset)
+        if orderbook is not None:
+            return orderbook
+
+    return get_pair_orderbook(exchange, base_asset, quote_asset)  # ** API CALL **
+
+
 def get_trade_set_orderbooks(exchange, trade_template):
     '''
     Gets up-to-date orderbooks for corresponding trade pairs needed to execute arbitrage oppurtunity.
@@ -147,15 +333,18 @@ def get_trade_set_orderbooks(exchange, trade_template):
     base_asset = exchange.assets_info.loc[trade_template["pair"]]["baseAsset"]
     quote_asset = exchange.assets_info.loc[trade_template["pair"]]["quoteAsset"]
 
-    orderbooks = [get_pair_orderbook(exchange, base_asset, trade_template["target"]),
-                  get_pair_orderbook(exchange, base_asset, quote_asset),
-                  get_pair_orderbook(exchange, quote_asset, trade_template["target"])]
+    orderbooks = [get_leg_orderbook(exchange, base_asset, trade_template["target"]),
+                  get_leg_orderbook(exchange, base_asset, quote_asset),
+                  get_leg_orderbook(exchange, quote_asset, trade_template["target"])]
 
     pairs = [base_asset + trade_template["target"], base_asset + quote_asset, quote_asset + trade_template["target"]]
 
     for orderbook in orderbooks:
         if orderbook is None or len(orderbook["bids"]) == 0 or len(orderbook['asks']) == 0:
-            log.record_status("At least one orderbook was not available.")
+            log.print_status("At least one orderbook was not available.")
             return None, None  # orderbook not available (pair not tradeable, only observable)
 
+        if not is_fresh(exchange, orderbook):
+            return None, None  # stale leg orderbook, don't plan on it
+
     return orderbooks, pairs
@@ -0,0 +1,88 @@
+import parameters
+import market
+import log
+
+import time
+
+
+LEG_ORDERBOOK_CALLS = 3  # orderbook requests trade planning makes per triangle
+
+
+class NegativeCache():
+    '''
+    Remembers triangles (pair + direction) whose trade planning failed, so the selector skips them and moves on to
+    the next best candidate instead of spending leg orderbook calls on the same phantom opportunity every scan.
+    Each failure blocks the triangle for its reason's NEGATIVE_CACHE_TTL_SECONDS, doubled for every consecutive
+    failure (capped at NEGATIVE_CACHE_MAX_TTL_SECONDS). A successful plan clears the entry, and failure counts are
+    forgotten once a triangle hasn't failed for twice the max ttl.
+    '''
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.entries = {}  # (pair, direction) -> {"failures", "reason", "failed_at", "blocked_until"}
+
+        self.skips = 0
+        self.saved_api_calls = 0
+        self.failures = {}  # reason -> count
+
+    def get_blocked(self, now):
+        return {key for key, entry in self.entries.items() if entry["blocked_until"] > now}
+
+    def get_candidate(self, scan, max_trade_template):
+        '''
+        @Returns
+        'max_trade_template' if its triangle isn't blocked, otherwise the best template among triangles that aren't
+        (None if every triangle is blocked)
+        '''
+        if max_trade_template is None:
+            return None
+
+        blocked = self.get_blocked(time.time())
+        if (max_trade_template["pair"], max_trade_template["best_direction"]) not in blocked:
+            return max_trade_template
+
+        if market.is_profitable(self.exchange, max_trade_template):  # planning would have been attempted
+            self.skips += 1
+            self.saved_api_calls += LEG_ORDERBOOK_CALLS
+            log.print_status("MSG: Skipping {} {}, planning failed recently ({}).".format(max_trade_template["pair"], max_trade_template["best_direction"],
+                                                                                         self.entries[(max_trade_template["pair"], max_trade_template["best_direction"])]["reason"]))
+
+        keys = scan["pair"] + "_" + scan["best_direction"]
+        candidates = scan[~keys.isin({pair + "_" + direction for pair, direction in blocked})]
+        if len(candidates) == 0:
+            return None
+
+        return market.get_max_profit_trade(candidates)
+
+    def record_plan(self, trade_template, trade_plan):
+        '''
+        Records the outcome of planning 'trade_template' (a TradePlan).
+        '''
+        key = (trade_template["pair"], trade_template["best_direction"])
+        if trade_plan.failure_reason is None:
+            self.entries.pop(key, None)
+            return
+
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or now - entry["failed_at"] > parameters.NEGATIVE_CACHE_MAX_TTL_SECONDS * 2:
+            entry = {"failures": 0}
+
+        entry["failures"] += 1
+        entry["reason"] = trade_plan.failure_reason
+        entry["failed_at"] = now
+        ttl_secs = min(parameters.NEGATIVE_CACHE_TTL_SECONDS[trade_plan.failure_reason] * 2 ** (entry["failures"] - 1), parameters.NEGATIVE_CACHE_MAX_TTL_SECONDS)
+        entry["blocked_until"] = now + ttl_secs
+        self.entries[key] = entry
+        self.failures[trade_plan.failure_reason] = self.failures.get(trade_plan.failure_reason, 0) + 1
+
+        log.print_status("MSG: Blocking {} {} for {} secs after {} failed plan(s) ({}).".format(key[0], key[1], ttl_secs, entry["failures"], entry["reason"]))
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of skipped candidates, api calls saved by skipping them, planning failures by reason and blocked triangles
+        '''
+        return {"skips": self.skips,
+                "saved_api_calls": self.saved_api_calls,
+                "failures": dict(self.failures),
+                "blocked": len(self.get_blocked(time.time()))}
@@ -1,5 +1,7 @@
 # Get API credentials for each exchange you want to use
 # NOTE: For Kucoin, provide the api credentials for the sub-account or main-account you created the api credentials in.
+# Optional "SUB_ACCOUNTS": [{"NAME": "", "PUBLIC_KEY": "", "SECRET_KEY": "", "PASSPHRASE": ""}, ...] adds funded sub-accounts
+# that trade plans are dispatched across (each with its own capital and api rate limit).
 EXCHANGE_CREDENTIALS = {
     "BINANCE.US": {
         "PUBLIC_KEY": "",
@@ -47,9 +49,100 @@ TARGET_STOP = 0.10            # decimal percent of TARGET_ASSET you are willing
 TARGET_MIN_LIQUIDITY = 0.50   # decimal percent of TARGET_ASSET you do not want the bot to touch/use
 FEE_MIN_LIQUIDITY = 0.20      # decimal percent of FEE_ASSET you do not want the bot to touch/use (needs to be above 0 for exchange discounts to apply)
 MIN_PROFIT = 0.0010           # decimal percent of min profit you want to make for each arbitrage
+PRICE_HISTORY_LENGTH = 60     # number of recent snapshots kept per symbol for rolling price statistics
+PRICE_HISTORY_MIN_OBSERVATIONS = 10  # snapshots needed before a triangle can be flagged as a price glitch
+GLITCH_MAX_ZSCORE = 4.0       # triangles with a leg price this many rolling std devs (or spreads) from its rolling mean are skipped
+VALUATION_BRIDGE_ASSETS = ["BTC", "ETH"]  # assets used to value holdings that have no direct TARGET_ASSET pair
+DUST_MAX_TARGET_VALUE = 1.0   # holdings worth less than this many TARGET_ASSET are counted as dust
 
-NUM_SCANS = 1000              # number of scans you want the bot to make before exiting  # 24 hrs = 86400 secs
+NUM_SCANS = 1000              # number of scans you want the bot to make before exiting (runs indefinitely with --daemon)  # 24 hrs = 86400 secs
 SCAN_LENGTH_SECONDS = 1       # number of seconds you want to space each scan to avoid exceeding api limits
+PIPELINED_SCANS = False       # fetch the next snapshot on a background thread while the current one is scanned/executed
+SYMBOL_REFRESH_INTERVAL_SECONDS = 900  # number of seconds between background symbol universe refreshes (0 to disable)
+
+TIERED_SCANNING = False                 # refresh and scan hot triangles every TIER_HOT_SCAN_SECONDS and the rest with a full snapshot every TIER_COLD_SCAN_SECONDS
+TIER_HOT_SCAN_SECONDS = 0.5             # number of seconds between hot triangle refreshes (targeted ticker requests for their legs)
+TIER_COLD_SCAN_SECONDS = 10             # number of seconds between full ticker snapshots (every triangle)
+TIER_MAX_HOT_TRIANGLES = 10             # most triangles in the hot tier (fewer if the api budget of one snapshot per SCAN_LENGTH_SECONDS runs out)
+TIER_MIN_VOLUME = 50000                 # min 24h volume (in TARGET_ASSET) of every leg of a hot triangle, where the venue reports volume
+TIER_MAX_SPREAD_PERCENT = 0.5           # max bid/ask spread percent of every leg of a hot triangle
+TIER_NEAR_PROFIT_WINDOW_PERCENT = 0.2   # scans within this many profit percent below the threshold count as near-threshold activity
+TIER_ACTIVITY_HALF_LIFE_SECONDS = 600   # half life of a triangle's near-threshold frequency
+TIER_API_WEIGHTS = {                    # market data request weights: full ticker snapshot, targeted ticker request (per request + per symbol)
+    "BINANCE.US": {"snapshot": 4, "request": 4, "symbol": 0},
+    "BINANCE": {"snapshot": 4, "request": 4, "symbol": 0},
+    "KUCOIN": {"snapshot": 15, "request": 0, "symbol": 2}
+}
+
+RETRY_BASE_DELAY_SECONDS = 0.05         # first market data retry backoff (doubles each retry, with jitter)
+RETRY_MAX_DELAY_SECONDS = 30            # max market data retry backoff
+BREAKER_FAILURE_THRESHOLD = 3           # consecutive failures before an endpoint's circuit opens
+BREAKER_RESET_SECONDS = 10              # number of seconds an open circuit waits before a trial call
+MAX_CACHED_SNAPSHOT_AGE_SECONDS = 5     # oldest cached snapshot that may stand in while every market data host is down
+FALLBACK_MARKET_HOSTS = {               # secondary REST host per exchange for market data failover ("" for none)
+    "BINANCE.US": "",
+    "BINANCE": "https://api2.binance.com/api",
+    "KUCOIN": "https://openapi-v2.kucoin.com"
+}
+
+MAX_DATA_AGE_SECONDS = 1.0              # opportunities priced off market data older than this (exchange clock) are dropped before planning
+CLOCK_SYNC_INTERVAL_SECONDS = 60        # number of seconds between exchange server time re-syncs
+CLOCK_SYNC_SAMPLES = 5                  # server time samples per sync (the lowest round trip sample is kept)
+
+PREFETCH_TOP_N = 0                      # triangles nearest the profit threshold whose leg orderbooks are kept warm (0 to disable), needs TOP_N * 3 / REQUESTS_PER_SECOND <= MAX_AGE_SECONDS
+PREFETCH_PROFIT_WINDOW_PERCENT = 0.1    # only prefetch triangles within this many profit percent below the threshold
+PREFETCH_REQUESTS_PER_SECOND = 5        # api budget of the background prefetcher
+PREFETCH_MAX_AGE_SECONDS = 0.5          # oldest prefetched orderbook planning will use instead of fetching
+
+NEGATIVE_CACHE = False                  # skip triangles whose trade planning failed recently and take the next best one
+NEGATIVE_CACHE_TTL_SECONDS = {          # base number of seconds a triangle is skipped per planning failure reason (doubles per consecutive failure)
+    "unprofitable": 5,                  # profit gone once leg orderbook depth was fetched
+    "unavailable": 30,                  # a leg orderbook was missing, empty or stale
+    "invalid": 60                       # plan broke a venue min qty / min notional rule
+}
+NEGATIVE_CACHE_MAX_TTL_SECONDS = 600    # longest a triangle is skipped
+
+LATENCY_AWARE_RANKING = False           # pick triangles by profit expected to be left after execution latency instead of instantaneous profit
+DECAY_EWMA_ALPHA = 0.1                  # weight of the newest observation in the decay model's rolling estimates
+DECAY_MIN_OBSERVATIONS = 20             # scans a triangle needs before its own decay rate replaces the pooled one
+DECAY_DEFAULT_LATENCY_SECONDS = 3.0     # assumed scan-to-fill latency until executions have been measured
+DECAY_HISTORY_PATH = ""                 # glob of recorded scan_history csvs to warm the decay model up from (e.g "/path/to/save/scan_history_*.csv", "" for none)
+
+ACCOUNT_REQUESTS_PER_SECOND = 10       # private api requests per second budgeted for each (sub-)account
+ACCOUNT_REQUEST_BURST = 30              # most private api requests an account may send in a burst
+PLAN_REQUEST_COST = 9                   # private api requests budgeted per trade plan (place, check and cancel per leg)
+
+EXECUTION_ATTRIBUTION = True            # join each executed leg to its projected leg and track slippage and ack/fill/cancel latency per pair and direction
+ATTRIBUTION_WINDOW = 200                # most recent legs kept in each pair's and direction's distributions
+ATTRIBUTION_MIN_SAMPLES = 10            # filled legs a pair (else its direction) needs before planning prices in its median slippage
+SLIPPAGE_AWARE_PLANNING = False         # with EXECUTION_ATTRIBUTION on, subtract the legs' median slippage from a triangle's profit when planning
+
+EXECUTION_MODE = "sequential"           # "sequential" waits for each leg to fill, "simultaneous" sends all 3 legs at once from held inventory
+INVENTORY_ASSETS = ["BTC", "ETH", "KCS"]  # intermediate assets kept as working balances (simultaneous mode only trades triangles covered by these)
+INVENTORY_TARGET_PERCENT = 0.05         # decimal percent of trading TARGET_ASSET qty to hold in each inventory asset
+INVENTORY_DRIFT_TOLERANCE = 0.25        # decimal percent an inventory balance may drift from its target before it is rebalanced
+REBALANCE_INTERVAL_SECONDS = 60         # number of seconds between background inventory rebalances
+
+PRESTAGE_ORDERS = False       # send limit orders from cached, pre-serialized templates over a warm keep-alive connection (see staging.py)
+STAGED_ORDER_TIMEOUT_SECONDS = 10  # order request timeout when PRESTAGE_ORDERS is on
+STAGED_ORDER_IDLE_SECONDS = 30     # idle order connections older than this are re-opened (venues drop idle keep-alives)
+
+ORDER_TIME_IN_FORCE = "GTC"   # "GTC" waits/cancels/retries unfilled limit orders, "IOC" (immediate-or-cancel) or "FOK" (fill-or-kill) resolve in one response
+IOC_MAX_RETRIES = 5           # max immediate remainder batches placed per leg when ORDER_TIME_IN_FORCE is "IOC" or "FOK"
+IOC_MAX_SLICES = 5            # max orderbook depth levels a remainder is sliced across in a single batch
+
+PROFILE_EVERY_N_SCANS = 50     # with the --profile flag, profile one of every N scans
+PROFILE_EVERY_N_EXECUTIONS = 1 # with the --profile flag, profile one of every N trade plans/executions
+PROFILE_INTERVAL_SECONDS = 0.001  # stack sampling interval while profiling
+
+SCAN_HISTORY_TOP_N = 5         # full scan rows kept per scan for the most profitable triangles (the rest only update per-pair aggregates)
+SCAN_HISTORY_MIN_PROFIT_PERCENT = 0.0  # triangles with a profit percent at or above this are always kept in full
+
+RECORD_MARKET_DATA = False     # record raw ticker snapshots and leg orderbooks to a binary market_data_* recording in SAVE_PATH
+PUBLISH_SNAPSHOT_BUS = False   # publish every ticker snapshot to shared memory for other local processes (see snapshotbus.SnapshotBusReader)
+SNAPSHOT_BUS_MAX_SYMBOLS = 4096  # symbol capacity of the shared memory snapshot bus
+
+DAEMON_CONTROL_PORT = 8765     # with the --daemon flag, localhost port of the control api (GET /status, POST /pause, /resume, /flush, /stop)
 
 # path to where you want csv output data to be stored (e.g "/path/to/savefile/")
 SAVE_PATH = "/path/to/save/"
@@ -0,0 +1,87 @@
+import market
+import log
+
+import threading
+import time
+
+
+class SnapshotProducer():
+    '''
+    Fetches orderbook snapshots on a background thread so the network wait for the next snapshot overlaps with
+    scanning, trade execution and history bookkeeping in the main loop.
+
+    Snapshots are published into a front/back double buffer. The producer always fills the back slot and then swaps it
+    to the front, so the consumer only ever sees the freshest completed snapshot and any it didn't get to are skipped.
+    '''
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+        self.buffers = [None, None]  # each slot holds (sequence, snapshot)
+        self.front_index = 0
+        self.sequence = 0
+        self.consumed_sequence = 0
+        self.skipped_snapshots = 0
+        self.failed_snapshots = 0
+
+        self.running = False
+        self.snapshot_ready = threading.Condition()
+
+    def start(self):
+        '''
+        Starts background snapshot fetching thread.
+        '''
+        self.running = True
+        threading.Thread(target=self.produce, daemon=True).start()
+
+    def stop(self):
+        '''
+        Stops fetching snapshots and wakes up any consumer waiting on one.
+        '''
+        with self.snapshot_ready:
+            self.running = False
+            self.snapshot_ready.notify_all()
+
+    def produce(self):
+        '''
+        Fetches a snapshot every scan interval (SCAN_LENGTH_SECONDS, the api budget) and publishes it to the front buffer.
+        A failed snapshot (market data outage) is skipped and retried on the next interval. If the thread dies anyway,
+        the producer is stopped so the consumer falls back to fetching snapshots itself.
+        '''
+        try:
+            while self.running:
+                start = time.time()
+                orderbook = market.get_scan_snapshot(self.exchange)  # ** API CALL **
+
+                if orderbook is None:
+                    log.print_status("Snapshot producer could not access exchange market data. Retrying next interval...")
+                    self.failed_snapshots += 1
+                else:
+                    with self.snapshot_ready:
+                        back_index = 1 - self.front_index
+                        self.sequence += 1
+                        self.buffers[back_index] = (self.sequence, orderbook)
+                        self.front_index = back_index  # swap buffers
+                        self.snapshot_ready.notify_all()
+
+                time.sleep(max(market.get_scan_interval(self.exchange) - (time.time() - start), 0))
+        finally:
+            self.stop()
+
+    def get_latest_snapshot(self):
+        '''
+        Waits for a snapshot newer than the last one consumed, skipping any stale snapshots in between.
+        @Returns
+        freshest orderbook snapshot, or None if the producer stopped
+        '''
+        with self.snapshot_ready:
+            while self.running and self.sequence == self.consumed_sequence:
+                self.snapshot_ready.wait()
+
+            if self.sequence == self.consumed_sequence:
+                return None
+
+            sequence, orderbook = self.buffers[self.front_index]
+            self.skipped_snapshots += sequence - self.consumed_sequence - 1
+            self.consumed_sequence = sequence
+
+        return orderbook
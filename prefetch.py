@@ -0,0 +1,121 @@
+import parameters
+import market
+
+import threading
+import time
+
+
+class OrderbookPrefetcher():
+    '''
+    Keeps leg orderbooks warm for the triangles closest to the profit threshold. After each scan the top
+    PREFETCH_TOP_N triangles within PREFETCH_PROFIT_WINDOW_PERCENT of the threshold become the candidates, and a
+    background thread refreshes their leg orderbooks round-robin at no more than PREFETCH_REQUESTS_PER_SECOND.
+    Trade planning takes a leg orderbook from here when it is younger than PREFETCH_MAX_AGE_SECONDS instead of
+    waiting on the network.
+    '''
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.candidate_legs = []  # (base_asset, quote_asset) legs to keep warm, swapped in whole
+        self.orderbooks = {}      # stripped symbol -> stamped orderbook
+        self.candidates_ready = threading.Event()
+        self.running = False
+
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.used_fetches = 0
+
+    def update_candidates(self, scan):
+        '''
+        Picks the triangles worth prefetching from a scan.
+        '''
+        if len(scan) == 0:
+            return
+
+        threshold_percent = (parameters.TRADING_FEES[self.exchange.name]["maker"] * 3 + parameters.MIN_PROFIT) * 100  # 3 trades required for arbitrage hence *3
+        best_profit = scan[["net_forward", "net_reverse"]].max(axis=1)
+        near = scan[best_profit >= threshold_percent - parameters.PREFETCH_PROFIT_WINDOW_PERCENT]
+        near = near.loc[best_profit[near.index].sort_values(ascending=False).index[:parameters.PREFETCH_TOP_N]]
+
+        candidate_legs = []
+        for pair in near["pair"]:
+            base_asset = self.exchange.assets_info.loc[pair]["baseAsset"]
+            quote_asset = self.exchange.assets_info.loc[pair]["quoteAsset"]
+            for leg in [(base_asset, self.exchange.target_asset), (base_asset, quote_asset), (quote_asset, self.exchange.target_asset)]:
+                if leg not in candidate_legs:
+                    candidate_legs.append(leg)
+
+        self.candidate_legs = candidate_legs
+        if len(candidate_legs) > 0:
+            self.candidates_ready.set()
+
+    def prefetch(self):
+        '''
+        Background loop refreshing candidate leg orderbooks round-robin within the api budget.
+        '''
+        i = 0
+        while self.running:
+            candidate_legs = self.candidate_legs
+            if len(candidate_legs) == 0:
+                self.candidates_ready.clear()
+                self.candidates_ready.wait(1)
+                continue
+
+            start = time.time()
+            base_asset, quote_asset = candidate_legs[i % len(candidate_legs)]
+            i += 1
+
+            orderbook = market.get_pair_orderbook(self.exchange, base_asset, quote_asset)  # ** API CALL **
+            if orderbook is not None:
+                self.orderbooks[base_asset + quote_asset] = orderbook
+                self.fetches += 1
+
+            time.sleep(max(1 / parameters.PREFETCH_REQUESTS_PER_SECOND - (time.time() - start), 0))
+
+    def start(self):
+        '''
+        Starts background prefetching thread.
+        '''
+        self.running = True
+        threading.Thread(target=self.prefetch, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.candidates_ready.set()
+
+    def get_orderbook(self, base_asset, quote_asset):
+        '''
+        @Returns
+        prefetched leg orderbook if one is younger than PREFETCH_MAX_AGE_SECONDS, otherwise None
+        '''
+        orderbook = self.orderbooks.get(base_asset + quote_asset)
+        if orderbook is None or self.exchange.clock.get_data_age(orderbook) > parameters.PREFETCH_MAX_AGE_SECONDS:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if not orderbook.get("prefetch_used", False):  # count each fetched book once
+            orderbook["prefetch_used"] = True
+            self.used_fetches += 1
+
+        return orderbook
+
+    def get_refresh_secs(self):
+        '''
+        @Returns
+        secs between refreshes of each leg orderbook with the legs of PREFETCH_TOP_N triangles (3 each) kept warm
+        '''
+        return parameters.PREFETCH_TOP_N * 3 / parameters.PREFETCH_REQUESTS_PER_SECOND
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of how often planning found warm books and how many prefetches were ever used
+        '''
+        lookups = self.hits + self.misses
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 5) if lookups > 0 else 0,
+                "fetches": self.fetches,
+                "used_fetch_rate": round(self.used_fetches / self.fetches, 5) if self.fetches > 0 else 0}
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class PriceRingBuffer():
+    '''
+    Fixed-memory ring buffer of the last 'length' bid/ask observations for a set of symbols (new symbols can be added).
+    Every symbol has its own ring position, so a snapshot that only refreshes some symbols (tiered hot ticks) doesn't
+    push the other symbols' observations out of their window.
+    Rolling mean, squared mean and spread sums are updated incrementally (add newest, subtract evicted) so every
+    statistic is O(1) per symbol per snapshot and memory stays constant regardless of run length.
+    '''
+    def __init__(self, symbols, length):
+        self.symbols = list(symbols)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.length = length
+
+        num_symbols = len(self.symbols)
+        self.positions = np.zeros(num_symbols, dtype=int)  # next row to overwrite, per symbol
+        self.mids = np.full((length, num_symbols), np.nan)
+        self.spreads = np.full((length, num_symbols), np.nan)
+
+        self.counts = np.zeros(num_symbols)
+        self.mid_sums = np.zeros(num_symbols)
+        self.mid_sq_sums = np.zeros(num_symbols)
+        self.spread_sums = np.zeros(num_symbols)
+
+    def add_symbols(self, symbols):
+        '''
+        Adds empty history for symbols not tracked yet. Every tracked symbol keeps its history and index.
+        '''
+        new_symbols = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self.symbol_index]
+        if len(new_symbols) == 0:
+            return
+
+        for symbol in new_symbols:
+            self.symbol_index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+
+        num_new = len(new_symbols)
+        self.mids = np.hstack([self.mids, np.full((self.length, num_new), np.nan)])
+        self.spreads = np.hstack([self.spreads, np.full((self.length, num_new), np.nan)])
+        self.positions = np.concatenate([self.positions, np.zeros(num_new, dtype=int)])
+        self.counts = np.concatenate([self.counts, np.zeros(num_new)])
+        self.mid_sums = np.concatenate([self.mid_sums, np.zeros(num_new)])
+        self.mid_sq_sums = np.concatenate([self.mid_sq_sums, np.zeros(num_new)])
+        self.spread_sums = np.concatenate([self.spread_sums, np.zeros(num_new)])
+
+    def update(self, orderbook):
+        '''
+        Adds a snapshot (dataframe indexed by symbol with 'bidPrice' and 'askPrice') to the buffer. Only the tracked
+        symbols in the snapshot advance; those without bids or asks are recorded as gaps and don't count toward their statistics.
+        '''
+        orderbook = orderbook[orderbook.index.isin(self.symbol_index)]
+        columns = np.array([self.symbol_index[symbol] for symbol in orderbook.index], dtype=int)
+        if len(columns) == 0:
+            return
+
+        bids = orderbook["bidPrice"].to_numpy(dtype=float)
+        asks = orderbook["askPrice"].to_numpy(dtype=float)
+        mids = (bids + asks) / 2
+        spreads = asks - bids
+        mids[(bids <= 0) | (asks <= 0)] = np.nan  # no bids or asks
+        spreads[np.isnan(mids)] = np.nan
+
+        rows = self.positions[columns]
+        self.evict(rows, columns)
+
+        valid = ~np.isnan(mids)
+        self.mids[rows, columns] = mids
+        self.spreads[rows, columns] = spreads
+        self.counts[columns] += valid
+        self.mid_sums[columns] += np.where(valid, mids, 0)
+        self.mid_sq_sums[columns] += np.where(valid, mids ** 2, 0)
+        self.spread_sums[columns] += np.where(valid, spreads, 0)
+
+        self.positions[columns] = (rows + 1) % self.length
+
+    def evict(self, rows, columns):
+        '''
+        Removes the observations at ('rows', 'columns') from the rolling sums before they are overwritten.
+        '''
+        old_mids = self.mids[rows, columns]
+        old_valid = ~np.isnan(old_mids)
+        self.counts[columns] -= old_valid
+        self.mid_sums[columns] -= np.where(old_valid, old_mids, 0)
+        self.mid_sq_sums[columns] -= np.where(old_valid, old_mids ** 2, 0)
+        self.spread_sums[columns] -= np.where(old_valid, self.spreads[rows, columns], 0)
+
+    def get_latest_mids(self):
+        return self.mids[(self.positions - 1) % self.length, np.arange(len(self.symbols))]
+
+    def get_latest_spreads(self):
+        return self.spreads[(self.positions - 1) % self.length, np.arange(len(self.symbols))]
+
+    def get_rolling_means(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.mid_sums / self.counts
+
+    def get_rolling_spreads(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.spread_sums / self.counts
+
+    def get_rolling_volatilities(self):
+        '''
+        Rolling standard deviation of each symbol's mid price.
+        '''
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.mid_sums / self.counts
+            return np.sqrt(np.maximum(self.mid_sq_sums / self.counts - means ** 2, 0))
+
+    def get_zscores(self):
+        '''
+        How far each symbol's latest mid price is from the rolling mean of its prior observations (the window without the
+        latest one, so a glitch can't inflate the statistics it is scored against), in units of the larger of their
+        volatility and spread (so a flat-priced symbol doesn't produce infinite scores).
+        '''
+        latest_mids, latest_spreads = self.get_latest_mids(), self.get_latest_spreads()
+        latest_valid = ~np.isnan(latest_mids)
+        prior_counts = self.counts - latest_valid
+        prior_mid_sums = self.mid_sums - np.where(latest_valid, latest_mids, 0)
+        prior_mid_sq_sums = self.mid_sq_sums - np.where(latest_valid, latest_mids ** 2, 0)
+        prior_spread_sums = self.spread_sums - np.where(latest_valid, latest_spreads, 0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            prior_means = prior_mid_sums / prior_counts
+            prior_volatilities = np.sqrt(np.maximum(prior_mid_sq_sums / prior_counts - prior_means ** 2, 0))
+            scale = np.maximum(prior_volatilities, prior_spread_sums / prior_counts)
+            return np.abs(latest_mids - prior_means) / scale
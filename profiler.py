@@ -0,0 +1,80 @@
+import parameters
+
+from contextlib import contextmanager
+import threading
+import os
+import sys
+import time
+
+
+class StageProfiler():
+    '''
+    Opt-in sampling profiler. While a sampled stage runs, a background thread periodically captures the calling
+    thread's stack and counts identical stacks, which is written out in collapsed-stack (flamegraph) format per stage.
+    Nothing is started unless the profiler is enabled and the stage iteration is sampled, so overhead is negligible when off.
+    '''
+    def __init__(self, enabled, interval_secs):
+        self.enabled = enabled
+        self.interval_secs = interval_secs
+        self.stage_stacks = {}  # stage -> {collapsed stack: count}
+        self.stage_runs = {}    # stage -> number of profiled runs
+
+    def sample_stacks(self, thread_id, stacks, done):
+        '''
+        Captures the stack of 'thread_id' every 'interval_secs' until 'done' is set.
+        '''
+        while not done.wait(self.interval_secs):
+            frame = sys._current_frames().get(thread_id)
+            frames = []
+            while frame is not None:
+                frames.append("{} ({}:{})".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_code.co_firstlineno))
+                frame = frame.f_back
+
+            if done.is_set():  # stage finished while sampling, don't count the profiler's own teardown
+                break
+
+            collapsed_stack = ";".join(reversed(frames))
+            stacks[collapsed_stack] = stacks.get(collapsed_stack, 0) + 1
+
+    @contextmanager
+    def profile(self, stage, iteration, sample_every):
+        '''
+        Profiles the wrapped block if the profiler is enabled and 'iteration' is one of every 'sample_every' iterations.
+        '''
+        if not self.enabled or iteration % sample_every != 0:
+            yield
+            return
+
+        stacks = self.stage_stacks.setdefault(stage, {})
+        done = threading.Event()
+        sampler = threading.Thread(target=self.sample_stacks, args=(threading.get_ident(), stacks, done), daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+            self.stage_runs[stage] = self.stage_runs.get(stage, 0) + 1
+
+    def save(self, path, save_time):
+        '''
+        Writes one collapsed-stack file per profiled stage (load with flamegraph.pl or speedscope).
+        '''
+        for stage, stacks in self.stage_stacks.items():
+            with open("{}profile_{}_{}.folded".format(path, stage, save_time), "w") as profile_file:
+                for collapsed_stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                    profile_file.write("{} {}\n".format(collapsed_stack, count))
+
+    def get_summary(self):
+        '''
+        @Returns
+        dict of stage -> (profiled runs, total samples)
+        '''
+        return {stage: (self.stage_runs.get(stage, 0), sum(stacks.values())) for stage, stacks in self.stage_stacks.items()}
+
+
+def get_profiler(user_input):
+    '''
+    Creates the stage profiler, enabled when '--profile' is passed on the command line.
+    '''
+    return StageProfiler("--profile" in user_input, parameters.PROFILE_INTERVAL_SECONDS)
@@ -0,0 +1,198 @@
+import log
+
+import numpy as np
+import pandas as pd
+import threading
+import queue
+import time
+import os
+
+
+# fixed-size record: one row per ticker symbol (kind 0, level 0) or per leg orderbook depth level (kind 1)
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("symbol_id", "<u4"), ("kind", "u1"), ("level", "u1"),
+                         ("bid_price", "<f8"), ("bid_qty", "<f8"), ("ask_price", "<f8"), ("ask_qty", "<f8")])
+
+# one index entry per recorded message (a whole ticker snapshot or one leg orderbook)
+INDEX_DTYPE = np.dtype([("timestamp", "<f8"), ("kind", "u1"), ("symbol_id", "<u4"), ("start", "<u8"), ("count", "<u4")])
+
+TICKER_KIND = 0
+ORDERBOOK_KIND = 1
+ALL_SYMBOLS_ID = np.iinfo(np.uint32).max  # index symbol id of full ticker snapshots
+
+
+class MarketDataRecorder():
+    '''
+    Append-only binary recorder for raw market data (ticker snapshots and leg orderbooks).
+    Recording only enqueues the raw response, so the hot path never waits on disk. A background thread converts each
+    message to fixed-size records, appends them to '<name>.bin' and appends an entry to the '<name>.idx' timestamp index.
+    New symbols are appended to '<name>.symbols' (line number = symbol id). All three files can be memory-mapped while
+    the recorder is still writing.
+    '''
+    def __init__(self, path, name):
+        self.base_path = os.path.join(path, name)
+        self.symbol_ids = {}
+        self.num_records = 0
+
+        self.data_file = open(self.base_path + ".bin", "ab")
+        self.index_file = open(self.base_path + ".idx", "ab")
+        self.symbols_file = open(self.base_path + ".symbols", "a")
+
+        self.messages = queue.Queue()
+        self.writer = threading.Thread(target=self.write_messages, daemon=True)
+        self.writer.start()
+
+    def record_snapshot(self, orderbook):
+        '''
+        Queues a ticker snapshot (dataframe indexed by symbol with 'bidPrice' and 'askPrice') for recording.
+        '''
+        self.messages.put((time.time(), TICKER_KIND, None, orderbook))
+
+    def record_orderbook(self, symbol, orderbook):
+        '''
+        Queues a leg orderbook ({"bids": [[price, qty], ...], "asks": ...}) for recording.
+        '''
+        self.messages.put((time.time(), ORDERBOOK_KIND, symbol, orderbook))
+
+    def get_symbol_id(self, symbol):
+        if symbol not in self.symbol_ids:
+            self.symbol_ids[symbol] = len(self.symbol_ids)
+            self.symbols_file.write(symbol + "\n")
+
+        return self.symbol_ids[symbol]
+
+    def to_records(self, timestamp, kind, symbol, orderbook):
+        '''
+        Converts a raw message to fixed-size records.
+        '''
+        if kind == TICKER_KIND:
+            records = np.zeros(len(orderbook), dtype=RECORD_DTYPE)
+            records["symbol_id"] = [self.get_symbol_id(ticker_symbol) for ticker_symbol in orderbook.index]
+            records["bid_price"] = orderbook["bidPrice"].to_numpy(dtype=float)
+            records["ask_price"] = orderbook["askPrice"].to_numpy(dtype=float)
+            records["bid_qty"] = np.nan
+            records["ask_qty"] = np.nan
+        else:
+            bids = np.array(orderbook["bids"], dtype=float).reshape(-1, 2)
+            asks = np.array(orderbook["asks"], dtype=float).reshape(-1, 2)
+            depth = max(len(bids), len(asks))
+            records = np.zeros(depth, dtype=RECORD_DTYPE)
+            records["symbol_id"] = self.get_symbol_id(symbol)
+            records["level"] = np.arange(depth)
+            for column in ["bid_price", "bid_qty", "ask_price", "ask_qty"]:
+                records[column] = np.nan
+            records["bid_price"][:len(bids)], records["bid_qty"][:len(bids)] = bids[:, 0], bids[:, 1]
+            records["ask_price"][:len(asks)], records["ask_qty"][:len(asks)] = asks[:, 0], asks[:, 1]
+
+        records["timestamp"] = timestamp
+        records["kind"] = kind
+
+        return records
+
+    def write_messages(self):
+        '''
+        Background writer loop. A None message flushes and stops the writer.
+        '''
+        while True:
+            message = self.messages.get()
+            if message is None:
+                break
+
+            timestamp, kind, symbol, orderbook = message
+            try:
+                records = self.to_records(timestamp, kind, symbol, orderbook)
+            except Exception as e:
+                log.print_status("MSG: Could not record market data -> " + str(e))
+                continue
+
+            index_entry = np.zeros(1, dtype=INDEX_DTYPE)
+            index_entry["timestamp"] = timestamp
+            index_entry["kind"] = kind
+            index_entry["symbol_id"] = ALL_SYMBOLS_ID if kind == TICKER_KIND else self.symbol_ids[symbol]
+            index_entry["start"] = self.num_records
+            index_entry["count"] = len(records)
+
+            self.data_file.write(records.tobytes())
+            self.index_file.write(index_entry.tobytes())
+            self.num_records += len(records)
+
+            if self.messages.empty():
+                self.symbols_file.flush()
+                self.data_file.flush()
+                self.index_file.flush()
+
+    def close(self):
+        '''
+        Writes out any queued messages and closes the recording.
+        '''
+        self.messages.put(None)
+        self.writer.join()
+        for recording_file in [self.symbols_file, self.data_file, self.index_file]:
+            recording_file.close()
+
+
+class MarketDataReader():
+    '''
+    Memory-mapped reader for recordings made by MarketDataRecorder. Lookups by timestamp use a binary search over the
+    index and lookups by symbol are vectorized over the index, so nothing is loaded into memory until it is read.
+    '''
+    def __init__(self, base_path):
+        with open(base_path + ".symbols") as symbols_file:
+            self.symbols = [line.rstrip("\n") for line in symbols_file]
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        self.records = np.memmap(base_path + ".bin", dtype=RECORD_DTYPE, mode="r") if os.path.getsize(base_path + ".bin") > 0 else np.zeros(0, dtype=RECORD_DTYPE)
+        self.index = np.fromfile(base_path + ".idx", dtype=INDEX_DTYPE)
+
+    def get_message(self, i):
+        '''
+        Returns (timestamp, kind, symbol, data) for index entry 'i'. Ticker data is a dataframe indexed by symbol,
+        orderbook data is in the same {"bids": [[price, qty], ...], "asks": ...} form it was recorded from.
+        '''
+        entry = self.index[i]
+        records = self.records[entry["start"]:entry["start"] + entry["count"]]
+
+        if entry["kind"] == TICKER_KIND:
+            data = pd.DataFrame({"bidPrice": records["bid_price"], "askPrice": records["ask_price"]},
+                                index=pd.Index([self.symbols[symbol_id] for symbol_id in records["symbol_id"]], name="symbol"))
+            return entry["timestamp"], TICKER_KIND, None, data
+
+        bids = records[~np.isnan(records["bid_price"])]
+        asks = records[~np.isnan(records["ask_price"])]
+        data = {"bids": np.column_stack([bids["bid_price"], bids["bid_qty"]]).tolist(),
+                "asks": np.column_stack([asks["ask_price"], asks["ask_qty"]]).tolist()}
+
+        return entry["timestamp"], ORDERBOOK_KIND, self.symbols[entry["symbol_id"]], data
+
+    def find_messages(self, start_time=None, end_time=None, symbol=None, kind=None):
+        '''
+        @Returns
+        array of index entry numbers within [start_time, end_time) matching 'symbol' and 'kind'
+        '''
+        start = 0 if start_time is None else np.searchsorted(self.index["timestamp"], start_time, side="left")
+        end = len(self.index) if end_time is None else np.searchsorted(self.index["timestamp"], end_time, side="left")
+        entries = np.arange(start, end)
+
+        if kind is not None:
+            entries = entries[self.index["kind"][start:end] == kind]
+        if symbol is not None:
+            entries = entries[self.index["symbol_id"][entries] == self.symbol_ids.get(symbol, -1)]
+
+        return entries
+
+    def replay(self, speed=None, **filters):
+        '''
+        Yields recorded messages in order, paced at 'speed' times real time (as fast as possible if speed is None).
+        '''
+        replay_start = time.time()
+        entries = self.find_messages(**filters)
+        if len(entries) == 0:
+            return
+
+        first_timestamp = self.index["timestamp"][entries[0]]
+        for i in entries:
+            if speed is not None:
+                wait_secs = (self.index["timestamp"][i] - first_timestamp) / speed - (time.time() - replay_start)
+                if wait_secs > 0:
+                    time.sleep(wait_secs)
+
+            yield self.get_message(i)
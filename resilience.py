@@ -0,0 +1,165 @@
+import parameters
+import log
+
+import threading
+import random
+import time
+
+
+class VenueError(Exception):
+    '''
+    Request rejected by the venue (rate limited, 5xx, api error code). Adapters translate their client's api errors into
+    it so they are retried, failed over and counted by the circuit breakers like connection errors.
+    '''
+    pass
+
+
+class CircuitBreaker():
+    '''
+    Per-endpoint circuit breaker. After BREAKER_FAILURE_THRESHOLD consecutive failures the endpoint is skipped for
+    BREAKER_RESET_SECONDS, then a single trial call is let through (half open) to check if it recovered.
+    Also keeps downtime metrics for the endpoint.
+    '''
+    def __init__(self, name, failure_threshold=None, reset_secs=None):
+        self.name = name
+        self.failure_threshold = failure_threshold if failure_threshold is not None else parameters.BREAKER_FAILURE_THRESHOLD
+        self.reset_secs = reset_secs if reset_secs is not None else parameters.BREAKER_RESET_SECONDS
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+        # downtime metrics
+        self.calls = 0
+        self.failed_calls = 0
+        self.outages = 0
+        self.down_since = None
+        self.total_downtime_secs = 0
+        self.longest_outage_secs = 0
+
+    def allow_request(self):
+        '''
+        Returns True if the endpoint may be called right now.
+        '''
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_secs:
+            self.state = "half_open"  # let one trial call through
+
+        return self.state != "open"
+
+    def record_success(self):
+        self.calls += 1
+        if self.down_since is not None:  # outage over
+            outage_secs = time.monotonic() - self.down_since
+            self.total_downtime_secs += outage_secs
+            self.longest_outage_secs = max(self.longest_outage_secs, outage_secs)
+            self.down_since = None
+            log.print_status("MSG: {} recovered after {} secs.".format(self.name, round(outage_secs, 3)))
+
+        self.consecutive_failures = 0
+        self.state = "closed"
+
+    def record_failure(self):
+        self.calls += 1
+        self.failed_calls += 1
+        self.consecutive_failures += 1
+        if self.down_since is None:  # new outage
+            self.down_since = time.monotonic()
+            self.outages += 1
+
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                log.print_status("WARNING: {} circuit opened for {} secs.".format(self.name, self.reset_secs))
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of downtime metrics for the endpoint (includes any outage still in progress)
+        '''
+        current_outage_secs = time.monotonic() - self.down_since if self.down_since is not None else 0
+
+        return {"endpoint": self.name,
+                "state": self.state,
+                "calls": self.calls,
+                "failed_calls": self.failed_calls,
+                "outages": self.outages,
+                "total_downtime_secs": round(self.total_downtime_secs + current_outage_secs, 5),
+                "longest_outage_secs": round(max(self.longest_outage_secs, current_outage_secs), 5)}
+
+
+class RateLimiter():
+    '''
+    Token bucket for one account's private api budget. Refills at 'rate' requests per second up to 'burst' tokens.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, cost=1):
+        '''
+        Takes 'cost' tokens if the bucket holds that many.
+        @Returns
+        True if the tokens were taken
+        '''
+        with self.lock:
+            self.refill()
+            if self.tokens < cost:
+                return False
+
+            self.tokens -= cost
+            return True
+
+    def get_available(self):
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+
+def get_backoff_delay(attempt):
+    '''
+    Exponential backoff with full jitter, starting at RETRY_BASE_DELAY_SECONDS and capped at RETRY_MAX_DELAY_SECONDS.
+    '''
+    return random.uniform(0, min(parameters.RETRY_MAX_DELAY_SECONDS, parameters.RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+def call_with_failover(sources, breakers, max_tries, get_cached=None, exceptions=(OSError, VenueError)):
+    '''
+    Calls each source in order of preference, skipping any whose circuit is open, until one succeeds.
+    If every source fails, 'get_cached' (if given) may provide a fallback result before backing off and trying again.
+    sources: list of (breaker_name, callable) tuples
+    @Returns
+    result of the first successful call, or None if all 'max_tries' rounds failed
+    '''
+    for attempt in range(max_tries + 1):
+        for breaker_name, source in sources:
+            breaker = breakers[breaker_name]
+            if not breaker.allow_request():
+                continue
+
+            try:
+                result = source()
+            except exceptions as e:
+                breaker.record_failure()
+                log.print_status("MSG: {} failed ({}/{}). Reason -> {}".format(breaker.name, attempt, max_tries, str(e)))
+                continue
+
+            breaker.record_success()
+            return result
+
+        if get_cached is not None:
+            cached_result = get_cached()
+            if cached_result is not None:
+                return cached_result
+
+        time.sleep(get_backoff_delay(attempt))
+
+    return None
@@ -0,0 +1,237 @@
+import log
+
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+import time
+
+
+'''
+::: SHARED MEMORY LAYOUT :::
+===========================
+[header][symbols block][slot 0 header][slot 1 header][slot 0 bids][slot 0 asks][slot 1 bids][slot 1 asks]
+
+The writer alternates between the two slots, so the slot readers are looking at ('front') is never the one being
+written. Every slot and the symbols block carry a seqlock counter: it is odd while a write is in progress and changes
+on every write, so a reader that sees the same even counter before and after reading knows it read a consistent copy.
+Symbol order lives once in the symbols block (newline separated) and is only rewritten when the snapshot's symbols
+change; each slot records which symbols version its prices are in.
+'''
+
+MAGIC = 0x41524231  # "ARB1"
+LAYOUT_VERSION = 1
+SYMBOL_BYTES = 24  # symbols block bytes reserved per symbol
+
+HEADER_DTYPE = np.dtype([("magic", "<u4"), ("layout_version", "<u4"), ("capacity", "<u4"), ("front", "<u4"),
+                         ("sequence", "<u8"), ("symbols_seq", "<u8"), ("symbols_version", "<u8"), ("symbols_nbytes", "<u8")])
+
+SLOT_HEADER_DTYPE = np.dtype([("seq", "<u8"), ("sequence", "<u8"), ("symbols_version", "<u8"), ("count", "<u8"),
+                              ("exchange_time", "<f8"), ("receive_time", "<f8")])
+
+
+def get_bus_name(exchange_name):
+    return "arb_snapshots_" + exchange_name.lower().replace(".", "_")
+
+
+class SnapshotBusLayout():
+    '''
+    numpy views over a snapshot bus shared memory block.
+    '''
+    def __init__(self, buf, capacity):
+        symbols_offset = HEADER_DTYPE.itemsize
+        slot_headers_offset = symbols_offset + capacity * SYMBOL_BYTES
+        prices_offset = slot_headers_offset + 2 * SLOT_HEADER_DTYPE.itemsize
+
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+        self.symbols = np.ndarray((capacity * SYMBOL_BYTES,), dtype=np.uint8, buffer=buf, offset=symbols_offset)
+        self.slot_headers = np.ndarray((2,), dtype=SLOT_HEADER_DTYPE, buffer=buf, offset=slot_headers_offset)
+        self.prices = np.ndarray((2, 2, capacity), dtype=np.float64, buffer=buf, offset=prices_offset)  # slot, bid/ask, symbol
+
+    @staticmethod
+    def get_size(capacity):
+        return HEADER_DTYPE.itemsize + capacity * SYMBOL_BYTES + 2 * SLOT_HEADER_DTYPE.itemsize + 2 * 2 * capacity * 8
+
+
+class SnapshotBusWriter():
+    '''
+    Publishes normalized bid/ask snapshots (dataframe indexed by symbol with 'bidPrice' and 'askPrice') into shared
+    memory so any number of local processes can read them without fetching their own.
+    '''
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.symbols = None
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SnapshotBusLayout.get_size(capacity))
+        except FileExistsError:  # left behind by a run that didn't exit cleanly
+            shared_memory.SharedMemory(name=name).unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SnapshotBusLayout.get_size(capacity))
+
+        self.layout = SnapshotBusLayout(self.shm.buf, capacity)
+        self.layout.header["capacity"] = capacity
+        self.layout.header["layout_version"] = LAYOUT_VERSION
+        self.layout.header["magic"] = MAGIC  # written last, readers wait for it
+
+    def write_symbols(self, symbols):
+        '''
+        Rewrites the symbols block under its seqlock and bumps the symbols version.
+        '''
+        encoded = np.frombuffer("\n".join(symbols).encode(), dtype=np.uint8)
+        header = self.layout.header
+        header["symbols_seq"] += 1  # odd -> write in progress
+        self.layout.symbols[:len(encoded)] = encoded
+        header["symbols_nbytes"] = len(encoded)
+        header["symbols_version"] += 1
+        header["symbols_seq"] += 1
+
+        self.symbols = symbols
+
+    def publish(self, orderbook, exchange_time=np.nan, receive_time=np.nan):
+        '''
+        Writes a snapshot into the back slot and makes it the front slot.
+        '''
+        if len(orderbook) > self.capacity:
+            log.print_status("MSG: Snapshot has {} symbols, snapshot bus only holds {}. Not published.".format(len(orderbook), self.capacity))
+            return
+
+        if self.symbols is None or not self.symbols.equals(orderbook.index):
+            self.write_symbols(orderbook.index)
+
+        header = self.layout.header
+        back = 1 - int(header["front"]) if header["sequence"] > 0 else 0
+        slot_header = self.layout.slot_headers[back:back + 1]
+        count = len(orderbook)
+
+        slot_header["seq"] += 1  # odd -> write in progress
+        self.layout.prices[back, 0, :count] = orderbook["bidPrice"].to_numpy(dtype=float)
+        self.layout.prices[back, 1, :count] = orderbook["askPrice"].to_numpy(dtype=float)
+        slot_header["count"] = count
+        slot_header["symbols_version"] = header["symbols_version"]
+        slot_header["sequence"] = header["sequence"] + 1
+        slot_header["exchange_time"] = exchange_time
+        slot_header["receive_time"] = receive_time
+        slot_header["seq"] += 1
+
+        header["front"] = back
+        header["sequence"] += 1
+
+    def close(self):
+        '''
+        Releases and removes the shared memory block (readers already attached keep their mapping).
+        '''
+        del self.layout
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SnapshotBusReader():
+    '''
+    Maps a snapshot bus published by another process. Prices are read straight out of shared memory, reads are
+    validated with the slot seqlock and retried if the writer got to the slot mid read.
+    '''
+    def __init__(self, name, timeout_secs=10):
+        deadline = time.time() + timeout_secs
+        while True:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        # the writer owns the block, keep this process's resource tracker from unlinking it on exit
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        while header["magic"] != MAGIC:
+            time.sleep(0.01)
+        if header["layout_version"] != LAYOUT_VERSION:
+            raise ValueError("Snapshot bus layout version {} not supported".format(int(header["layout_version"])))
+        capacity = int(header["capacity"])
+        del header  # views pin the mapping, only keep the layout's
+
+        self.layout = SnapshotBusLayout(self.shm.buf, capacity)
+        self.symbols = None
+        self.symbols_version = 0
+        self.last_sequence = 0
+
+    def read_symbols(self):
+        '''
+        Reads the symbols block (consistently) if its version changed.
+        '''
+        header = self.layout.header
+        while self.symbols_version != header["symbols_version"]:
+            seq = int(header["symbols_seq"])
+            if seq % 2 == 1:
+                continue
+            version, nbytes = int(header["symbols_version"]), int(header["symbols_nbytes"])
+            symbols = self.layout.symbols[:nbytes].tobytes().decode().split("\n")
+            if int(header["symbols_seq"]) == seq:
+                self.symbols, self.symbols_version = pd.Index(symbols, name="symbol"), version
+
+    def read(self, max_tries=100):
+        '''
+        Reads the front snapshot.
+        @Returns
+        (sequence, dataframe indexed by symbol with 'bidPrice' and 'askPrice', exchange_time, receive_time) or None if
+        nothing was published yet
+        '''
+        header = self.layout.header
+        for i in range(max_tries):
+            if header["sequence"] == 0:
+                return None
+
+            front = int(header["front"])
+            slot_header = self.layout.slot_headers[front:front + 1][0]
+            seq = int(slot_header["seq"])
+            if seq % 2 == 1:
+                continue  # writer lapped us onto this slot
+
+            if slot_header["symbols_version"] != self.symbols_version:
+                self.read_symbols()
+            count = int(slot_header["count"])
+            snapshot = pd.DataFrame({"bidPrice": self.layout.prices[front, 0, :count].copy(),
+                                     "askPrice": self.layout.prices[front, 1, :count].copy()}, index=self.symbols[:count])
+            sequence, exchange_time, receive_time = int(slot_header["sequence"]), float(slot_header["exchange_time"]), float(slot_header["receive_time"])
+
+            if int(slot_header["seq"]) == seq and slot_header["symbols_version"] == self.symbols_version:
+                self.last_sequence = sequence
+                return sequence, snapshot, exchange_time, receive_time
+
+        return None
+
+    def get_views(self):
+        '''
+        Zero-copy access to the front slot. Check 'is_valid(token)' after using the views, they are only guaranteed
+        consistent if the slot wasn't rewritten meanwhile.
+        @Returns
+        (symbols, bid prices view, ask prices view, token)
+        '''
+        front = int(self.layout.header["front"])
+        slot_header = self.layout.slot_headers[front:front + 1][0]
+        token = (front, int(slot_header["seq"]))
+
+        if slot_header["symbols_version"] != self.symbols_version:
+            self.read_symbols()
+        count = int(slot_header["count"])
+
+        return self.symbols[:count], self.layout.prices[front, 0, :count], self.layout.prices[front, 1, :count], token
+
+    def is_valid(self, token):
+        front, seq = token
+        return seq % 2 == 0 and int(self.layout.slot_headers[front]["seq"]) == seq
+
+    def wait_for_snapshot(self, poll_secs=0.01):
+        '''
+        Blocks until a snapshot newer than the last one read is published, then reads it.
+        '''
+        while self.layout.header["sequence"] <= self.last_sequence:
+            time.sleep(poll_secs)
+
+        return self.read()
+
+    def close(self):
+        del self.layout
+        self.shm.close()
@@ -0,0 +1,306 @@
+import parameters
+import log
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlencode
+import http.client
+import socket
+import threading
+import argparse
+import hashlib
+import base64
+import hmac
+import json
+import time
+import uuid
+
+
+'''
+::: ORDER PRE-STAGING :::
+=========================
+Everything about a limit order except its price, qty, client order id and timestamp is known as soon as a triangle is
+picked, so it is prepared once per (symbol, side) and cached: the serialized body up to the first variable field, the
+signature prefix and the static auth headers. The HMAC key schedule is computed once per account (hmac objects are
+copied per request) and orders go out over a persistent keep-alive connection that is opened ahead of time. At send
+time only a few byte strings are concatenated and signed before the request is written.
+'''
+
+
+class StagedOrderError(Exception):
+    '''
+    Order rejected by the venue. The message is the venue's own, so adapters' is_below_min_size_error still applies.
+    '''
+    pass
+
+
+class OrderStager():
+    '''
+    Per-account pre-staged limit order sender. Venue subclasses implement build_template, finish and parse_order.
+    '''
+    warm_path = "/"
+
+    def __init__(self, base_url, api_public, api_secret):
+        url = urlsplit(base_url)  # only scheme, host and port are used (client base urls may carry a path)
+        self.scheme, self.host, self.port = url.scheme, url.hostname, url.port
+        self.api_public = api_public
+        self.signer = hmac.new(api_secret.encode(), digestmod=hashlib.sha256)  # keyed once, copied per request
+
+        self.templates = {}  # (venue symbol, order type, time in force) -> template
+        self.connection = None
+        self.lock = threading.Lock()
+        self.last_request_time = 0
+
+    def sign(self, *parts):
+        signer = self.signer.copy()
+        for part in parts:
+            signer.update(part)
+
+        return signer.digest()
+
+    def open_connection(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=parameters.STAGED_ORDER_TIMEOUT_SECONDS)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # don't hold small order writes back
+
+        return connection
+
+    def connect(self):
+        if self.connection is not None:
+            self.connection.close()
+
+        self.connection = self.open_connection()
+
+    def request(self, method, path, body, headers):
+        '''
+        Sends a request over the persistent connection (reconnecting first if it sat idle long enough to be closed).
+        Order requests are never retried, a lost response could mean the order was placed.
+        @Returns
+        (status, parsed json response)
+        '''
+        if self.connection is None or time.monotonic() - self.last_request_time > parameters.STAGED_ORDER_IDLE_SECONDS:
+            self.connect()
+
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            self.connection = None
+            raise
+
+        self.last_request_time = time.monotonic()
+
+        return response.status, json.loads(payload) if len(payload) > 0 else {}
+
+    def warm(self):
+        '''
+        Opens a new connection (tcp + tls handshake and one request) ahead of the first order. The round trip happens
+        outside the send lock, so an order sent meanwhile never waits on it, and the connection is only swapped in if
+        no order has kept the current one open since.
+        '''
+        try:
+            connection = self.open_connection()
+            connection.request("GET", self.warm_path)
+            connection.getresponse().read()
+        except (http.client.HTTPException, OSError) as e:
+            log.print_status("MSG: Could not warm order connection to {}. Reason -> {}".format(self.host, str(e)))
+            return
+
+        with self.lock:
+            if self.connection is None or time.monotonic() - self.last_request_time > parameters.STAGED_ORDER_IDLE_SECONDS / 2:
+                connection, self.connection = self.connection, connection
+                self.last_request_time = time.monotonic()
+
+        if connection is not None:
+            connection.close()  # whichever one wasn't kept
+
+    def stage(self, symbol, order_type):
+        key = (symbol, order_type, parameters.ORDER_TIME_IN_FORCE)  # time in force is part of the template and may be reloaded
+        if key not in self.templates:
+            self.templates[key] = self.build_template(symbol, order_type)
+
+        return self.templates[key]
+
+    def stage_orders(self, orders):
+        '''
+        Prepares templates for [(venue symbol, order type)] legs and makes sure the connection will be open by the
+        time they are sent.
+        '''
+        for symbol, order_type in orders:
+            self.stage(symbol, order_type)
+
+        if time.monotonic() - self.last_request_time > parameters.STAGED_ORDER_IDLE_SECONDS / 2:
+            threading.Thread(target=self.warm, daemon=True).start()
+
+    def send(self, symbol, order_type, qty, price):
+        '''
+        Places a limit order from its staged template. 'qty' and 'price' are exact decimal strings.
+        @Returns
+        {"orderId", "pair"} like adapters' place_limit_order
+        '''
+        template = self.stage(symbol, order_type)
+        with self.lock:
+            method, path, body, headers = self.finish(template, qty, price, uuid.uuid4().hex, str(int(time.time() * 1000)))
+            status, response = self.request(method, path, body, headers)
+
+        return self.parse_order(symbol, status, response)
+
+    def build_template(self, symbol, order_type):
+        raise NotImplementedError
+
+    def finish(self, template, qty, price, client_order_id, timestamp):
+        raise NotImplementedError
+
+    def parse_order(self, symbol, status, response):
+        raise NotImplementedError
+
+
+class KucoinOrderStager(OrderStager):
+    order_path = "/api/v1/orders"
+    warm_path = "/api/v1/timestamp"
+
+    def __init__(self, base_url, api_public, api_secret, passphrase):
+        super().__init__(base_url, api_public, api_secret)
+        self.headers = {"KC-API-KEY": api_public,
+                        "KC-API-PASSPHRASE": base64.b64encode(self.sign(passphrase.encode())).decode(),  # v2 keys send the signed passphrase
+                        "KC-API-KEY-VERSION": "2",
+                        "Content-Type": "application/json"}
+
+    def build_template(self, symbol, order_type):
+        static_fields = json.dumps({"symbol": symbol, "side": order_type, "type": "limit", "timeInForce": parameters.ORDER_TIME_IN_FORCE}, separators=(",", ":"))
+        return {"body_prefix": static_fields[:-1] + ',"clientOid":"', "sign_infix": ("POST" + self.order_path).encode()}
+
+    def finish(self, template, qty, price, client_order_id, timestamp):
+        body = (template["body_prefix"] + client_order_id + '","price":"' + price + '","size":"' + qty + '"}').encode()
+        headers = dict(self.headers)
+        headers["KC-API-TIMESTAMP"] = timestamp
+        headers["KC-API-SIGN"] = base64.b64encode(self.sign(timestamp.encode(), template["sign_infix"], body)).decode()
+
+        return "POST", self.order_path, body, headers
+
+    def parse_order(self, symbol, status, response):
+        if response.get("code") != "200000":
+            raise StagedOrderError(response.get("msg", "HTTP {}".format(status)))
+
+        return {"orderId": response["data"]["orderId"], "pair": symbol}
+
+
+class BinanceOrderStager(OrderStager):
+    order_path = "/api/v3/order"
+    warm_path = "/api/v3/ping"
+
+    def __init__(self, base_url, api_public, api_secret):
+        super().__init__(base_url, api_public, api_secret)
+        self.headers = {"X-MBX-APIKEY": api_public, "Content-Type": "application/x-www-form-urlencoded"}
+
+    def build_template(self, symbol, order_type):
+        static_fields = urlencode({"symbol": symbol, "side": order_type.upper(), "type": "LIMIT", "timeInForce": parameters.ORDER_TIME_IN_FORCE})
+        return {"query_prefix": static_fields + "&quantity="}
+
+    def finish(self, template, qty, price, client_order_id, timestamp):
+        query = (template["query_prefix"] + qty + "&price=" + price + "&newClientOrderId=" + client_order_id + "&timestamp=" + timestamp).encode()
+        body = query + b"&signature=" + self.sign(query).hex().encode()
+
+        return "POST", self.order_path, body, self.headers
+
+    def parse_order(self, symbol, status, response):
+        if status != 200:
+            raise StagedOrderError(response.get("msg", "HTTP {}".format(status)))
+
+        return {"orderId": response["orderId"], "pair": symbol}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Local venue stand-in for benchmarking, accepts any order.
+    '''
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            self.rfile.read(length)
+
+        payload = json.dumps({"code": "200000", "data": {"orderId": "1"}, "orderId": 1}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def send_unstaged(stager, symbol, order_type, qty, price, api_secret, passphrase):
+    '''
+    Builds, serializes and signs an order from scratch the way the client libraries do, then sends it over the same
+    keep-alive connection (baseline for the staged path).
+    '''
+    timestamp = str(int(time.time() * 1000))
+    body = json.dumps({"clientOid": uuid.uuid4().hex, "side": order_type, "symbol": symbol, "type": "limit", "price": price,
+                       "size": qty, "timeInForce": parameters.ORDER_TIME_IN_FORCE}).encode()
+    signature = hmac.new(api_secret.encode(), (timestamp + "POST" + KucoinOrderStager.order_path).encode() + body, hashlib.sha256).digest()
+    headers = {"KC-API-KEY": stager.api_public,
+               "KC-API-PASSPHRASE": base64.b64encode(hmac.new(api_secret.encode(), passphrase.encode(), hashlib.sha256).digest()).decode(),
+               "KC-API-KEY-VERSION": "2",
+               "KC-API-TIMESTAMP": timestamp,
+               "KC-API-SIGN": base64.b64encode(signature).decode(),
+               "Content-Type": "application/json"}
+
+    with stager.lock:
+        return stager.request("POST", KucoinOrderStager.order_path, body, headers)
+
+
+def benchmark(num_orders):
+    '''
+    Times raw round trips, unstaged orders and staged orders against a local http stand-in.
+    @Returns
+    dict of median and p99 microseconds per order for each path
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_public, api_secret, passphrase = "key", "secret", "passphrase"
+    stager = KucoinOrderStager("http://127.0.0.1:{}".format(server.server_address[1]), api_public, api_secret, passphrase)
+    stager.stage_orders([("ETH-BTC", "buy")])
+    stager.warm()
+
+    paths = {"round_trip": lambda: stager.request("POST", KucoinOrderStager.order_path, b"{}", {"Content-Type": "application/json"}),
+             "unstaged": lambda: send_unstaged(stager, "ETH-BTC", "buy", "0.1245", "0.07951", api_secret, passphrase),
+             "staged": lambda: stager.send("ETH-BTC", "buy", "0.1245", "0.07951")}
+
+    results = {}
+    for name, send in paths.items():
+        times = []
+        for i in range(num_orders):
+            start = time.perf_counter()
+            send()
+            times.append((time.perf_counter() - start) * 1e6)
+        times.sort()
+        results[name] = {"median_us": round(times[len(times) // 2], 1), "p99_us": round(times[int(len(times) * 0.99)], 1)}
+
+    for name in ["unstaged", "staged"]:
+        results[name]["overhead_us"] = round(results[name]["median_us"] - results["round_trip"]["median_us"], 1)
+
+    server.shutdown()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pre-staged order sending against a local HTTP stand-in.")
+    parser.add_argument("--orders", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, result in benchmark(args.orders).items():
+        print("{:<12} {}".format(name, result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+import parameters
+import exchange
+import adapters
+import resilience
+import clocksync
+import trade
+
+from kucoin.client import Market as KucoinMarket
+from kucoin.client import Trade as KucoinTrade
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import pandas as pd
+import argparse
+import tempfile
+import time
+import threading
+import json
+import sys
+
+
+'''
+::: VENUE STAND-IN :::
+=====================
+Local HTTP stand-in for the Kucoin order endpoints the adapters use (limit order, bulk orders, order details, cancel by
+id, cancel all), level 2 orderbooks and the all tickers snapshot. `python standin.py` runs the checks against it
+through the real client library: partial bulk rejections, failed bulk requests, failed detail fetches, chunking, cancel
+by id and market data failover / recovery through an injected outage.
+`python standin.py --benchmark` times a leg's GTC wait/cancel path against its IOC path on the same fills.
+'''
+
+
+class StandInVenue():
+    '''
+    Order state of the stand-in. Each order fills 'fill_ratio' of its size on arrival (fill-or-kill orders fill in
+    full or not at all), then GTC orders rest until canceled and IOC/FOK orders are closed.
+    '''
+    def __init__(self, min_sizes, fill_ratio=0):
+        self.min_sizes = min_sizes  # symbol -> min order size, smaller orders are rejected
+        self.fill_ratio = fill_ratio
+        self.books = {}             # symbol -> {"bids": [[price, size], ...], "asks": [[price, size], ...]}
+        self.down_symbols = set()   # bulk requests for these symbols fail outright
+        self.details_down = False   # order detail requests fail
+        self.market_down_until = 0  # market data requests fail with a 503 until this epoch time
+        self.orders = {}            # order id -> order details
+        self.requests = []          # (method, path) of every request received
+        self.lock = threading.Lock()
+
+    def place(self, symbol, order):
+        '''
+        @Returns
+        order id, or None if the order is rejected for its size
+        '''
+        size = float(order["size"])
+        if size < self.min_sizes.get(symbol, 0):
+            return None
+
+        time_in_force = order.get("timeInForce", "GTC")
+        if time_in_force == "FOK":
+            deal_size = size if self.fill_ratio >= 1 else 0
+        else:
+            deal_size = round(size * self.fill_ratio, 10)
+
+        with self.lock:
+            order_id = "order{}".format(len(self.orders) + 1)
+            self.orders[order_id] = {"id": order_id, "symbol": symbol, "side": order["side"], "price": order["price"], "size": order["size"],
+                                     "dealSize": str(deal_size), "dealFunds": str(round(deal_size * float(order["price"]), 10)), "fee": "0",
+                                     "feeCurrency": "USDT", "isActive": time_in_force == "GTC" and deal_size < size}
+
+        return order_id
+
+    def cancel(self, order_ids):
+        '''
+        @Returns
+        ids of the open orders among 'order_ids' that were canceled
+        '''
+        with self.lock:
+            canceled = [order_id for order_id in order_ids if order_id in self.orders and self.orders[order_id]["isActive"]]
+            for order_id in canceled:
+                self.orders[order_id]["isActive"] = False
+
+        return canceled
+
+    def get_open_orders(self, symbol):
+        return [order_id for order_id, order in self.orders.items() if order["symbol"] == symbol and order["isActive"]]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # replies go out in one write, without waiting on delayed acks
+
+    def reply(self, status, data, code="200000"):
+        payload = json.dumps({"code": code, "data": data, "msg": "" if code == "200000" else data}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length > 0 else {}
+
+    def do_POST(self):
+        venue = self.server.venue
+        path = urlsplit(self.path).path
+        body = self.read_body()
+        venue.requests.append(("POST", path))
+
+        if path == "/api/v1/orders/multi":
+            if body["symbol"] in venue.down_symbols:
+                return self.reply(503, "Service unavailable", code="503000")
+
+            results = []
+            for order in body["orderList"]:
+                order_id = venue.place(body["symbol"], order)
+                results.append(dict(order, symbol=body["symbol"], id=order_id, clientOid=order["clientOid"], status="success" if order_id else "fail",
+                                    failMsg=None if order_id else "Order size below the minimum requirement."))
+            return self.reply(200, {"data": results})
+
+        if path == "/api/v1/orders":
+            order_id = venue.place(body["symbol"], body)
+            if order_id is None:
+                return self.reply(400, "Order size below the minimum requirement.", code="400100")
+            return self.reply(200, {"orderId": order_id})
+
+        self.reply(404, "Not found", code="404000")
+
+    def do_GET(self):
+        venue = self.server.venue
+        path = urlsplit(self.path).path
+        venue.requests.append(("GET", path))
+
+        if path == "/api/v1/market/allTickers":
+            if time.time() < venue.market_down_until:
+                return self.reply(503, "Service unavailable", code="503000")
+            tickers = [{"symbol": symbol, "buy": book["bids"][0][0], "sell": book["asks"][0][0], "volValue": "1000"} for symbol, book in venue.books.items()]
+            return self.reply(200, {"time": int(time.time() * 1000), "ticker": tickers})
+
+        if path == "/api/v1/market/orderbook/level2_20":
+            book = venue.books.get(parse_qs(urlsplit(self.path).query)["symbol"][0])
+            if book is None:
+                return self.reply(400, "Unsupported trading pair.", code="400100")
+            return self.reply(200, dict(book, sequence="1", time=int(time.time() * 1000)))
+
+        order_id = path.rsplit("/", 1)[-1]
+        if path.startswith("/api/v1/orders/") and order_id in venue.orders and not venue.details_down:
+            return self.reply(200, venue.orders[order_id])
+
+        self.reply(404, "Order not found", code="400100")
+
+    def do_DELETE(self):
+        venue = self.server.venue
+        url = urlsplit(self.path)
+        venue.requests.append(("DELETE", url.path))
+
+        if url.path == "/api/v1/orders":  # cancel all of a symbol
+            symbol = parse_qs(url.query)["symbol"][0]
+            return self.reply(200, {"cancelledOrderIds": venue.cancel(venue.get_open_orders(symbol))})
+
+        canceled = venue.cancel([url.path.rsplit("/", 1)[-1]])
+        if len(canceled) == 0:
+            return self.reply(400, "order_not_exist_or_not_allow_to_cancel", code="400100")
+
+        self.reply(200, {"cancelledOrderIds": canceled})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(venue):
+    '''
+    Serves 'venue' on a free local port.
+    @Returns
+    (server, base url)
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.venue = venue
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def get_trade(symbol, order_type, qty, price):
+    return {"scan_id": 0, "pair": symbol, "order_type": order_type, "order_qty": qty, "price": price}
+
+
+def run_checks():
+    '''
+    Runs the Kucoin adapter's batch order and cancel paths against a local stand-in venue.
+    @Returns
+    list of (check name, passed, detail)
+    '''
+    venue = StandInVenue({"ETH-BTC": 0.01})
+    server, url = start_server(venue)
+
+    adapter = adapters.KucoinAdapter("KUCOIN", "key", "secret", "passphrase")
+    adapter.trade = KucoinTrade("key", "secret", "passphrase", url=url)
+    checks = []
+
+    # one order of a bulk request rejected, the others placed and returned as normalized details in order
+    trades = [(0, get_trade("ETH-BTC", "buy", "0.1", "0.0795")), (1, get_trade("ETH-BTC", "buy", "0.001", "0.0795")), (2, get_trade("ETH-BTC", "sell", "0.2", "0.0796"))]
+    responses = adapter.place_symbol_batch("ETH-BTC", trades)
+    orders = [adapter.normalize_order_details(response, trade, trade_num) if response is not None else None for (trade_num, trade), response in zip(trades, responses)]
+    checks.append(("partial bulk rejection", orders[1] is None and orders[0]["original_qty"] == 0.1 and orders[2]["original_qty"] == 0.2 and orders[0]["pending"],
+                   [order["orderId"] if order else None for order in orders]))
+
+    # a failed bulk request fails only its own orders
+    venue.down_symbols.add("BTC-USDT")
+    responses = adapter.place_symbol_batch("BTC-USDT", [(0, get_trade("BTC-USDT", "buy", "0.01", "50000"))])
+    checks.append(("failed bulk request", responses == [None], responses))
+    venue.down_symbols.clear()
+
+    # accepted orders are still returned (open, fill state unknown) if their details can't be fetched
+    venue.details_down = True
+    responses = adapter.place_symbol_batch("ETH-USDT", [(0, get_trade("ETH-USDT", "sell", "0.5", "4000"))])
+    checks.append(("failed detail fetch", responses[0] is not None and responses[0]["isActive"] and responses[0]["unresolved"] and responses[0]["id"] in venue.orders, responses))
+    venue.details_down = False
+
+    # more orders than fit one bulk request go out in chunks of 5
+    num_requests = len(venue.requests)
+    responses = adapter.place_symbol_batch("KCS-USDT", [(i, get_trade("KCS-USDT", "buy", "1", "10")) for i in range(7)])
+    bulk_requests = [request for request in venue.requests[num_requests:] if request == ("POST", "/api/v1/orders/multi")]
+    checks.append(("bulk chunking", len(bulk_requests) == 2 and all(response is not None for response in responses), len(bulk_requests)))
+
+    # canceling a batch cancels its orders by id and leaves other open orders on the same symbols alone
+    foreign_order_id = adapter.trade.create_limit_order("ETH-BTC", "buy", "0.3", "0.0790")["orderId"]
+    batch = [order for order in orders if order is not None] + [dict(orders[0])]  # already canceled by the time its duplicate is
+    canceled = adapter.cancel_orders(batch)
+    checks.append(("cancel by id", sorted(canceled) == sorted([orders[0]["orderId"], orders[2]["orderId"]]) and foreign_order_id in venue.get_open_orders("ETH-BTC"),
+                   {"canceled": canceled, "open": venue.get_open_orders("ETH-BTC")}))
+
+    server.shutdown()
+
+    checks.append(check_failover_recovery(outage_secs=1.0, reset_secs=0.25, poll_secs=0.05))
+
+    return checks
+
+
+def check_failover_recovery(outage_secs, reset_secs, poll_secs):
+    '''
+    Injects an 'outage_secs' long 503 outage into the primary market data host and polls snapshots through
+    resilience.call_with_failover every 'poll_secs', like scans do, with a healthy fallback host. Measures how long the
+    first snapshot of the outage took (failover) and how long after the outage the primary circuit closed again (its
+    half-open trial call succeeding, within 'reset_secs' of a failed one).
+    @Returns
+    (check name, passed, detail)
+    '''
+    books = {"ETH-BTC": {"bids": [["0.07950", "10"]], "asks": [["0.07951", "10"]]}}
+    primary, fallback = StandInVenue({}), StandInVenue({})
+    primary.books, fallback.books = books, books
+    (primary_server, primary_url), (fallback_server, fallback_url) = start_server(primary), start_server(fallback)
+
+    adapter = adapters.KucoinAdapter("KUCOIN", "key", "secret", "passphrase")
+    adapter.market, adapter.market_fallback = KucoinMarket(url=primary_url), KucoinMarket(url=fallback_url)
+    adapter.map_symbols(pd.DataFrame(index=["ETHBTC"]), ["ETH-BTC"])
+    breakers = {"primary": resilience.CircuitBreaker("stand-in market data", reset_secs=reset_secs),
+                "fallback": resilience.CircuitBreaker("stand-in fallback market data", reset_secs=reset_secs)}
+    sources = [("primary", lambda: adapter.get_orderbook_tickers()), ("fallback", lambda: adapter.get_orderbook_tickers(fallback=True))]
+
+    outage_start = time.time()
+    primary.market_down_until = outage_start + outage_secs
+    failover_secs, failed_polls = None, 0
+    while time.time() - outage_start < outage_secs + reset_secs + 1:
+        poll_start = time.time()
+        orderbook = resilience.call_with_failover(sources, breakers, max_tries=0)
+        if orderbook is None:
+            failed_polls += 1
+        elif failover_secs is None:
+            failover_secs = time.time() - outage_start
+
+        if time.time() > primary.market_down_until and breakers["primary"].state == "closed":
+            break
+        time.sleep(max(poll_secs - (time.time() - poll_start), 0))
+    recovery_secs = time.time() - primary.market_down_until
+
+    primary_server.shutdown()
+    fallback_server.shutdown()
+
+    passed = failed_polls == 0 and failover_secs is not None and breakers["primary"].state == "closed" and recovery_secs <= reset_secs + poll_secs + 0.1
+    return ("failover recovery", passed, {"failover_secs": round(failover_secs, 4) if failover_secs is not None else None,
+                                          "recovery_secs": round(recovery_secs, 4), "failed_polls": failed_polls,
+                                          "primary": {key: value for key, value in breakers["primary"].get_metrics().items() if key in ["calls", "failed_calls", "outages"]}})
+
+
+class StandInExchange():
+    '''
+    The parts of exchange.Exchange the trade path uses, over a Kucoin adapter pointed at the stand-in.
+    '''
+    get_pair_info = exchange.Exchange.get_pair_info
+    place_batch_orders = exchange.Exchange.place_batch_orders
+
+    def __init__(self, adapter, assets_info, trading_target_qty):
+        self.name = adapter.name
+        self.adapter = adapter
+        self.assets_info = assets_info
+        self.trading_target_qty = trading_target_qty
+        self.clock = clocksync.ClockSync(adapter.name, time.time)  # stand-in shares the local clock
+        self.recorder = None
+        self.attribution = None
+
+
+def time_leg(ex, leg, time_in_force):
+    '''
+    Places one leg and resolves it on the 'time_in_force' path (GTC wait/cancel/retry or IOC/FOK remainders).
+    @Returns
+    (leg secs, share of the leg's qty filled, orders placed)
+    '''
+    parameters.ORDER_TIME_IN_FORCE = time_in_force
+    t = trade.Trade(ex, trade.prep_trade(ex, dict(leg)), 1)  # a middle leg, a partial first leg is not given up on
+
+    start = time.perf_counter()
+    order = t.execute_limit_trade()
+    if time_in_force in ["IOC", "FOK"]:
+        additional_orders, _ = t.handle_ioc_order(order)
+    else:
+        additional_orders, _ = t.handle_order(order)
+    leg_secs = time.perf_counter() - start
+
+    orders = [order] + additional_orders
+    return leg_secs, sum(max(order["filled_qty"], 0) for order in orders) / t.orig_trade_qty, len(orders)
+
+
+def benchmark(num_legs, fill_ratio):
+    '''
+    Times single legs on the GTC wait/cancel path and the IOC path against the stand-in, with every order filling
+    'fill_ratio' of its size on arrival.
+    @Returns
+    dict of median leg secs, mean share filled and mean orders per leg for each path
+    '''
+    venue = StandInVenue({}, fill_ratio)
+    venue.books["ETH-BTC"] = {"bids": [["0.07950", "10"], ["0.07949", "10"]], "asks": [[price, "10"] for price in ["0.07951", "0.07952", "0.07953", "0.07954", "0.07955"]]}
+    server, url = start_server(venue)
+
+    adapter = adapters.KucoinAdapter("KUCOIN", "key", "secret", "passphrase")
+    adapter.trade = KucoinTrade("key", "secret", "passphrase", url=url)
+    adapter.market.url = url
+    adapter.stager = None
+    assets_info = pd.DataFrame({"baseAsset": ["ETH"], "quoteAsset": ["BTC"], "baseMinQty": [0.0001], "baseMaxQty": [1e9], "baseQtyPrecision": [4],
+                                "quoteQtyPrecision": [8], "basePricePrecision": [5], "baseMinNotional": [""], "tradingEnabled": [True]}, index=["ETHBTC"])
+    adapter.map_symbols(assets_info, ["ETH-BTC"])
+    ex = StandInExchange(adapter, assets_info, trading_target_qty=0.001)
+    leg = {"scan_id": 0, "pair": "ETH-BTC", "order_type": "buy", "side": "ask", "qty_lots": 100, "price_ticks": 7951}  # 0.01 ETH at 0.07951
+
+    time_in_force = parameters.ORDER_TIME_IN_FORCE
+    results = {}
+    for path in ["GTC", "IOC"]:
+        legs = [time_leg(ex, leg, path) for i in range(num_legs)]
+        leg_secs = sorted(leg_secs for leg_secs, _, _ in legs)
+        results[path] = {"median_leg_secs": round(leg_secs[len(leg_secs) // 2], 4),
+                         "filled_percent": round(100 * sum(filled for _, filled, _ in legs) / num_legs, 2),
+                         "orders_per_leg": round(sum(num_orders for _, _, num_orders in legs) / num_legs, 1)}
+    parameters.ORDER_TIME_IN_FORCE = time_in_force
+
+    server.shutdown()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the batch order and cancel paths against a local venue stand-in.")
+    parser.add_argument("--save-path", default=None, help="directory for the console log (a temporary one by default)")
+    parser.add_argument("--benchmark", action="store_true", help="time the GTC and IOC leg paths instead of running the checks")
+    parser.add_argument("--legs", type=int, default=3, help="legs timed per path")
+    parser.add_argument("--fill-ratio", type=float, default=0.5, help="share of each benchmark order filled on arrival")
+    args = parser.parse_args()
+    parameters.SAVE_PATH = (args.save_path or tempfile.mkdtemp()).rstrip("/") + "/"
+
+    if args.benchmark:
+        if not 0 < args.fill_ratio <= 1:
+            parser.error("--fill-ratio must be in (0, 1], the GTC path re-places a middle leg that never fills indefinitely")
+        for path, result in benchmark(args.legs, args.fill_ratio).items():
+            print("{:<6} {}".format(path, result))
+        return
+
+    failed = 0
+    for name, passed, detail in run_checks():
+        print("{:<6} {:<24} {}".format("PASS" if passed else "FAIL", name, detail))
+        failed += not passed
+
+    sys.exit(1 if failed > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import parameters
+
+from multiprocessing import shared_memory
+from multiprocessing import Pool
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+import glob
+import os
+
+
+'''
+::: SIMULATION MODEL :::
+========================
+Every recorded scan is reduced to its best triangle (pair + direction). With a given SCAN_LENGTH_SECONDS the bot only
+sees one of every 'stride' recorded scans. When the best profit of a seen scan clears 3 * fee + MIN_PROFIT an
+arbitrage is attempted, and it "fills" at the profit the same pair/direction shows in the next recorded scan (what is
+left once execution lands). If that profit no longer covers the fees the first leg isn't filled and nothing is made.
+Each arbitrage trades the capital left after the TARGET_MIN_LIQUIDITY reserve. Recorded scans carry no orderbook depth,
+so fills aren't liquidity limited and the reserve only scales pnl, which is why it isn't swept.
+'''
+
+SCAN_COLUMNS = ["run_id", "scan_pos", "best_profit", "realized_profit", "scan_interval_secs"]
+
+shared_scans = {}  # worker-side zero-copy views of the shared scan arrays
+
+
+def load_runs(data_path):
+    '''
+    Loads every recorded scan_history csv under 'data_path' and reduces each scan to its best triangle.
+    @Returns
+    dict of column name -> numpy array, one entry per recorded scan
+    '''
+    runs = []
+    for run_id, scan_history_path in enumerate(sorted(glob.glob(os.path.join(data_path, "run*", "scan_history_*.csv")))):
+        scans = pd.read_csv(scan_history_path, usecols=["scan_id", "pair", "net_forward", "net_reverse", "timestamp"])
+        scans["run_id"] = run_id
+        runs.append(scans)
+
+    scans = pd.concat(runs, ignore_index=True)
+    scans["direction"] = np.where(scans["net_forward"] >= scans["net_reverse"], "net_forward", "net_reverse")
+    scans["profit"] = scans[["net_forward", "net_reverse"]].max(axis=1)
+
+    # best triangle per scan
+    best = scans.loc[scans.groupby(["run_id", "scan_id"])["profit"].idxmax()].sort_values(["run_id", "scan_id"]).reset_index(drop=True)
+    best["scan_pos"] = best.groupby("run_id").cumcount()
+    best["best_profit"] = best["profit"]
+
+    # profit of the same pair/direction in the next recorded scan of the run
+    next_scans = scans.set_index(["run_id", "scan_id", "pair"])[["net_forward", "net_reverse"]]
+    next_keys = pd.MultiIndex.from_arrays([best["run_id"], best.groupby("run_id")["scan_id"].shift(-1).fillna(-1).astype(int), best["pair"]])
+    next_profits = next_scans.reindex(next_keys).to_numpy()
+    best["realized_profit"] = np.where(best["direction"] == "net_forward", next_profits[:, 0], next_profits[:, 1])
+
+    # median seconds between recorded scans of each run
+    seconds = pd.to_timedelta(best["timestamp"]).dt.total_seconds()
+    intervals = seconds.groupby(best["run_id"]).diff()
+    run_intervals = intervals[intervals > 0].groupby(best["run_id"]).median()
+    best["scan_interval_secs"] = best["run_id"].map(run_intervals).fillna(1)
+
+    return {column: best[column].to_numpy(dtype=float) for column in SCAN_COLUMNS}
+
+
+def share_arrays(arrays):
+    '''
+    Copies each array into a shared memory block once, so pool workers map the same memory instead of receiving copies.
+    @Returns
+    (list of SharedMemory blocks to release later, dict of column -> (block name, length))
+    '''
+    blocks, layout = [], {}
+    for column, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=np.float64, buffer=block.buf)[:] = array
+        blocks.append(block)
+        layout[column] = (block.name, len(array))
+
+    return blocks, layout
+
+
+def attach_arrays(layout):
+    '''
+    Pool worker initializer. Maps the shared scan arrays without copying them.
+    '''
+    for column, (block_name, length) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        shared_scans[column + "_block"] = block  # keep the mapping alive
+        shared_scans[column] = np.ndarray((length,), dtype=np.float64, buffer=block.buf)
+
+
+def simulate(config):
+    '''
+    Simulates one parameter configuration over every recorded run.
+    @Returns
+    dict of config values and simulated results
+    '''
+    fee = config["maker_fee"] * 3  # 3 trades required for arbitrage hence *3
+    trading_qty = config["capital"] * (1 - parameters.TARGET_MIN_LIQUIDITY)
+
+    stride = np.maximum(np.round(config["scan_length"] / shared_scans["scan_interval_secs"]), 1)
+    seen = shared_scans["scan_pos"] % stride == 0
+    attempted = seen & (shared_scans["best_profit"] / 100 > fee + config["min_profit"])
+    filled = attempted & (shared_scans["realized_profit"] / 100 > fee)  # nan (pair gone) counts as not filled
+
+    pnl = trading_qty * (shared_scans["realized_profit"][filled] / 100 - fee)
+    num_attempted = int(attempted.sum())
+
+    result = dict(config)
+    result["scans_seen"] = int(seen.sum())
+    result["attempted"] = num_attempted
+    result["filled"] = int(filled.sum())
+    result["fill_rate"] = filled.sum() / num_attempted if num_attempted > 0 else 0
+    result["pnl"] = pnl.sum()
+    result["pnl_per_attempt"] = result["pnl"] / num_attempted if num_attempted > 0 else 0
+
+    return result
+
+
+def get_configs(args):
+    '''
+    Builds every combination of the swept parameter values.
+    '''
+    grid = {"min_profit": args.min_profit, "scan_length": args.scan_length, "maker_fee": args.maker_fee}
+    return [dict(zip(grid.keys(), values), capital=args.capital) for values in itertools.product(*grid.values())]
+
+
+def parse_values(values):
+    return [float(value) for value in values.split(",")]
+
+
+def main():
+    default_exchange = "KUCOIN"
+    parser = argparse.ArgumentParser(description="Sweep trading parameters over recorded data/run* histories.")
+    parser.add_argument("data_path", nargs="?", default="data")
+    parser.add_argument("--min-profit", type=parse_values, default=[parameters.MIN_PROFIT])
+    parser.add_argument("--scan-length", type=parse_values, default=[parameters.SCAN_LENGTH_SECONDS])
+    parser.add_argument("--maker-fee", type=parse_values, default=[parameters.TRADING_FEES[default_exchange]["maker"]])
+    parser.add_argument("--capital", type=float, default=100.0, help="starting TARGET_ASSET qty")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep_results.csv")
+    args = parser.parse_args()
+
+    arrays = load_runs(args.data_path)
+    configs = get_configs(args)
+    print("Loaded {} recorded scans. Simulating {} configurations on {} workers...".format(len(arrays["best_profit"]), len(configs), args.workers))
+
+    blocks, layout = share_arrays(arrays)
+    try:
+        with Pool(args.workers, initializer=attach_arrays, initargs=(layout,)) as pool:
+            results = pool.map(simulate, configs)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results = pd.DataFrame(results).sort_values(["pnl", "fill_rate"], ascending=False).reset_index(drop=True)
+    results.to_csv(args.output)
+    print(results.head(20).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import parameters
+import market
+import log
+
+import numpy as np
+import pandas as pd
+import time
+
+
+class TieringScheduler():
+    '''
+    Splits triangles into a hot tier refreshed every tick and a cold tier refreshed by a full ticker snapshot every
+    TIER_COLD_SCAN_SECONDS. Between full snapshots only the hot triangles' leg symbols are fetched (targeted ticker
+    requests) and only hot triangles are scanned. Hot ticks are recorded, published to the snapshot bus and fail over
+    through the same circuit breakers as full snapshots. A hot tick snapshot is stamped (attrs) with the time of its
+    refreshed symbols, but published to the bus with the time of the full snapshot under it (its oldest rows).
+    Triangles are hot if every leg trades at least TIER_MIN_VOLUME (24h, valued in the target asset, where the venue
+    reports volume) at a spread of at most TIER_MAX_SPREAD_PERCENT, ranked by how often they were recently near the
+    profit threshold (time weighted, so hot triangles being sampled more often doesn't inflate it).
+    The hot tier is capped so that full snapshots plus hot ticks spend no more api weight per second than one full
+    snapshot every SCAN_LENGTH_SECONDS (see TIER_API_WEIGHTS).
+    '''
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.state = pd.DataFrame(columns=["near_fraction", "best_profit", "time"], dtype=float)  # per pair
+        self.hot_pairs = []    # swapped in whole
+        self.hot_symbols = []  # stripped leg symbols of the hot pairs
+        self.last_full_snapshot = None
+        self.last_full_time = 0
+
+        self.start_time = time.time()
+        self.full_snapshots = 0
+        self.hot_ticks = 0
+        self.api_weight = 0
+
+    def get_legs(self, pair):
+        base_asset = self.exchange.assets_info.loc[pair]["baseAsset"]
+        quote_asset = self.exchange.assets_info.loc[pair]["quoteAsset"]
+
+        return [base_asset + self.exchange.target_asset, quote_asset + self.exchange.target_asset, pair]
+
+    def get_max_hot_symbols(self):
+        '''
+        @Returns
+        most leg symbols a hot tick can fetch within the api budget left after full snapshots
+        '''
+        weights = parameters.TIER_API_WEIGHTS[self.exchange.name]
+        weight_per_sec = weights["snapshot"] / parameters.SCAN_LENGTH_SECONDS - weights["snapshot"] / parameters.TIER_COLD_SCAN_SECONDS
+        tick_weight = weight_per_sec * parameters.TIER_HOT_SCAN_SECONDS - weights["request"]
+        if tick_weight < 0:
+            return 0
+        if weights["symbol"] == 0:
+            return np.inf  # one request fetches any number of symbols
+
+        return int(tick_weight // weights["symbol"])
+
+    def get_tick_secs(self):
+        return parameters.TIER_HOT_SCAN_SECONDS if len(self.hot_pairs) > 0 else parameters.SCAN_LENGTH_SECONDS
+
+    def take_snapshot(self):
+        '''
+        Takes a full snapshot when the cold tier is due (or nothing is hot), otherwise refreshes the hot symbols on top of
+        the last full snapshot.
+        @Returns
+        orderbook snapshot, hot tick snapshots name the triangles they refreshed in attrs 'tier_pairs'
+        '''
+        hot_pairs, hot_symbols = self.hot_pairs, self.hot_symbols
+        weights = parameters.TIER_API_WEIGHTS[self.exchange.name]
+
+        if self.last_full_snapshot is not None and len(hot_pairs) > 0 and time.time() - self.last_full_time < parameters.TIER_COLD_SCAN_SECONDS:
+            tickers = market.take_symbol_tickers(self.exchange, hot_symbols)  # ** API CALL **
+            self.api_weight += weights["request"] + weights["symbol"] * len(hot_symbols)
+            if tickers is not None:
+                orderbook = self.last_full_snapshot.copy()
+                orderbook.update(tickers[["bidPrice", "askPrice"]])
+                orderbook.attrs = dict(tickers.attrs)  # only hot triangles are scanned, from the refreshed rows
+                orderbook.attrs["tier_pairs"] = hot_pairs
+                orderbook.attrs["refreshed_symbols"] = list(tickers.index.intersection(orderbook.index))
+                market.publish_snapshot(self.exchange, orderbook, stamp=self.last_full_snapshot.attrs)  # bus readers see every row's worst case age
+                self.hot_ticks += 1
+                return orderbook
+
+        orderbook = market.take_orderbook_snapshot(self.exchange)  # ** API CALL **
+        self.api_weight += weights["snapshot"]
+        if orderbook is not None and orderbook is not self.last_full_snapshot:
+            self.last_full_snapshot = orderbook
+            self.last_full_time = time.time()
+            self.full_snapshots += 1
+
+        return orderbook
+
+    def update(self, scan):
+        '''
+        Folds a scan into each triangle's near-threshold frequency and re-picks the hot tier.
+        '''
+        if len(scan) == 0:
+            return
+
+        now = time.time()
+        threshold_percent = (parameters.TRADING_FEES[self.exchange.name]["maker"] * 3 + parameters.MIN_PROFIT) * 100  # 3 trades required for arbitrage hence *3
+        best_profit = scan[["net_forward", "net_reverse"]].max(axis=1).set_axis(scan["pair"])
+        best_profit = best_profit[~best_profit.index.duplicated()]
+        near = (best_profit >= threshold_percent - parameters.TIER_NEAR_PROFIT_WINDOW_PERCENT).astype(float)
+
+        state = self.state.reindex(best_profit.index)
+        weight = (1 - 0.5 ** ((now - state["time"]) / parameters.TIER_ACTIVITY_HALF_LIFE_SECONDS)).fillna(1)
+        near_fraction = state["near_fraction"].fillna(near)
+
+        updated = pd.DataFrame({"near_fraction": near_fraction + weight * (near - near_fraction), "best_profit": best_profit, "time": now}, index=best_profit.index)
+        # keep triangles missing from this scan (cold ones between full snapshots)
+        dropped = self.state.index.difference(updated.index)
+        self.state = pd.concat([updated, self.state.loc[dropped]]) if len(dropped) > 0 else updated
+
+        self.classify()
+
+    def get_eligible(self, pairs):
+        '''
+        @Returns
+        boolean Series of which 'pairs' pass the leg volume and spread requirements of the hot tier
+        '''
+        orderbook = self.last_full_snapshot
+        legs = pd.DataFrame([self.get_legs(pair) for pair in pairs], index=pairs)
+
+        spreads = ((orderbook["askPrice"] - orderbook["bidPrice"]) / ((orderbook["askPrice"] + orderbook["bidPrice"]) / 2) * 100)
+        leg_spreads = legs.apply(lambda leg: leg.map(spreads))
+        eligible = leg_spreads.max(axis=1) <= parameters.TIER_MAX_SPREAD_PERCENT
+
+        if "quoteVolume" in orderbook.columns:
+            quote_rates = self.exchange.assets_info["quoteAsset"].reindex(orderbook.index).map(self.exchange.conversion_rates)
+            volumes = orderbook["quoteVolume"] * quote_rates
+            leg_volumes = legs.apply(lambda leg: leg.map(volumes))
+            eligible &= leg_volumes.min(axis=1).fillna(np.inf) >= parameters.TIER_MIN_VOLUME  # unvalued volume doesn't disqualify
+
+        return eligible
+
+    def classify(self):
+        '''
+        Picks the hot tier: eligible triangles by near-threshold frequency (then current profit), as many as
+        TIER_MAX_HOT_TRIANGLES and the api budget allow.
+        '''
+        if self.last_full_snapshot is None:
+            return
+
+        pairs = [pair for pair in self.exchange.valid_pairs if pair in self.state.index]
+        if len(pairs) == 0:
+            return
+
+        state = self.state.loc[pairs]
+        ranked = state[self.get_eligible(pairs)].sort_values(["near_fraction", "best_profit"], ascending=False)
+
+        max_hot_symbols = self.get_max_hot_symbols()
+        hot_pairs, hot_symbols = [], []
+        for pair in ranked.index:
+            if len(hot_pairs) == parameters.TIER_MAX_HOT_TRIANGLES:
+                break
+
+            symbols = [symbol for symbol in self.get_legs(pair) if symbol not in hot_symbols]
+            if len(hot_symbols) + len(symbols) <= max_hot_symbols:  # a lower ranked triangle may still fit on shared legs
+                hot_pairs.append(pair)
+                hot_symbols += symbols
+
+        if hot_pairs != self.hot_pairs:
+            log.print_status("MSG: Hot triangles ({} secs refresh) -> {}".format(parameters.TIER_HOT_SCAN_SECONDS, hot_pairs))
+
+        self.hot_pairs, self.hot_symbols = hot_pairs, hot_symbols
+
+    def get_metrics(self):
+        '''
+        @Returns
+        dict of full snapshots, hot ticks, hot triangles and api weight spent per second against the untiered budget
+        '''
+        weights = parameters.TIER_API_WEIGHTS[self.exchange.name]
+        elapsed_secs = max(time.time() - self.start_time, 1e-9)
+
+        return {"full_snapshots": self.full_snapshots,
+                "hot_ticks": self.hot_ticks,
+                "hot_pairs": len(self.hot_pairs),
+                "weight_per_sec": round(self.api_weight / elapsed_secs, 3),
+                "budget_per_sec": round(weights["snapshot"] / parameters.SCAN_LENGTH_SECONDS, 3)}
@@ -4,6 +4,7 @@ import market
 import helper
 import log
 
+from fractions import Fraction
 import pandas as pd
 pd.options.mode.chained_assignment = None
 import time
@@ -34,12 +35,18 @@ class TradePlan():
     def __init__(self, ex, scan_id, trade_template):
         self.exchange = ex
         self.trade_template = trade_template
+        self.failure_reason = None  # "unavailable", "unprofitable" or "invalid" when planning fails
+        self.exchange.adapter.stage_orders(get_leg_orders(self.exchange, self.trade_template))  # ready before the plan is
         self.trade_set = self.build_trade_set(self.exchange, self.trade_template)
         self.max_quantities = self.calculate_max_quantities(self.trade_set)
         self.trade_plan = self.generate_trade_plan(self.exchange, self.trade_set, self.max_quantities)
 
         if self.trade_plan is not None:
             self.trade_plan["scan_id"] = scan_id
+            if not self.trade_plan["valid"].all():
+                self.failure_reason = "invalid"
+        elif self.failure_reason is None:
+            self.failure_reason = "unprofitable"
 
     def optimize_orderbook_depths(self, exchange, orderbooks, pairs, trade_template):
         '''
@@ -82,6 +89,10 @@ class TradePlan():
         dict with optimal qty and prices for each arbitrage pair
         '''
         orderbooks, pairs = market.get_trade_set_orderbooks(exchange, trade_template)
+        if orderbooks is None:
+            self.failure_reason = "unavailable"  # missing, empty or stale leg orderbook
+            return None
+
         orderbook_depths = self.optimize_orderbook_depths(exchange, orderbooks, pairs, trade_template)
 
         print(orderbook_depths)  # temp
@@ -104,9 +115,14 @@ class TradePlan():
             trade_set["right_x_target_qty"] = float(orderbooks[2]["bids"][orderbook_depths[2]][1])
             trade_set["end_profit_percent"] = arbitrage.calculate_reverse_arbitrage((trade_set["left_x_target_rate"], trade_set["right_x_target_rate"], trade_set["left_x_right_rate"]))
 
+        if exchange.attribution is not None and parameters.SLIPPAGE_AWARE_PLANNING:  # price in the slippage these legs have been filling at
+            trade_set["expected_slippage_percent"] = exchange.attribution.get_expected_slippage_percent(get_leg_orders(exchange, trade_template), trade_set["best_direction"])
+            trade_set["end_profit_percent"] -= trade_set["expected_slippage_percent"]
+
         if market.is_profitable(exchange, trade_set):
             return trade_set
 
+        self.failure_reason = "unprofitable"
         return None
 
     def calculate_max_quantities(self, trade_set):
@@ -168,76 +184,63 @@ class TradePlan():
                 if i == 0:  # trade 1
                     trade["order_type"] = "buy"
                     trade["side"] = "ask"
-                    trade["pair"] = quote_asset + "-" + trade_set["target"]  # right_x_target
+                    trade["pair"] = exchange.adapter.get_symbol(quote_asset, trade_set["target"])  # right_x_target
                     trade["price"] = trade_set["right_x_target_rate"]
-
-                    trade["qty"] = tradeable_target_qty / trade_set["right_x_target_rate"]
                     trade["max_trading_qty"] = max_quantities["max_right_x_target_qty"]
 
-                    if trade["qty"] > max_quantities["max_right_x_target_qty"]:  # check if quantity exceeds max quantity offered in order book
-                        trade["qty"] = max_quantities["max_right_x_target_qty"]
-
                 elif i == 1:  # trade 2
                     trade["order_type"] = "buy"
                     trade["side"] = "ask"
-                    trade["pair"] = base_asset + "-" + quote_asset  # left_x_right
+                    trade["pair"] = exchange.adapter.get_symbol(base_asset, quote_asset)  # left_x_right
                     trade["price"] = trade_set["pair_rate"]
-
-                    trade["qty"] = trade_plan[i - 1]["qty"] / trade_set["pair_rate"]  # BEFORE -> trade_item["pair_rate"] * trade_plan[i - 1]["qty"]
                     trade["max_trading_qty"] = max_quantities["max_left_x_right_qty"]
 
-                    if trade["qty"] > max_quantities["max_left_x_right_qty"]:  # check if quantity exceeds max quantity offered in order book
-                        trade["qty"] = max_quantities["max_left_x_right_qty"]
-
                 else:  # trade 3
                     trade["order_type"] = "sell"
                     trade["side"] = "bid"
-                    trade["pair"] = base_asset + "-" + trade_set["target"]  # left_x_target
+                    trade["pair"] = exchange.adapter.get_symbol(base_asset, trade_set["target"])  # left_x_target
                     trade["price"] = trade_set["left_x_target_rate"]
-
-                    trade["qty"] = trade_plan[i - 1]["qty"]
                     trade["max_trading_qty"] = max_quantities["max_left_x_target_qty"]
-
-                    if trade["qty"] > max_quantities["max_left_x_target_qty"]:  # check if quantity exceeds max quantity offered in order book
-                        trade["qty"] = max_quantities["max_left_x_target_qty"]
             else:
                 trade["direction"] = "reverse"
 
                 if i == 0:  # trade 1
                     trade["order_type"] = "buy"
                     trade["side"] = "ask"
-                    trade["pair"] = base_asset + "-" + trade_set["target"]  # left_x_target
+                    trade["pair"] = exchange.adapter.get_symbol(base_asset, trade_set["target"])  # left_x_target
                     trade["price"] = trade_set["left_x_target_rate"]
-
-                    trade["qty"] = tradeable_target_qty / trade_set["left_x_target_rate"]
                     trade["max_trading_qty"] = max_quantities["max_left_x_target_qty"]
 
-                    if trade["qty"] > max_quantities["max_left_x_target_qty"]:  # check if quantity exceeds max quantity offered in order book
-                        trade["qty"] = max_quantities["max_left_x_target_qty"]
-
                 elif i == 1:  # trade 2
                     trade["order_type"] = "sell"
                     trade["side"] = "bid"
-                    trade["pair"] = base_asset + "-" + quote_asset  # left_x_right
+                    trade["pair"] = exchange.adapter.get_symbol(base_asset, quote_asset)  # left_x_right
                     trade["price"] = trade_set["pair_rate"]
-
-                    trade["qty"] = trade_plan[i - 1]["qty"]
                     trade["max_trading_qty"] = max_quantities["max_left_x_right_qty"]
-                    # check if quantity exceeds max quantity offered in order book
-                    if trade["qty"] > max_quantities["max_left_x_right_qty"]:
-                        trade["qty"] = max_quantities["max_left_x_right_qty"]
 
                 else:  # trade 3
                     trade["order_type"] = "sell"
                     trade["side"] = "bid"
-                    trade["pair"] = quote_asset + "-" + trade_set["target"]  # right_x_target
+                    trade["pair"] = exchange.adapter.get_symbol(quote_asset, trade_set["target"])  # right_x_target
                     trade["price"] = trade_set["right_x_target_rate"]
-
-                    trade["qty"] = trade_set["pair_rate"] * trade_plan[i - 1]["qty"]
                     trade["max_trading_qty"] = max_quantities["max_right_x_target_qty"]
-                    # check if quantity exceeds max quantity offered in order book
-                    if trade["qty"] > max_quantities["max_right_x_target_qty"]:
-                        trade["qty"] = max_quantities["max_right_x_target_qty"]
+
+            # size in integer qty lots, each trade spends exactly what the trade before it results in
+            qty_precision, price_precision = get_lot_precisions(exchange, trade["pair"])
+            trade["price_ticks"] = helper.to_ticks(float(trade["price"]), price_precision, round_down=False)
+            if i == 0:
+                qty_lots = helper.to_ticks(tradeable_target_qty * 10 ** price_precision / trade["price_ticks"], qty_precision)  # spends the target qty
+            else:
+                last_trade = trade_plan[i - 1]
+                last_qty_precision, last_price_precision = get_lot_precisions(exchange, last_trade["pair"])
+                if last_trade["order_type"] == "sell":  # sells the quote asset the last trade resulted in
+                    qty_lots = helper.multiply_ticks(last_trade["qty_lots"], last_qty_precision, last_trade["price_ticks"], last_price_precision, qty_precision)
+                elif trade["order_type"] == "buy":  # buys with the base asset the last trade bought
+                    qty_lots = helper.divide_ticks(last_trade["qty_lots"], last_qty_precision, trade["price_ticks"], price_precision, qty_precision)
+                else:  # sells the base asset the last trade bought
+                    qty_lots = helper.convert_ticks(last_trade["qty_lots"], last_qty_precision, qty_precision)
+
+            trade["qty_lots"] = min(qty_lots, helper.to_ticks(trade["max_trading_qty"], qty_precision))  # check if quantity exceeds max quantity offered in order book
 
             trade_plan.append(prep_trade(exchange, trade, trade_set))  # prep and add trade to trade plan
 
@@ -252,39 +255,55 @@ class Trade():
 
         self.orig_trade_qty = trade["qty"]  # save to compare end resulting qty with original trading qty intent
         self.orig_trade_price = float(trade["price"])
+        self.orig_qty_lots = int(trade["qty_lots"])
+        self.orig_price_ticks = int(trade["price_ticks"])
+        self.qty_precision, self.price_precision = get_lot_precisions(exchange, trade["pair"])
         self.unused_qty = exchange.trading_target_qty - (trade["qty"] * float(trade["price"]))
         self.trading_target_qty = exchange.trading_target_qty  # starting target qty
         self.ending_target_qty = 0
         self.orderbook_depth = 0
 
         self.partially_filled = False
-        self.invalid_order_qty = -1
+        self.invalid_order_lots = -1
         self.trade_complete = False
         self.arbitrage_lost = False
         self.order_mostly_filled = False
 
+    def get_lots(self, qty):
+        '''
+        @Returns
+        'qty' of the trade's base asset (order quantities, orderbook levels) in integer qty lots
+        '''
+        return helper.to_ticks(float(qty), self.qty_precision)
+
+    def get_filled_lots(self, order):
+        '''
+        @Returns
+        qty lots 'order' filled, rounded up (a fill of part of a lot uses up the lot, so unfilled lots always shrink)
+        '''
+        return -helper.to_ticks(-float(order["filled_qty"]), self.qty_precision)
+
+    def set_qty_lots(self, qty_lots):
+        self.trade["qty_lots"] = qty_lots
+        self.trade["qty"] = helper.from_ticks(qty_lots, self.qty_precision)
+
     def update_order_details(self, order):
         '''
         Extract order details from exchange-specific limit order placement api response.
         '''
-        if self.exchange.name == "BINANCE" or self.exchange.name == "BINANCE.US":
-            return order  # TODO ## <- edit so that it matches kucoin revised order details
-        elif self.exchange.name == "KUCOIN":
-            order_details = self.exchange.trade.get_order_details(order["orderId"])  # API CALL ##
-            revised_order_details = {"scan_id": self.trade["scan_id"],
-                                     "trade_num": self.trade_num,
-                                     "orderId": order_details["id"],
-                                     "order_type": self.trade["order_type"],
-                                     "pair": order_details["symbol"],
-                                     "pending": bool(order_details["isActive"]),
-                                     "price": float(order_details["price"]),
-                                     "original_qty": float(order_details["size"]),
-                                     "filled_qty": float(order_details["dealSize"]),
-                                     "result_qty": float(order_details["dealFunds"]),
-                                     "fee": float(order_details["fee"]),
-                                     "fee_currency": order_details["feeCurrency"]}
-
-        return revised_order_details
+        order_details = self.exchange.adapter.get_order_details(order)  # API CALL ##
+
+        return self.exchange.adapter.normalize_order_details(order_details, self.trade, self.trade_num)
+
+    def resolve_order_details(self, order):
+        '''
+        Refetches order details. If they can't be fetched the order is returned flagged 'unresolved' (fill state unknown).
+        '''
+        try:
+            return self.update_order_details(order)  # API CALL ##
+        except Exception as e:
+            log.print_status("WARNING: Could not get details of order {}. API Reason -> {}".format(order["orderId"], str(e)))
+            return dict(order, unresolved=True)
 
     def extract_available_qty(self, balances, asset_to_adjust):
         '''
@@ -307,16 +326,10 @@ class Trade():
 
         while True:
             try:
-                if self.exchange.name == "BINANCE" or self.exchange.name == "BINANCE.US":
-                    if self.trade["order_type"] == "buy":
-                        order = self.exchange.trade.order_limit_buy(symbol=self.trade["pair"], quantity=self.trade["qty"], price=self.trade["price"])  # API CALL ##
-                        break
-                    else:
-                        order = self.exchange.trade.order_limit_sell(symbol=self.trade["pair"], quantity=self.trade["qty"], price=self.trade["price"])  # API CALL ##
-                        break
-                elif self.exchange.name == "KUCOIN":
-                    order = self.exchange.trade.create_limit_order(self.trade["pair"], self.trade["order_type"], self.trade["qty"], self.trade["price"])  # API CALL ##
-                    break
+                submit_time = time.time()
+                order = self.exchange.adapter.place_limit_order(self.trade["pair"], self.trade["order_type"], self.trade["order_qty"], self.trade["price"])  # API CALL ##
+                ack_secs = time.time() - submit_time
+                break
             except Exception as e:
                 log.print_status("API RESPONSE ->" + str(e))
                 if not reduced_qty:
@@ -324,10 +337,10 @@ class Trade():
                     balances = self.exchange.get_balances()
 
                     if self.trade["order_type"] == "sell":
-                        asset_to_adjust = self.exchange.assets_info.loc[self.trade["pair"].replace("-", "")]["baseAsset"]
+                        asset_to_adjust = self.exchange.get_pair_info(self.trade["pair"])["baseAsset"]
                         self.trade["qty"] = self.extract_available_qty(balances, asset_to_adjust)
                     elif self.trade["order_type"] == "buy":
-                        asset_to_adjust = self.exchange.assets_info.loc[self.trade["pair"].replace("-", "")]["quoteAsset"]
+                        asset_to_adjust = self.exchange.get_pair_info(self.trade["pair"])["quoteAsset"]
                         self.trade["qty"] = self.extract_available_qty(balances, asset_to_adjust) / float(self.trade["price"])
 
                     if asset_to_adjust == parameters.TARGET_ASSET:
@@ -342,8 +355,8 @@ class Trade():
                     if adj_factor != 1:
                         self.trade["qty"] *= adj_factor
 
-                    adjusted_trade_qty_precision = int(self.exchange.assets_info.loc[self.trade["pair"].replace("-", "")]["baseQtyPrecision"])
-                    self.trade["qty"] = helper.round_decimals_down(float(self.trade["qty"]), adjusted_trade_qty_precision)
+                    self.set_qty_lots(self.get_lots(self.trade["qty"]))  # balances are the only float input, lotted once
+                    self.trade["order_qty"] = helper.format_ticks(self.trade["qty_lots"], self.qty_precision)
 
                     if self.trade["qty"] == 0:
                         return None  # nothing available in account, fail to execute limit trade
@@ -351,7 +364,7 @@ class Trade():
                     log.print_status("New trade qty: {}".format(self.trade["qty"]))
                     reduced_qty = True
                 else:
-                    if "Order size below the minimum requirement" in str(e):
+                    if self.exchange.adapter.is_below_min_size_error(e):
                         log.print_status("Order size below the minimum requirement. Continue with trade plan.")
                         # create artificial order to indicate to override order filled checking requiremnt
                         order = {}  # create dummy order to let program know to continue trade plan
@@ -365,6 +378,7 @@ class Trade():
 
         order = self.update_order_details(order)
         order["execution_time_secs"] = str(round(time.time() - start, 5))
+        order["ack_secs"] = ack_secs
 
         return order
 
@@ -406,18 +420,16 @@ class Trade():
         @Returns
         bool indicating 'True' if cancel order succeeded, 'False' otherwise.
         '''
+        start = time.time()
         try:
-            if self.exchange.name == "BINANCE.US" or self.exchange.name == "BINANCE":
-                if self.exchange.trade.cancel_order(symbol=order["pair"], orderId=order["order_id"])["orderId"] == order["orderId"]:
-                    log.print_status("MSG: Order canceled.")
-                    return True
-            elif self.exchange.name == "KUCOIN":
-                if self.exchange.trade.cancel_order(order["orderId"])["cancelledOrderIds"][0] == order["orderId"]:
-                    log.print_status("MSG: Order canceled.")
-                    return True
+            if self.exchange.adapter.cancel_order(order):  # API CALL ##
+                log.print_status("MSG: Order canceled.")
+                return True
         except Exception as e:
             log.print_status("MSG: Failed to cancel order. API Reason -> " + str(e))  # if failed to cancel order, then order most likely completed
             return False
+        finally:
+            order["cancel_secs"] = order.get("cancel_secs", 0) + time.time() - start
 
     def get_resulting_qty(self, order):
         '''
@@ -430,11 +442,12 @@ class Trade():
 
     def handle_order(self, order):
         '''
-        Handles incomplete orders, failures, and edge cases related to orders.
+        Handles incomplete orders, failures, and edge cases related to orders. Unfilled, remainder and available
+        quantities are tracked in integer qty lots.
         '''
         additional_orders = []
         partially_filled, override = False, False
-        remainder_qty = 0
+        remainder_lots = 0
 
         if order is None:  # case where reduction in qty from prior order handle failed
             log.print_status("MSG: Arbitrage trade lost. Returning to scanning...")
@@ -461,58 +474,57 @@ class Trade():
                 time.sleep(1)
                 #  if order["pending"]:  # added
                 if not self.cancel_trade(order):
-                    print("XXX:", remainder_qty)
                     order = self.update_order_details(order)
                     additional_orders.append(order)
                     resulting_qty += self.get_resulting_qty(order)  # save qty that actually executed after waiting 1 sec
-                    if remainder_qty == 0:
+                    if remainder_lots == 0:
                         log.print_status("Order completed while cancelling, and no remainder qty is left. Continuing with trade plan.")
                         return additional_orders, resulting_qty  # no additional trades needed, still continuing with trade plan
                     else:
-                        log.print_status("Order completed while cancelling, but remainder qty still exists ({} {})".format(remainder_qty, self.trade["pair"]))
-                        self.trade["qty"] = remainder_qty  # update quantity since there is more qty to fill
-                        if not helper.check_qty(self.exchange, self.trade, self.trade["pair"].replace("-", "")):
+                        self.set_qty_lots(remainder_lots)  # update quantity since there is more qty to fill
+                        log.print_status("Order completed while cancelling, but remainder qty still exists ({} {})".format(self.trade["qty"], self.trade["pair"]))
+                        if not helper.check_qty(self.exchange, self.trade, self.exchange.adapter.stripped_symbols[self.trade["pair"]]):
                             log.print_status("Remainder qty too low to execute (qty={}). Continuing with trade plan.".format(self.trade["qty"]))
                             return additional_orders, resulting_qty  # remainder qty too low to execute, continue with trade plan
 
                 if not override:
-                    self.trade["qty"] = order["original_qty"] - order["filled_qty"]  # get unfilled qty
+                    self.set_qty_lots(self.get_lots(order["original_qty"]) - self.get_filled_lots(order))  # get unfilled qty
 
-                base_asset = self.exchange.assets_info.loc[self.trade["pair"].replace("-", "")]["baseAsset"]
-                quote_asset = self.exchange.assets_info.loc[self.trade["pair"].replace("-", "")]["quoteAsset"]
+                pair_info = self.exchange.get_pair_info(self.trade["pair"])
+                base_asset, quote_asset = pair_info["baseAsset"], pair_info["quoteAsset"]
 
                 # update pair orderbook
                 new_pair_orderbook = market.get_pair_orderbook(self.exchange, base_asset, quote_asset)
                 # orderbook_depth = 0  # <- update later with optimal trade volume depth ......................................
-                self.trade["price"] = float(new_pair_orderbook[self.trade["side"] + "s"][self.orderbook_depth][0])
-                available_qty = float(new_pair_orderbook[self.trade["side"] + "s"][self.orderbook_depth][1])
+                self.trade["price_ticks"] = helper.to_ticks(float(new_pair_orderbook[self.trade["side"] + "s"][self.orderbook_depth][0]), self.price_precision, round_down=False)
+                available_lots = self.get_lots(new_pair_orderbook[self.trade["side"] + "s"][self.orderbook_depth][1])
+                trade_lots = self.trade["qty_lots"]
 
                 # get new trading qty, update remainder qty
-                if self.invalid_order_qty != available_qty:  # prevents infinite loop prior invalid order
-                    if self.trade["qty"] > available_qty:                   # not enough qty to fill full order
-                        remainder_qty += self.trade["qty"] - available_qty  # increase remainder qty by the qty that can't be filled now
-                        self.trade["qty"] = available_qty                   # set new trading qty to what is available to trade
-                        log.print_status("Not enough quantity to fill. Remainder qty = {}".format(remainder_qty))
+                if self.invalid_order_lots != available_lots:  # prevents infinite loop prior invalid order
+                    if trade_lots > available_lots:                   # not enough qty to fill full order
+                        remainder_lots += trade_lots - available_lots  # increase remainder qty by the qty that can't be filled now
+                        trade_lots = available_lots                    # set new trading qty to what is available to trade
+                        log.print_status("Not enough quantity to fill. Remainder qty = {}".format(helper.from_ticks(remainder_lots, self.qty_precision)))
                     else:
-                        if available_qty >= self.trade["qty"] + remainder_qty:  # can fill all of remainder qty + trade qty
-                            self.trade["qty"] += remainder_qty
-                            log.print_status("Can fully fill remainder qty + trade qty. Remainder qty set to 0.".format(remainder_qty))
-                            remainder_qty = 0
+                        if available_lots >= trade_lots + remainder_lots:  # can fill all of remainder qty + trade qty
+                            trade_lots += remainder_lots
+                            log.print_status("Can fully fill remainder qty + trade qty. Remainder qty set to 0.")
+                            remainder_lots = 0
                         else:                                              # can partially fill remainder qty + trade qty
-                            available_qty_diff = available_qty - self.trade["qty"]
-                            remainder_qty -= available_qty_diff
-                            self.trade["qty"] += available_qty_diff
-                            log.print_status("Can partially fill trade qty. Remainder qty = {}".format(remainder_qty))
+                            available_lots_diff = available_lots - trade_lots
+                            remainder_lots -= available_lots_diff
+                            trade_lots += available_lots_diff
+                            log.print_status("Can partially fill trade qty. Remainder qty = {}".format(helper.from_ticks(remainder_lots, self.qty_precision)))
 
                     # prep additional trade specs for execution
-                    print("A", remainder_qty)
+                    self.trade["qty_lots"] = trade_lots
                     self.trade = prep_trade(self.exchange, self.trade)
-                    print("B", remainder_qty)
 
                     if not self.trade["valid"]:
                         log.print_status("Invalid trade -> (likely) due to remainder qty being to low to execute.")
-                        self.invalid_order_qty = self.trade["qty"]
-                        if remainder_qty == 0:
+                        self.invalid_order_lots = self.trade["qty_lots"]
+                        if remainder_lots == 0:
                             log.print_status("Remainder qty is 0. Continuing with trade plan.")
                             return additional_orders, resulting_qty
                     else:
@@ -522,21 +534,17 @@ class Trade():
                         if order is None:
                             break
 
-                        print("C", remainder_qty)
-
                         resulting_qty += self.get_resulting_qty(order)
                         additional_orders.append(order)
-
-                        print("F", remainder_qty)
                 else:
                     log.print_status("Last order was invalid and same qty available. Incrementing orderbook depth to {}".format(self.orderbook_depth + 1))
                     self.orderbook_depth += 1
 
             else:  # order was fully filled
-                if remainder_qty > 0:  # if remainder still exist, fill remainder in new order override
+                if remainder_lots > 0:  # if remainder still exist, fill remainder in new order override
                     log.print_status("Filling remainder qty. Override set.")
-                    self.trade["qty"] = remainder_qty
-                    remainder_qty = 0
+                    self.set_qty_lots(remainder_lots)
+                    remainder_lots = 0
                     override = True
                 else:
                     break  # limit order completed, no remainder qty left
@@ -544,19 +552,131 @@ class Trade():
         return additional_orders, resulting_qty
 
 
-def prep_trade(exchange, trade, trade_set={}):
+    def handle_ioc_order(self, order):
+        '''
+        Handles immediate-or-cancel / fill-or-kill orders. The exchange cancels whatever did not fill before responding,
+        so zero-fill, partial and full outcomes are resolved straight from the order response with no sleeping or canceling.
+        Any remainder is sliced across the refreshed orderbook depth levels and sent immediately as one batch of orders.
+        Remainders and slices are tracked in integer qty lots.
+        '''
+        additional_orders = []
+
+        if order is None:  # case where reduction in qty from prior order handle failed
+            log.print_status("MSG: Arbitrage trade lost. Returning to scanning...")
+            self.arbitrage_lost = True
+            return additional_orders, self.trading_target_qty
+
+        resulting_qty = self.get_resulting_qty(order)
+
+        if order["filled_qty"] < 0:  # below min size dummy order, continue with trade plan
+            return additional_orders, resulting_qty
+
+        if self.trade_num == 0 and order["filled_qty"] == 0:
+            log.print_status("MSG: First {} order not filled. Arbitrage trade lost. Returning to scanning...".format(parameters.ORDER_TIME_IN_FORCE))
+            self.arbitrage_lost = True
+            return additional_orders, self.trading_target_qty
+
+        remainder_lots = self.get_lots(order["original_qty"]) - self.get_filled_lots(order)
+        stripped_symbol = self.exchange.adapter.stripped_symbols[self.trade["pair"]]
+        base_asset = self.exchange.assets_info.loc[stripped_symbol]["baseAsset"]
+        quote_asset = self.exchange.assets_info.loc[stripped_symbol]["quoteAsset"]
+        base_min_lots = self.get_lots(self.exchange.assets_info.loc[stripped_symbol]["baseMinQty"])
+
+        for i in range(parameters.IOC_MAX_RETRIES):
+            if remainder_lots <= 0:
+                break
+
+            self.set_qty_lots(remainder_lots)
+            if not helper.check_qty(self.exchange, self.trade, stripped_symbol):
+                log.print_status("Remainder qty too low to execute (qty={}). Continuing with trade plan.".format(self.trade["qty"]))
+                break
+
+            new_pair_orderbook = market.get_pair_orderbook(self.exchange, base_asset, quote_asset)
+            if new_pair_orderbook is None or len(new_pair_orderbook[self.trade["side"] + "s"]) == 0:
+                break
+
+            # slice the remainder across depth levels and send every slice in one batch
+            slices = []
+            slice_remainder_lots = remainder_lots
+            for offering in new_pair_orderbook[self.trade["side"] + "s"][self.orderbook_depth:]:
+                if slice_remainder_lots < base_min_lots or len(slices) == parameters.IOC_MAX_SLICES:
+                    break
+
+                price_ticks = helper.to_ticks(float(offering[0]), self.price_precision, round_down=False)
+                remainder_slice = prep_trade(self.exchange, dict(self.trade, price_ticks=price_ticks, qty_lots=min(slice_remainder_lots, self.get_lots(offering[1]))))
+                if remainder_slice["valid"]:
+                    slices.append((self.trade_num, remainder_slice))
+                    slice_remainder_lots -= remainder_slice["qty_lots"]
+
+            if len(slices) == 0:
+                log.print_status("Invalid trade -> (likely) due to remainder qty being to low to execute.")
+                break
+
+            for _, remainder_slice in slices:
+                log.print_status("TRADE + -> {} {} {} at price {} ({}/{})".format(remainder_slice["order_type"], remainder_slice["qty"], remainder_slice["pair"], remainder_slice["price"], i + 1, parameters.IOC_MAX_RETRIES))
+
+            start = time.time()
+            orders = [order for order in self.exchange.place_batch_orders(slices) if order is not None]
+            orders = [self.resolve_order_details(order) if order["unresolved"] else order for order in orders]  # one more try before giving up
+            for order in orders:
+                order["execution_time_secs"] = str(round(time.time() - start, 5))
+                order["ack_secs"] = time.time() - start  # the batch response is the ack
+                additional_orders.append(order)
+                resulting_qty += self.get_resulting_qty(order)
+                remainder_lots -= self.get_filled_lots(order)
+
+            if len(orders) == 0:
+                break
+
+            if any(order["unresolved"] for order in orders):
+                log.print_status("WARNING: Fill of a TRADE {} remainder order is unknown. No more remainders are sent for this leg.".format(self.trade_num))
+                break  # the remainder can't be sized, sending it again could overfill the leg
+
+            if sum(order["filled_qty"] for order in orders) == 0:
+                self.orderbook_depth += len(slices)  # sliced levels already taken, reach deeper
+
+        return additional_orders, resulting_qty
+
+
+def get_leg_orders(exchange, trade_template):
+    '''
+    @Returns
+    [(venue symbol, order type)] of the three legs of the arbitrage in 'trade_template' (see NOTES)
+    '''
+    base_asset = exchange.assets_info.loc[trade_template["pair"]]["baseAsset"]
+    quote_asset = exchange.assets_info.loc[trade_template["pair"]]["quoteAsset"]
+    target_asset = trade_template["target"]
+
+    if trade_template["best_direction"] == "forward":
+        return [(exchange.adapter.get_symbol(quote_asset, target_asset), "buy"),
+                (exchange.adapter.get_symbol(base_asset, quote_asset), "buy"),
+                (exchange.adapter.get_symbol(base_asset, target_asset), "sell")]
+
+    return [(exchange.adapter.get_symbol(base_asset, target_asset), "buy"),
+            (exchange.adapter.get_symbol(base_asset, quote_asset), "sell"),
+            (exchange.adapter.get_symbol(quote_asset, target_asset), "sell")]
+
+
+def get_lot_precisions(exchange, pair):
     '''
-    Preps trade specs for trade execution. Determines if trade is valid and conforms floats to required precisions.
+    @Returns
+    (qty precision, price precision) of venue symbol 'pair', the decimals of its qty lots and price ticks
     '''
-    stripped_symbol = trade["pair"].replace("-", "")
+    pair_info = exchange.get_pair_info(pair)
 
-    # change pair formatting for exchanges other than KUCOIN
-    if exchange.name == "BINANCE" or exchange.name == "BINANCE.US":
-        trade["pair"] = stripped_symbol
+    return int(pair_info["baseQtyPrecision"]), int(pair_info["basePricePrecision"])
 
-    # adhere to rounding / max decimal exchange requirements
-    base_qty_precision = int(exchange.assets_info.loc[stripped_symbol]["baseQtyPrecision"])
-    trade["qty"] = helper.round_decimals_down(trade["qty"], base_qty_precision)
+
+def prep_trade(exchange, trade, trade_set={}):
+    '''
+    Preps trade specs for trade execution from its integer 'qty_lots' and 'price_ticks'. Determines if trade is valid
+    and derives the float qty / price (for checks and records) and the exact order strings from them.
+    '''
+    stripped_symbol = exchange.adapter.stripped_symbols[trade["pair"]]
+    base_qty_precision, base_price_precision = get_lot_precisions(exchange, trade["pair"])
+    trade["qty_lots"], trade["price_ticks"] = int(trade["qty_lots"]), int(trade["price_ticks"])
+    trade["qty"] = helper.from_ticks(trade["qty_lots"], base_qty_precision)
+    trade["price"] = helper.from_ticks(trade["price_ticks"], base_price_precision)
 
     # check if notional value adheres to exchange rules and if quantity >= min and quantity <= max
     if helper.check_min_notional(exchange, trade, stripped_symbol) and helper.check_qty(exchange, trade, stripped_symbol):
@@ -564,9 +684,9 @@ def prep_trade(exchange, trade, trade_set={}):
     else:
         trade["valid"] = False
 
-    # convert all prices to string representation to avoid scientific notation issues when placing limit orders
-    base_price_precision = exchange.assets_info.loc[stripped_symbol]["basePricePrecision"]
-    trade["price"] = '{:0.0{}f}'.format(trade["price"], base_price_precision)
+    # exact string representations to avoid scientific notation issues when placing limit orders
+    trade["price"] = helper.format_ticks(trade["price_ticks"], base_price_precision)
+    trade["order_qty"] = helper.format_ticks(trade["qty_lots"], base_qty_precision)
 
     # save profit percent that indicates what profit is yielded after executing all three arbitrage trades
     try:
@@ -581,19 +701,25 @@ def compare_resulting_qty(exchange, t, actual_resulting_qty):
     '''
     Checks to see if the resulting qty is what was expected from the trading plan.
     @Returns
-    factor that is multiplied by the qty of the next trade to adjust it and align with what the actual resulting qty is
+    exact fraction that the qty lots of the next trade are multiplied by to align with what the actual resulting qty is
     '''
-    base_qty_precision = int(exchange.assets_info.loc[t.trade["pair"].replace("-", "")]["baseQtyPrecision"])
-    quote_qty_precision = int(exchange.assets_info.loc[t.trade["pair"].replace("-", "")]["quoteQtyPrecision"])
+    pair_info = exchange.get_pair_info(t.trade["pair"])
+    base_qty_precision, base_price_precision = get_lot_precisions(exchange, t.trade["pair"])
 
+    # compare in integer lots (buy -> base qty, sell -> quote qty) so float rounding never shows up as a difference
     if t.trade["order_type"] == "buy":
-        expected_resulting_qty = helper.round_decimals_down(t.orig_trade_qty, base_qty_precision)  # helps avoid small rounding miscompares
+        result_precision = base_qty_precision
+        expected_resulting_lots = t.orig_qty_lots
     else:
-        expected_resulting_qty = helper.round_decimals_down(t.orig_trade_qty * float(t.orig_trade_price), quote_qty_precision)  # helps avoid small rounding miscompares
+        result_precision = int(pair_info.get("quoteQtyPrecision", base_qty_precision + base_price_precision))  # exact notional if the venue has no quote increment
+        expected_resulting_lots = helper.multiply_ticks(t.orig_qty_lots, base_qty_precision, t.orig_price_ticks, base_price_precision, result_precision)
+
+    actual_resulting_lots = helper.to_ticks(actual_resulting_qty, result_precision)
+    expected_resulting_qty = helper.from_ticks(expected_resulting_lots, result_precision)
 
-    if actual_resulting_qty != expected_resulting_qty:
-        qty_reduction_factor = actual_resulting_qty / expected_resulting_qty
-        log.print_status("Unexpected result qty difference. Expected {} {} but received {} {} from last trade.\nAdjusting next trade qty by a factor of {}.".format(expected_resulting_qty, t.trade["pair"], actual_resulting_qty, t.trade["pair"], qty_reduction_factor))
+    if actual_resulting_lots != expected_resulting_lots and expected_resulting_lots > 0:
+        qty_reduction_factor = Fraction(actual_resulting_lots, expected_resulting_lots)
+        log.print_status("Unexpected result qty difference. Expected {} {} but received {} {} from last trade.\nAdjusting next trade qty by a factor of {}.".format(expected_resulting_qty, t.trade["pair"], actual_resulting_qty, t.trade["pair"], float(qty_reduction_factor)))
         return qty_reduction_factor
 
     return 1
@@ -613,18 +739,26 @@ def execute_trade_plan(exchange, trade_plan):
     qty_reduction_factor = 1
     for trade_num, trade in trade_plan.iterrows():
         if qty_reduction_factor != 1:
-            trade["qty"] *= qty_reduction_factor
-            base_qty_precision = int(exchange.assets_info.loc[trade["pair"].replace("-", "")]["baseQtyPrecision"])
-            trade["qty"] = helper.round_decimals_down(trade["qty"], base_qty_precision)
+            base_qty_precision = get_lot_precisions(exchange, trade["pair"])[0]
+            trade["qty_lots"] = int(int(trade["qty_lots"]) * qty_reduction_factor)  # exact, rounded down
+            trade["qty"] = helper.from_ticks(trade["qty_lots"], base_qty_precision)
+            trade["order_qty"] = helper.format_ticks(trade["qty_lots"], base_qty_precision)
 
         log.print_status("TRADE {} -> {} {} {} at price {}".format(trade_num, trade["order_type"], trade["qty"], trade["pair"], trade["price"]))
 
         t = Trade(exchange, trade, trade_num)
+        leg_start_time = time.time()
         order = t.execute_limit_trade()
         executed_orders.append(order)  # append initial order attempt
-        additional_orders, resulting_qty = t.handle_order(order)
+        if parameters.ORDER_TIME_IN_FORCE in ["IOC", "FOK"]:
+            additional_orders, resulting_qty = t.handle_ioc_order(order)
+        else:
+            additional_orders, resulting_qty = t.handle_order(order)
         executed_orders += additional_orders  # append any additional orders needed to complete trade (could be 0 additional trades)
 
+        if exchange.attribution is not None:
+            exchange.attribution.record_leg(trade_num, trade_plan.loc[trade_num], t.orig_trade_qty, [order] + additional_orders, leg_start_time)
+
         if t.arbitrage_lost:
             raw_profit = {}
             raw_profit["scan_id"] = trade_plan["scan_id"][0]
@@ -650,6 +784,76 @@ def execute_trade_plan(exchange, trade_plan):
     return pd.DataFrame(executed_orders), raw_profit
 
 
+def execute_trade_plan_simultaneous(exchange, trade_plan):
+    '''
+    Sends all three legs of the trading plan at the same moment using pre-positioned inventory of the intermediate assets.
+    Unfilled leg remainders are canceled rather than chased, and the difference is tracked as inventory drift.
+    Falls back to sequential execution if held inventory does not cover every leg.
+    Returns dataframe of executed orders.
+    '''
+    with exchange.inventory_lock:  # keep rebalance bookkeeping from interleaving with the legs being booked
+        if not exchange.has_leg_inventory(trade_plan):
+            log.print_status("MSG: Falling back to sequential execution.")
+            return execute_trade_plan(exchange, trade_plan)
+
+        log.print_status("\nARBITRAGE AVAILABLE! (simultaneous)\nBEG BAL -> {} {}".format(exchange.trading_target_qty, parameters.TARGET_ASSET))
+
+        trades = [Trade(exchange, trade, trade_num) for trade_num, trade in trade_plan.iterrows()]
+        for t in trades:
+            log.print_status("TRADE {} -> {} {} {} at price {}".format(t.trade_num, t.trade["order_type"], t.trade["qty"], t.trade["pair"], t.trade["price"]))
+
+        start = time.time()
+        orders = exchange.place_batch_orders([(t.trade_num, t.trade) for t in trades])  # all legs go out together
+        ack_secs = time.time() - start
+        execution_time_secs = str(round(ack_secs, 5))
+
+        cancel_start = time.time()
+        canceled = exchange.cancel_batch_orders(orders)  # no chasing, unfilled remainders show up as inventory drift
+        cancel_secs = time.time() - cancel_start
+        # legs still open at placement may have filled since, whether or not they were canceled (most likely they completed)
+        orders = [t.resolve_order_details(order) if order is not None and order["pending"] else order for t, order in zip(trades, orders)]
+
+        executed_orders = []
+        target_qty_delta = 0
+        for t, order in zip(trades, orders):
+            if order is None:
+                order = {"scan_id": t.trade["scan_id"], "trade_num": t.trade_num, "pair": t.trade["pair"], "order_type": t.trade["order_type"],
+                         "filled_qty": 0, "original_qty": t.trade["qty"], "result_qty": 0}
+            order["execution_time_secs"] = execution_time_secs
+            order["ack_secs"] = ack_secs
+            order["cancel_secs"] = cancel_secs if order.get("orderId") in canceled else 0
+            if order.get("unresolved", False):
+                log.print_status("WARNING: Fill of TRADE {} is unknown. Booked as unfilled until the rebalancer syncs inventory with balances.".format(t.trade_num))
+
+            if exchange.attribution is not None:
+                exchange.attribution.record_leg(t.trade_num, trade_plan.loc[t.trade_num], t.orig_trade_qty, [order], start)
+
+            order["leg_drift_qty"] = exchange.record_inventory_drift(t.trade, order)
+            executed_orders.append(order)
+
+            # only legs quoted in the target asset change the target balance
+            spend_asset, receive_asset = exchange.get_leg_assets(t.trade)
+            if spend_asset == exchange.target_asset:
+                target_qty_delta -= order["result_qty"]
+            elif receive_asset == exchange.target_asset:
+                target_qty_delta += order["result_qty"]
+
+    raw_profit = {}
+    raw_profit["scan_id"] = trade_plan["scan_id"][0]
+    raw_profit["starting_qty"] = exchange.trading_target_qty
+    raw_profit["ending_qty"] = exchange.trading_target_qty + target_qty_delta
+    raw_profit["profit"] = target_qty_delta
+    raw_profit["asset"] = parameters.TARGET_ASSET
+
+    log.print_status("==============================\nEND BAL -> {} {}".format(round(raw_profit["ending_qty"], 5), parameters.TARGET_ASSET))
+    log.print_status("PROFIT  -> {} {}".format(round(raw_profit["profit"], 5), parameters.TARGET_ASSET))
+    log.print_status("DRIFT   -> {}".format({asset: round(drift, 8) for asset, drift in exchange.inventory_drift.items()}))
+
+    exchange.rebalance_event.set()  # let the background rebalancer top inventory back up
+
+    return pd.DataFrame(executed_orders), raw_profit
+
+
 # TODO ## <- revise this
 # def rebalance_portfolio(exchange, original_total_account_value, target_stop_loss_percent):
 #     '''